@@ -0,0 +1,456 @@
+"""Índice aproximado de vizinhos mais próximos (IVF-flat) em NumPy.
+
+Os vetores são agrupados em ``nlist`` listas por k-means esférico; uma busca
+compara a consulta só com os centróides e com os vetores das ``nprobe`` listas
+mais próximas, o que a torna sublinear no tamanho do índice.
+
+Layout:
+
+- parte principal: vetores ordenados por lista (cada lista é uma fatia
+  contígua), carregável com ``mmap`` a partir do disco;
+- delta: inserções feitas desde a última compactação, buscadas exatamente;
+- remoções marcam os vetores como mortos; ``compact()`` (chamado por
+  ``save()`` ou quando o delta cresce) reconstrói o layout sem eles, copiando
+  em blocos (com a parte principal em mmap, para um novo arquivo no disco).
+
+Cada vetor pertence a um usuário (``None`` = conhecimento global) e as buscas
+podem ser filtradas por usuário; as posições de cada usuário na parte principal
+ficam num índice invertido (posições ordenadas por usuário), então o filtro não
+varre todos os vetores.
+
+``save()`` grava arquivos novos (nomes com uma geração) e troca ``meta.json``
+atomicamente com ``os.replace``: uma queda no meio deixa o índice anterior
+intacto, e um processo com os vetores antigos em mmap não os vê reescritos.
+"""
+import json
+import os
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_ANY_USER = object()
+GLOBAL_USER_CODE = 0  # vetores sem usuário (base de conhecimento)
+MIN_POINTS_PER_LIST = 4  # abaixo disso o índice não treina e busca exatamente
+TRAINING_POINTS_PER_LIST = 64  # tamanho da amostra do k-means por lista
+COPY_CHUNK_ROWS = 65536  # vetores copiados por vez na compactação
+_ARRAYS = ("vectors", "ids", "users", "offsets", "centroids", "delta_vectors", "delta_ids", "delta_users")
+
+
+class IVFIndex:
+    """Índice IVF-flat com inserção, remoção, filtro por usuário e persistência"""
+
+    def __init__(self, dim: int, nlist: int = 256, nprobe: int = 8, max_delta: int = 20000,
+                 exact_user_limit: int = 4096):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.max_delta = max_delta
+        # Usuários com até esse número de vetores são buscados exatamente: as
+        # lembranças de um usuário se espalham por muitas listas e sondar poucas
+        # delas perderia vizinhos
+        self.exact_user_limit = exact_user_limit
+
+        self.centroids: Optional[np.ndarray] = None  # (nlist, dim); None até treinar
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._users = np.empty(0, dtype=np.int32)
+        self._offsets = np.zeros(nlist + 1, dtype=np.int64)
+        self._alive = np.empty(0, dtype=bool)
+        # Índice invertido por usuário: posições da parte principal ordenadas por usuário
+        self._user_order = np.empty(0, dtype=np.int64)
+        self._sorted_users = np.empty(0, dtype=np.int32)
+
+        self._delta_vectors = np.empty((0, dim), dtype=np.float32)
+        self._delta_ids = np.empty(0, dtype=np.int64)
+        self._delta_users = np.empty(0, dtype=np.int32)
+        self._delta_size = 0
+
+        self._user_codes: Dict[str, int] = {}
+        self.max_id = 0  # maior id já indexado (marca d'água para alcançar o banco ao carregar)
+        self._mmap_dir: Optional[str] = None  # diretório dos vetores em mmap (compactação grava lá)
+        self._unsaved_file: Optional[str] = None  # vetores compactados ainda não referenciados por meta.json
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return int(self._alive.sum()) + self._delta_size
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    # ========== CONSTRUÇÃO ==========
+
+    @staticmethod
+    def _kmeans(sample: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+        """k-means esférico (vetores normalizados, similaridade de cosseno)"""
+        rng = np.random.default_rng(seed)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = IVFIndex._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=nlist) == 0
+            # Listas vazias recebem pontos aleatórios da amostra
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        return centroids
+
+    def build(self, ids, vectors: np.ndarray, user_ids: List[Optional[str]]):
+        """Treina os centróides e indexa tudo de uma vez (descarta o conteúdo anterior)"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            self._delta_size = 0
+            self._train_and_index(ids, vectors, self._encode_users(user_ids))
+            self.max_id = int(ids.max()) if len(ids) else 0
+
+    def _train_and_index(self, ids: np.ndarray, vectors: np.ndarray, users: np.ndarray):
+        self.nlist = max(1, min(self.nlist, len(ids)))
+        sample_size = min(len(ids), self.nlist * TRAINING_POINTS_PER_LIST)
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(ids), sample_size, replace=False)] if sample_size < len(ids) else vectors
+        self.centroids = self._kmeans(sample, self.nlist)
+        self._rebuild(vectors, ids, users)
+
+    def _rebuild(self, vectors: np.ndarray, ids: np.ndarray, users: np.ndarray):
+        """Reordena os vetores por lista (cada lista vira uma fatia contígua)"""
+        assignment = self._assign(vectors, self.centroids) if len(vectors) else np.empty(0, dtype=np.int64)
+        order = np.argsort(assignment, kind="stable")
+        self._vectors = np.ascontiguousarray(vectors[order])
+        self._ids = ids[order]
+        self._users = users[order]
+        self._alive = np.ones(len(order), dtype=bool)
+        counts = np.bincount(assignment, minlength=self.nlist)
+        self._offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._index_users()
+
+    def _index_users(self):
+        """Refaz o índice invertido por usuário (a parte principal só muda ao compactar)"""
+        self._user_order = np.argsort(self._users, kind="stable").astype(np.int64)
+        self._sorted_users = self._users[self._user_order]
+
+    def _user_positions(self, user_code: int) -> np.ndarray:
+        """Posições na parte principal dos vetores do usuário (O(log n) + tamanho do usuário)"""
+        # Mesmo dtype do array: senão o searchsorted converte os n usuários a cada busca
+        bounds = np.array([user_code, user_code + 1], dtype=self._sorted_users.dtype)
+        start, end = np.searchsorted(self._sorted_users, bounds)
+        return self._user_order[start:end]
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        """Lista mais próxima de cada vetor, em blocos para limitar a memória"""
+        return np.concatenate([
+            np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), chunk)
+        ]) if len(vectors) else np.empty(0, dtype=np.int64)
+
+    # ========== ATUALIZAÇÃO INCREMENTAL ==========
+
+    def add(self, ids, vectors: np.ndarray, user_id: Optional[str] = None):
+        """Insere vetores (de um mesmo usuário) no delta; compacta quando ele cresce demais"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        with self._lock:
+            size = self._delta_size
+            needed = size + len(ids)
+            if needed > len(self._delta_ids):
+                capacity = max(needed, len(self._delta_ids) * 2, 1024)
+                self._delta_vectors = _grow(self._delta_vectors, capacity, size)
+                self._delta_ids = _grow(self._delta_ids, capacity, size)
+                self._delta_users = _grow(self._delta_users, capacity, size)
+            self._delta_vectors[size:needed] = vectors
+            self._delta_ids[size:needed] = ids
+            self._delta_users[size:needed] = self._user_code(user_id)
+            self._delta_size = needed
+            if len(ids):
+                self.max_id = max(self.max_id, int(ids.max()))
+
+            if self._delta_size > max(self.max_delta, len(self._ids) // 10):
+                self.compact()
+
+    def remove(self, ids) -> int:
+        """Remove vetores pelos ids; retorna quantos foram encontrados"""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if len(ids) == 0:
+            return 0
+        with self._lock:
+            main_hits = np.isin(self._ids, ids) & self._alive
+            self._alive[main_hits] = False
+
+            delta_ids = self._delta_ids[:self._delta_size]
+            keep = ~np.isin(delta_ids, ids)
+            removed_delta = self._delta_size - int(keep.sum())
+            if removed_delta:
+                kept = int(keep.sum())
+                self._delta_vectors[:kept] = self._delta_vectors[:self._delta_size][keep]
+                self._delta_ids[:kept] = delta_ids[keep]
+                self._delta_users[:kept] = self._delta_users[:self._delta_size][keep]
+                self._delta_size = kept
+            return int(main_hits.sum()) + removed_delta
+
+    def compact(self):
+        """Incorpora o delta à parte principal e descarta os vetores removidos.
+
+        Treina os centróides na primeira compactação com dados suficientes.
+        """
+        with self._lock:
+            if self.trained:
+                self._merge_delta()
+                return
+            size = self._delta_size
+            vectors = np.concatenate([self._vectors[self._alive], self._delta_vectors[:size]])
+            ids = np.concatenate([self._ids[self._alive], self._delta_ids[:size]])
+            users = np.concatenate([self._users[self._alive], self._delta_users[:size]])
+            self._delta_size = 0
+            if len(ids) >= self.nlist * MIN_POINTS_PER_LIST:
+                self._train_and_index(ids, vectors, users)
+            else:
+                # Poucos dados para treinar: tudo continua no delta (busca exata)
+                self._delta_vectors, self._delta_ids, self._delta_users = vectors, ids, users
+                self._delta_size = len(ids)
+                self._vectors = np.empty((0, self.dim), dtype=np.float32)
+                self._ids = np.empty(0, dtype=np.int64)
+                self._users = np.empty(0, dtype=np.int32)
+                self._alive = np.empty(0, dtype=bool)
+                self._index_users()
+
+    def _merge_delta(self):
+        """Compacta um índice treinado sem materializar a parte principal.
+
+        A lista de cada vetor vivo da parte principal sai de ``_offsets`` (sem
+        recalcular) e a do delta, dos centróides; os vetores são copiados em
+        blocos de ``COPY_CHUNK_ROWS`` para o novo layout, que vai para um arquivo
+        novo quando a parte principal está em mmap.
+        """
+        if self._delta_size == 0 and self._alive.all():
+            return
+        size = self._delta_size
+        keep = np.flatnonzero(self._alive)
+        main_lists = np.repeat(np.arange(self.nlist), np.diff(self._offsets))[keep]
+        delta_lists = self._assign(self._delta_vectors[:size], self.centroids)
+        order = np.argsort(np.concatenate([main_lists, delta_lists]), kind="stable")
+
+        vectors = self._new_vectors(len(order))
+        for start in range(0, len(order), COPY_CHUNK_ROWS):
+            part = order[start:start + COPY_CHUNK_ROWS]
+            from_main = part < len(keep)
+            block = np.empty((len(part), self.dim), dtype=np.float32)
+            # Posições crescentes dentro de cada lista: leitura sequencial do mmap
+            block[from_main] = self._vectors[keep[part[from_main]]]
+            block[~from_main] = self._delta_vectors[part[~from_main] - len(keep)]
+            vectors[start:start + len(part)] = block
+        if isinstance(vectors, np.memmap):
+            vectors.flush()
+
+        self._ids = np.concatenate([self._ids[keep], self._delta_ids[:size]])[order]
+        self._users = np.concatenate([self._users[keep], self._delta_users[:size]])[order]
+        counts = np.bincount(np.concatenate([main_lists, delta_lists]), minlength=self.nlist)
+        self._offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._alive = np.ones(len(order), dtype=bool)
+        self._delta_size = 0
+        self._replace_vectors(vectors)
+        self._index_users()
+
+    def _new_vectors(self, rows: int) -> np.ndarray:
+        """Destino da compactação: arquivo novo no diretório do mmap, ou memória"""
+        if self._mmap_dir is None or rows == 0:
+            return np.empty((rows, self.dim), dtype=np.float32)
+        filename = os.path.join(self._mmap_dir, f"vectors.{uuid.uuid4().hex}.npy")
+        return np.lib.format.open_memmap(filename, mode="w+", dtype=np.float32, shape=(rows, self.dim))
+
+    def _replace_vectors(self, vectors: np.ndarray):
+        """Troca a parte principal; apaga o arquivo compactado anterior que nenhum meta.json cita"""
+        previous = self._unsaved_file
+        self._vectors = vectors
+        self._unsaved_file = vectors.filename if isinstance(vectors, np.memmap) else None
+        if previous is not None:
+            os.remove(previous)
+
+    # ========== BUSCA ==========
+
+    def search(self, query: np.ndarray, k: int = 10, user_id=_ANY_USER,
+               nprobe: int = None) -> List[Tuple[float, int]]:
+        """Os ``k`` vizinhos aproximados de ``query`` como (similaridade, id).
+
+        Com ``user_id`` (``None`` = conhecimento global) só vetores desse usuário
+        entram: usuários pequenos são comparados com todos os seus vetores; nos
+        demais, se as listas sondadas não tiverem ``k`` deles, a sondagem é ampliada.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            user_code = None
+            if user_id is not _ANY_USER:
+                user_code = self._user_codes.get(user_id) if user_id is not None else GLOBAL_USER_CODE
+                if user_code is None:
+                    return []
+
+            scores, ids = self._search_delta(query, user_code)
+            positions = None
+            if user_code is not None and len(self._ids):
+                positions = self._user_positions(user_code)
+                if len(positions) > self.exact_user_limit:
+                    positions = None
+                else:
+                    positions = positions[self._alive[positions]]
+            if positions is not None:
+                scores = np.concatenate([scores, self._vectors[positions] @ query])
+                ids = np.concatenate([ids, self._ids[positions]])
+            elif self.trained and len(self._ids):
+                nprobe = min(nprobe or self.nprobe, self.nlist)
+                centroid_order = np.argsort(-(self.centroids @ query))
+                probed = 0
+                main_scores, main_ids = [], []
+                found = 0
+                while probed < self.nlist:
+                    batch = centroid_order[probed:nprobe]
+                    for centroid in batch:
+                        start, end = self._offsets[centroid], self._offsets[centroid + 1]
+                        if start == end:
+                            continue
+                        mask = self._alive[start:end]
+                        if user_code is not None:
+                            mask = mask & (self._users[start:end] == user_code)
+                        if not mask.any():
+                            continue
+                        main_scores.append(self._vectors[start:end][mask] @ query)
+                        main_ids.append(self._ids[start:end][mask])
+                        found += int(mask.sum())
+                    probed = nprobe
+                    if found >= k or user_code is None:
+                        break
+                    nprobe = min(nprobe * 4, self.nlist)
+                if main_scores:
+                    scores = np.concatenate([scores] + main_scores)
+                    ids = np.concatenate([ids] + main_ids)
+
+        if len(scores) == 0:
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), int(ids[i])) for i in top]
+
+    def _search_delta(self, query: np.ndarray, user_code: Optional[int]):
+        size = self._delta_size
+        if size == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        vectors, ids = self._delta_vectors[:size], self._delta_ids[:size]
+        if user_code is not None:
+            mask = self._delta_users[:size] == user_code
+            vectors, ids = vectors[mask], ids[mask]
+        return vectors @ query, ids
+
+    # ========== USUÁRIOS ==========
+
+    def _user_code(self, user_id: Optional[str]) -> int:
+        if user_id is None:
+            return GLOBAL_USER_CODE
+        code = self._user_codes.get(user_id)
+        if code is None:
+            code = len(self._user_codes) + 1
+            self._user_codes[user_id] = code
+        return code
+
+    def _encode_users(self, user_ids: List[Optional[str]]) -> np.ndarray:
+        return np.fromiter((self._user_code(user_id) for user_id in user_ids), dtype=np.int32, count=len(user_ids))
+
+    # ========== PERSISTÊNCIA ==========
+
+    def save(self, path: str):
+        """Compacta e grava o índice em ``path`` (diretório com arquivos .npy).
+
+        Os arquivos ganham uma geração nova e ``meta.json`` só aponta para eles
+        depois de gravados (``os.replace``); em seguida os da geração anterior
+        são apagados. Vetores já em mmap nesse diretório não são regravados.
+        """
+        with self._lock:
+            self.compact()
+            os.makedirs(path, exist_ok=True)
+            generation = uuid.uuid4().hex
+            files = {}
+
+            def write(name: str, array: np.ndarray):
+                files[name] = f"{name}.{generation}.npy"
+                with open(os.path.join(path, files[name]), "wb") as f:
+                    np.save(f, array)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            if isinstance(self._vectors, np.memmap) and \
+                    os.path.dirname(os.path.abspath(self._vectors.filename)) == os.path.abspath(path):
+                files["vectors"] = os.path.basename(self._vectors.filename)
+            else:
+                write("vectors", self._vectors)
+            write("ids", self._ids)
+            write("users", self._users)
+            write("offsets", self._offsets)
+            if self.trained:
+                write("centroids", self.centroids)
+            if self._delta_size:
+                write("delta_vectors", self._delta_vectors[:self._delta_size])
+                write("delta_ids", self._delta_ids[:self._delta_size])
+                write("delta_users", self._delta_users[:self._delta_size])
+
+            meta_path = os.path.join(path, "meta.json")
+            with open(meta_path + ".tmp", "w") as f:
+                json.dump({"dim": self.dim, "nlist": self.nlist, "nprobe": self.nprobe,
+                           "max_delta": self.max_delta, "exact_user_limit": self.exact_user_limit,
+                           "trained": self.trained, "max_id": self.max_id,
+                           "delta_size": self._delta_size, "user_codes": self._user_codes,
+                           "files": files}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(meta_path + ".tmp", meta_path)
+            if self._unsaved_file is not None and \
+                    os.path.basename(self._unsaved_file) == files["vectors"]:
+                self._unsaved_file = None
+
+            # Gerações anteriores (e o formato sem geração); quem as tem em mmap continua lendo
+            current = set(files.values())
+            for name in os.listdir(path):
+                if name.endswith(".npy") and name.split(".")[0] in _ARRAYS and name not in current:
+                    if os.path.join(path, name) != self._unsaved_file:
+                        os.remove(os.path.join(path, name))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "IVFIndex":
+        """Carrega um índice salvo; com ``mmap`` os vetores são lidos do disco sob demanda"""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        # Índices salvos antes das gerações: arquivos sem sufixo
+        files = meta.get("files") or {name: f"{name}.npy" for name in _ARRAYS}
+
+        def read(name: str, mmap_mode: str = None) -> np.ndarray:
+            return np.load(os.path.join(path, files[name]), mmap_mode=mmap_mode)
+
+        index = cls(meta["dim"], meta["nlist"], meta["nprobe"], meta["max_delta"], meta["exact_user_limit"])
+        index._vectors = read("vectors", "r" if mmap else None)
+        index._ids = read("ids")
+        index._users = read("users")
+        index._offsets = read("offsets")
+        index._alive = np.ones(len(index._ids), dtype=bool)
+        index._index_users()
+        if mmap:
+            index._mmap_dir = path
+        if meta["trained"]:
+            index.centroids = read("centroids")
+        if meta["delta_size"]:
+            index._delta_vectors = read("delta_vectors")
+            index._delta_ids = read("delta_ids")
+            index._delta_users = read("delta_users")
+            index._delta_size = meta["delta_size"]
+        index._user_codes = meta["user_codes"]
+        # Índices salvos antes da marca d'água: o maior id presente
+        index.max_id = meta.get("max_id") or int(max(index._ids.max(initial=0),
+                                                     index._delta_ids[:index._delta_size].max(initial=0)))
+        return index
+
+
+def _grow(array: np.ndarray, capacity: int, size: int) -> np.ndarray:
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:size] = array[:size]
+    return grown
@@ -0,0 +1,533 @@
+import asyncio
+from datetime import datetime
+import json
+import time
+from typing import AsyncIterator, Dict, Iterable, List
+import openai
+from dotenv import load_dotenv
+
+from cache import AsyncCachedRepository
+from consolidation import EXTRACT, SUMMARIZE, ConsolidationWorker
+from context_builder import ContextBuilder, TokenCounter
+from db import DatabaseConfig
+import instrumentation
+from llm_cache import CHAT, DEFAULT_PURPOSES, ROLLUP, LLMCache
+from memory import ERROR_RESPONSE, STREAM_CALLER, _chunk_text, _extraction_prompt, _parse_extraction
+from extraction_scheduler import ExtractionScheduler
+from prompt import (CHAT_SYSTEM_MESSAGE, get_create_system_message, get_extract_system_message,
+                    get_rollup_system_message, get_user_profile_message)
+from async_repository import AsyncMemoryRepository
+from repository import MemoryRepository
+from retention import RetentionJob
+from semantic import MESSAGE, SUMMARY, AsyncSemanticRepository, SemanticMemory, format_memory
+from short_term import ShortTermMemory
+
+_ = load_dotenv()  # força a execução
+
+class AsyncDBMemoryAgent:
+    """Versão assíncrona do DBMemoryAgent (AsyncOpenAI + SQLAlchemy async).
+
+    Nenhuma chamada bloqueia o event loop, então vários usuários podem ser
+    atendidos de forma concorrente no mesmo processo.
+    """
+
+    def __init__(self, model: str = "gpt-3.5-turbo", short_term_limit: int = 10,
+                 max_tokens: int = 4000, database_url: str = "sqlite:///memory.db",
+                 max_resident_users: int = 1000, cache_ttl: float = 300.0,
+                 semantic_memory: bool = False,
+                 semantic_index_path: str = None):
+        # Configuração OpenAI
+        self.client = openai.AsyncOpenAI()
+        self.model = model
+        self.max_tokens = max_tokens
+
+        # Gerenciador de banco de dados
+        self.db = DatabaseConfig(database_url)
+        self.repository = AsyncMemoryRepository(self.db)
+        # Cache de perfis, resumos e conhecimento na frente do banco (cache_ttl=0 desativa)
+        if cache_ttl:
+            self.repository = AsyncCachedRepository(self.repository, ttl=cache_ttl)
+
+        # Memória de Curto Prazo - reidratada de forma assíncrona em _ensure_resident
+        self.conversation_history = ShortTermMemory(
+            per_user_limit=short_term_limit,
+            max_resident_users=max_resident_users
+        )
+
+        # Memória semântica opcional; a busca por similaridade é CPU (NumPy) e usa
+        # um repositório síncrono, então roda em threads via asyncio.to_thread
+        self.semantic_memory = SemanticMemory(
+            MemoryRepository(self.db), max_resident_users=max_resident_users, index_path=semantic_index_path
+        ) if semantic_memory else None
+        if self.semantic_memory is not None:
+            # Escritas na base de conhecimento atualizam os vetores na hora
+            self.repository = AsyncSemanticRepository(self.repository, self.semantic_memory)
+
+        # Configurações de consolidação
+        self.consolidation_threshold = 5  # Número de mensagens para consolidar
+        self.summary_trigger = 15  # Mensagens novas (desde o último resumo) para criar resumo
+        self.summary_batch_limit = 40  # Máximo de mensagens por resumo incremental
+        self.summary_rollup_fanout = 3  # Resumos de um mesmo nível que geram um resumo de resumos
+        self.summary_context_limit = 6  # Resumos incluídos no contexto de cada resposta
+        self.max_messages_per_user = 100  # Limite de mensagens por usuário no BD
+
+        # Worker opcional de consolidação em segundo plano (ver attach_consolidation_worker)
+        self.consolidation_worker = None
+
+        # Job opcional de retenção; substitui a limpeza por usuário em add_message (ver attach_retention_job)
+        self.retention_job = None
+
+        # Cache opcional de respostas do LLM (ver attach_llm_cache)
+        self.llm_cache = None
+
+        # Agendador opcional da extração; substitui o gatilho fixo (ver attach_extraction_scheduler)
+        self.extraction_scheduler = None
+
+    async def _ensure_resident(self, user_id: str):
+        """Carrega a memória de curto prazo do usuário a partir do banco, se necessário"""
+        if user_id in self.conversation_history:
+            return
+        messages = await self.repository.get_recent_messages(
+            user_id, limit=self.conversation_history.per_user_limit
+        )
+        # Outra corrotina pode ter carregado o usuário durante o await
+        if user_id not in self.conversation_history:
+            self.conversation_history.load(user_id, messages)
+
+    async def add_message(self, user_id: str, role: str, content: str, metadata: Dict = None,
+                          consolidate: bool = True) -> Dict:
+        """Adiciona uma mensagem à memória de curto prazo e ao banco (ver DBMemoryAgent.add_message)"""
+        message = {
+            "role": role,
+            "content": content,
+            "timestamp": datetime.now(),
+            "user_id": user_id,
+            "metadata": metadata or {}
+        }
+
+        # Adiciona à memória de curto prazo
+        await self._ensure_resident(user_id)
+        self.conversation_history.append(user_id, message)
+
+        # Persiste no banco de dados (uma transação; devolve os contadores do usuário)
+        counters = await self.repository.add_message(user_id, role, content, metadata)
+
+        if self.semantic_memory is not None:
+            await asyncio.to_thread(self.semantic_memory.remember, user_id, MESSAGE, content,
+                                    counters["message_id"])
+
+        if self.extraction_scheduler is not None:
+            self.extraction_scheduler.observe(user_id, role, content)
+
+        if consolidate:
+            await self._check_triggers(user_id, counters)
+        return counters
+
+    async def _check_triggers(self, user_id: str, counters: Dict):
+        """Dispara extração, resumo e limpeza conforme os contadores do usuário"""
+        # Verifica se precisa consolidar conhecimento
+        if self.extraction_scheduler is not None:
+            # Sem a tarefa em segundo plano, os lotes devidos são extraídos aqui
+            if not self.extraction_scheduler.started and self.extraction_scheduler.due():
+                try:
+                    await self.extraction_scheduler.run_once_async()
+                except Exception as e:
+                    print(f" Error extracting information: {str(e)}")
+        else:
+            # O usuário pode ter sido expulso da LRU desde add_message
+            await self._ensure_resident(user_id)
+            if self.conversation_history.count(user_id) >= self.consolidation_threshold:
+                await self._schedule_consolidation(EXTRACT, user_id)
+
+        # Cria resumo quando acumular mensagens suficientes desde o último resumo
+        if counters["unsummarized_count"] >= self.summary_trigger:
+            await self._schedule_consolidation(SUMMARIZE, user_id)
+
+        # Limpa mensagens antigas se necessário
+        if self.retention_job is None and counters["message_count"] > self.max_messages_per_user:
+            deleted = await self.repository.cleanup_old_messages(user_id, keep_last=self.max_messages_per_user // 2)
+            instrumentation.inc("memory_messages_cleaned_total", deleted, source="agent")
+            print(f"🗑️ Removed {deleted} old messages for user {user_id}")
+
+    def attach_consolidation_worker(self, queue=None, concurrency: int = 2,
+                                    max_retries: int = 3) -> ConsolidationWorker:
+        """Move extração e resumos para um worker em segundo plano (ver DBMemoryAgent)"""
+        self.consolidation_worker = ConsolidationWorker(
+            handlers={EXTRACT: self._extract_user_information, SUMMARIZE: self._summarize_conversation},
+            queue=queue,
+            concurrency=concurrency,
+            max_retries=max_retries
+        )
+        return self.consolidation_worker
+
+    def attach_retention_job(self, max_age_days: float = None, archive_dir: str = None,
+                             max_rows_per_second: float = None) -> RetentionJob:
+        """Move a limpeza de mensagens antigas para um job global (ver DBMemoryAgent).
+
+        O job usa um repositório síncrono e roda em thread; inicie com ``await job.start(interval)``.
+        """
+        self.retention_job = RetentionJob(
+            MemoryRepository(self.db),
+            max_messages_per_user=self.max_messages_per_user,
+            max_age_days=max_age_days,
+            archive_dir=archive_dir,
+            max_rows_per_second=max_rows_per_second
+        )
+        return self.retention_job
+
+    def attach_llm_cache(self, ttl: float = 7 * 24 * 3600, max_entries: int = 10000,
+                         purposes: Iterable[str] = DEFAULT_PURPOSES, semantic_purposes: Iterable[str] = (),
+                         semantic_threshold: float = 0.95) -> LLMCache:
+        """Cache de respostas do LLM no banco (ver DBMemoryAgent); usa um repositório síncrono em thread"""
+        self.llm_cache = LLMCache(
+            MemoryRepository(self.db),
+            ttl=ttl,
+            max_entries=max_entries,
+            purposes=purposes,
+            semantic_purposes=semantic_purposes,
+            semantic_threshold=semantic_threshold
+        )
+        return self.llm_cache
+
+    def attach_extraction_scheduler(self, gain_threshold: float = 1.0, batch_size: int = 8,
+                                    max_batch_delay: float = 30.0, max_pending: int = 50,
+                                    max_staleness: float = 3600.0) -> ExtractionScheduler:
+        """Extração guiada pelo ganho de informação, em lotes (ver DBMemoryAgent)"""
+        self.extraction_scheduler = ExtractionScheduler(
+            self._extract_batch,
+            gain_threshold=gain_threshold,
+            batch_size=batch_size,
+            max_batch_delay=max_batch_delay,
+            max_pending=max_pending,
+            max_staleness=max_staleness,
+            max_users=self.conversation_history.max_resident_users
+        )
+        return self.extraction_scheduler
+
+    async def _chat_completion(self, purpose: str = CHAT, **kwargs):
+        """Única porta de chamada ao LLM (cache de respostas e ponto de instrumentação)"""
+        if self.llm_cache is not None and not kwargs.get("stream"):
+            cached = await asyncio.to_thread(self.llm_cache.get, purpose, **kwargs)
+            if cached is not None:
+                return cached
+        response = await self.client.chat.completions.create(**kwargs)
+        if self.llm_cache is not None and not kwargs.get("stream"):
+            await asyncio.to_thread(self.llm_cache.put, purpose, response=response, **kwargs)
+        return response
+
+    async def _schedule_consolidation(self, kind: str, user_id: str):
+        """Enfileira a consolidação ou, sem worker (ou com a fila cheia), executa agora"""
+        if self.consolidation_worker is not None and await self.consolidation_worker.submit_async(kind, user_id):
+            instrumentation.inc("memory_consolidations_total", kind=kind, mode="worker")
+            return
+        instrumentation.inc("memory_consolidations_total", kind=kind, mode="inline")
+
+        if kind == EXTRACT:
+            await self._extract_and_consolidate_information(user_id)
+        else:
+            await self._create_conversation_summary(user_id)
+
+    async def _extract_and_consolidate_information(self, user_id: str):
+        """Extrai informações importantes da conversa e consolida no perfil do usuário"""
+        try:
+            await self._extract_user_information(user_id)
+        except Exception as e:
+            print(f" Error extracting information: {str(e)}")
+
+    async def _extract_user_information(self, user_id: str):
+        """Extração propriamente dita; erros de API são propagados para permitir retentativas"""
+        await self._ensure_resident(user_id)
+        recent_messages = self.conversation_history.recent(user_id, 5)
+
+        if not recent_messages:
+            return
+
+        conversation_text = "\n".join([
+            f"{msg['role']}: {msg['content']}" for msg in recent_messages
+        ])
+
+        extraction_prompt = get_extract_system_message(conversation_text=conversation_text)
+
+        response = await self._chat_completion(
+            purpose=EXTRACT,
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": extraction_prompt}],
+            max_tokens=500,
+            temperature=0.3
+        )
+
+        extracted_info = response.choices[0].message.content
+
+        try:
+            user_info = json.loads(extracted_info)
+            # Remove campos vazios
+            user_info = {k: v for k, v in user_info.items() if v}
+
+            if user_info:  # Só atualiza se tiver informações
+                await self.repository.update_user_profile(user_id, user_info)
+                print(f" User profile {user_id} updated: {user_info}")
+
+        except json.JSONDecodeError:
+            print(f" Error parsing extracted information: {extracted_info}")
+
+    async def _extract_batch(self, conversations: Dict[str, List[Dict]]):
+        """Extrai o perfil de vários usuários em uma única chamada ao LLM (ver DBMemoryAgent)"""
+        response = await self._chat_completion(
+            purpose=EXTRACT,
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": _extraction_prompt(conversations)}],
+            max_tokens=500 * len(conversations),
+            temperature=0.3
+        )
+        instrumentation.inc("memory_consolidations_total", len(conversations), kind=EXTRACT, mode="batch")
+
+        extracted_info = response.choices[0].message.content
+        for user_id, user_info in _parse_extraction(extracted_info, conversations).items():
+            await self.repository.update_user_profile(user_id, user_info)
+            print(f" User profile {user_id} updated: {user_info}")
+
+    async def _create_conversation_summary(self, user_id: str):
+        """Cria resumo da conversa atual e limpa parte da memória de curto prazo"""
+        try:
+            await self._summarize_conversation(user_id)
+        except Exception as e:
+            print(f" Error creating summary: {str(e)}")
+
+    async def _summarize_conversation(self, user_id: str):
+        """Sumarização incremental a partir da marca d'água (ver DBMemoryAgent)"""
+        watermark = await self.repository.get_summary_watermark(user_id)
+        new_messages = await self.repository.get_messages_since(user_id, watermark, limit=self.summary_batch_limit)
+
+        if len(new_messages) < 3:
+            return
+
+        conversation_text = "\n".join([
+            f"{msg['role']}: {msg['content']}" for msg in new_messages
+        ])
+
+        summary_prompt = get_create_system_message(conversation_text=conversation_text)
+
+        response = await self._chat_completion(
+            purpose=SUMMARIZE,
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": summary_prompt}],
+            max_tokens=300,
+            temperature=0.3
+        )
+
+        summary = response.choices[0].message.content
+
+        stored = await self.repository.add_conversation_summary(
+            user_id, summary, len(new_messages),
+            start_message_id=new_messages[0]["id"],
+            end_message_id=new_messages[-1]["id"],
+            expected_watermark=watermark
+        )
+        if not stored:
+            return
+
+        print(f" Conversation summary created for user {user_id}")
+
+        if self.semantic_memory is not None:
+            await asyncio.to_thread(self.semantic_memory.remember, user_id, SUMMARY, summary)
+
+        await self._roll_up_summaries(user_id)
+
+        self._compress_short_term_memory(user_id)
+
+    async def _roll_up_summaries(self, user_id: str):
+        """Consolida resumos acumulados em um resumo de nível superior (resumo de resumos)"""
+        level = 0
+        while True:
+            active = await self.repository.get_active_summaries(user_id, level)
+            if len(active) < self.summary_rollup_fanout:
+                return
+
+            summaries_text = "\n\n".join(item["summary"] for item in active)
+            response = await self._chat_completion(
+                purpose=ROLLUP,
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": get_rollup_system_message(summaries_text=summaries_text)}],
+                max_tokens=300,
+                temperature=0.3
+            )
+
+            rolled = await self.repository.roll_up_summaries(
+                user_id, [item["id"] for item in active], response.choices[0].message.content, level + 1
+            )
+            if not rolled:
+                return
+
+            print(f" Summaries of user {user_id} rolled up to level {level + 1}")
+            level += 1
+
+    def _compress_short_term_memory(self, user_id: str):
+        """Remove mensagens antigas da memória de curto prazo, mantendo as mais recentes"""
+        self.conversation_history.compress(user_id, keep_last=5)
+
+    async def get_user_profile(self, user_id: str) -> Dict:
+        """Retorna o perfil completo do usuário"""
+        return dict(await self.repository.get_user_profile_dict(user_id))
+
+    async def get_conversation_summaries(self, user_id: str, limit: int = 5) -> List[str]:
+        """Retorna resumos de conversas do usuário"""
+        return await self.repository.get_conversation_summaries(user_id, limit)
+
+    async def close(self):
+        """Libera o cliente HTTP e o pool de conexões"""
+        if self.consolidation_worker is not None:
+            await self.consolidation_worker.stop()
+        if self.retention_job is not None:
+            await self.retention_job.stop()
+            self.retention_job.repository.dispose()
+        await self.client.close()
+        await self.repository.dispose()
+        if self.semantic_memory is not None:
+            await asyncio.to_thread(self.semantic_memory.close)
+            self.semantic_memory.repository.dispose()
+        if self.llm_cache is not None:
+            self.llm_cache.repository.dispose()
+
+class AsyncTestDBMemoryAgent:
+    """Versão assíncrona do TestDBMemoryAgent"""
+
+    def __init__(self, model: str = "gpt-3.5-turbo", short_term_limit: int = 10,
+                 max_tokens: int = 4000, database_url: str = "sqlite:///test_memory.db",
+                 max_resident_users: int = 1000, context_budget: int = 3000,
+                 cache_ttl: float = 300.0, semantic_memory: bool = False,
+                 semantic_index_path: str = None):
+        self.model = model
+        self.short_term_limit = short_term_limit
+        self.max_tokens = max_tokens  # Orçamento da resposta (completion)
+        # Orçamento do prompt: sistema > perfil > resumos > turnos recentes > conhecimento
+        self.context_builder = ContextBuilder(TokenCounter(model), budget=context_budget)
+        self.memory_agent = AsyncDBMemoryAgent(
+            model=model,
+            short_term_limit=short_term_limit,
+            max_tokens=max_tokens,
+            database_url=database_url,
+            max_resident_users=max_resident_users,
+            cache_ttl=cache_ttl,
+            semantic_memory=semantic_memory,
+            semantic_index_path=semantic_index_path
+        )
+        self.semantic_context_limit = 5  # Lembranças semânticas incluídas no contexto
+
+    async def generate_response(self, user_id: str, user_message: str) -> str:
+        """Gera resposta considerando toda a memória disponível"""
+        await self.memory_agent.add_message(user_id, "user", user_message)
+
+        context_messages = await self._build_context_for_user(user_id)
+
+        try:
+            response = await self.memory_agent._chat_completion(
+                purpose=CHAT,
+                model=self.model,
+                messages=context_messages,
+                max_tokens=self.max_tokens,
+                temperature=0.7
+            )
+
+            ai_response = response.choices[0].message.content
+
+            await self.memory_agent.add_message(user_id, "assistant", ai_response)
+
+            return ai_response
+
+        except Exception as e:
+            error_msg = f"Erro ao gerar resposta: {str(e)}"
+            print(error_msg)
+            return ERROR_RESPONSE
+
+    async def generate_response_stream(self, user_id: str, user_message: str) -> AsyncIterator[str]:
+        """Versão em streaming de generate_response (ver TestDBMemoryAgent.generate_response_stream)"""
+        counters = await self.memory_agent.add_message(user_id, "user", user_message, consolidate=False)
+        context_messages = await self._build_context_for_user(user_id)
+
+        parts: List[str] = []
+        stream = None
+        completed = False  # stream lido até o fim
+        finished = False   # terminou sem interrupção do consumidor (com ou sem erro)
+        start = time.perf_counter()
+        try:
+            stream = await self.memory_agent._chat_completion(
+                purpose=CHAT,
+                model=self.model,
+                messages=context_messages,
+                max_tokens=self.max_tokens,
+                temperature=0.7,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                instrumentation.record_llm_usage(getattr(chunk, "usage", None), self.model, STREAM_CALLER)
+                text = _chunk_text(chunk)
+                if text:
+                    if not parts:
+                        instrumentation.observe("memory_llm_first_token_seconds", time.perf_counter() - start,
+                                                model=self.model)
+                    parts.append(text)
+                    yield text
+            completed = finished = True
+            instrumentation.observe("memory_llm_seconds", time.perf_counter() - start,
+                                    caller=STREAM_CALLER, model=self.model)
+
+        except Exception as e:
+            finished = True
+            print(f"Erro ao gerar resposta: {str(e)}")
+            if not parts:
+                yield ERROR_RESPONSE
+
+        finally:
+            if stream is not None and not completed:
+                await stream.close()
+            # Interrompido pelo consumidor: a consolidação fica para a próxima mensagem
+            if parts:
+                await self.memory_agent.add_message(user_id, "assistant", "".join(parts),
+                                                    None if completed else {"partial": True},
+                                                    consolidate=finished)
+            elif finished:
+                await self.memory_agent._check_triggers(user_id, counters)
+
+    async def _build_context_for_user(self, user_id: str) -> List[Dict]:
+        """Constrói o contexto do usuário dentro do orçamento de tokens do prompt"""
+        profile = await self.memory_agent.get_user_profile(user_id)
+        summaries = await self.memory_agent.get_conversation_summaries(
+            user_id, limit=self.memory_agent.summary_context_limit
+        )
+        await self.memory_agent._ensure_resident(user_id)
+        history = self.memory_agent.conversation_history.get(user_id)
+
+        return self.context_builder.build(
+            system=CHAT_SYSTEM_MESSAGE,
+            profile=get_user_profile_message(profile),
+            summaries=summaries,
+            history=history,
+            knowledge=await self._get_relevant_memories(user_id, history)
+        )
+
+    async def _get_relevant_memories(self, user_id: str, history: List[Dict]) -> List[str]:
+        """Lembranças e conhecimentos mais similares à mensagem atual (requer semantic_memory=True)"""
+        semantic_memory = self.memory_agent.semantic_memory
+        query = next((msg["content"] for msg in reversed(history) if msg["role"] == "user"), None)
+        if semantic_memory is None or not query:
+            return []
+
+        recent = {msg["content"] for msg in history}
+        results = await asyncio.to_thread(
+            semantic_memory.search, user_id, query, self.semantic_context_limit + len(history)
+        )
+        return [format_memory(result) for result in results
+                if result["content"] not in recent][:self.semantic_context_limit]
+
+    async def get_user_profile(self, user_id: str) -> Dict:
+        """Retorna perfil do usuário"""
+        return await self.memory_agent.get_user_profile(user_id)
+
+    async def add_message(self, user_id: str, role: str, content: str, metadata: Dict = None):
+        """Adiciona mensagem (para compatibilidade com testes antigos)"""
+        await self.memory_agent.add_message(user_id, role, content, metadata)
+
+    async def close(self):
+        """Libera recursos do agente"""
+        await self.memory_agent.close()
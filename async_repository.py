@@ -0,0 +1,450 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+import json
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from db import (DatabaseConfig, acquire_async_engine, ensure_schema, mark_schema_ready, release_async_engine,
+                schema_ready)
+import fulltext
+import migrations
+from models import Base, ConversationSummary, Message, UserProfile, KnowledgeBase
+from records import MessageRecord, ProfileRecord
+from repository import (COMPRESSION_DICTIONARIES, KNOWLEDGE_CHUNK_SIZE, MESSAGES_SINCE, RECENT_MESSAGES, USER_PROFILE,
+                        _knowledge_chunks, _upsert_knowledge_chunk, needs_dictionaries, register_dictionaries)
+
+
+class AsyncMemoryRepository:
+    """Versão assíncrona do MemoryRepository (sqlalchemy.ext.asyncio + aiosqlite/asyncpg).
+
+    A API espelha a do ``MemoryRepository`` síncrono; todos os métodos são
+    corrotinas. O engine vem do registro do processo (compartilhado por URL) e
+    as tabelas são criadas de forma preguiçosa no primeiro acesso, uma vez por
+    banco (inclusive se o repositório síncrono já as criou).
+    """
+
+    def __init__(self, config: DatabaseConfig):
+        self.config = config
+        self.engine = acquire_async_engine(config)
+        self.SessionLocal = async_sessionmaker(self.engine, autoflush=False, expire_on_commit=False)
+        self._tables_created = False
+        self._fulltext = False
+        self._tables_lock = asyncio.Lock()
+        self._disposed = False
+
+    async def create_tables(self):
+        """Cria todas as tabelas e aplica migrações de colunas em bancos existentes"""
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(migrations.upgrade)
+            register_dictionaries(await conn.execute(COMPRESSION_DICTIONARIES))
+            self._fulltext = await conn.run_sync(fulltext.is_available)
+        self._tables_created = True
+        if not self.config.is_sqlite_memory:
+            mark_schema_ready(self.config, self._fulltext)
+
+    async def _ensure_tables(self):
+        if self._tables_created:
+            return
+        async with self._tables_lock:
+            if self._tables_created:
+                return
+            if not self.config.is_sqlite_memory and schema_ready(self.config):
+                self._fulltext = ensure_schema(self.config, lambda: None)
+                self._tables_created = True
+            else:
+                await self.create_tables()
+
+    @asynccontextmanager
+    async def get_session(self):
+        """Retorna nova sessão assíncrona de banco de dados"""
+        await self._ensure_tables()
+        async with self.SessionLocal() as session:
+            yield session
+
+    async def dispose(self):
+        """Devolve o engine ao registro; o pool fecha quando o último repositório da URL sai"""
+        if not self._disposed:
+            self._disposed = True
+            await release_async_engine(self.engine)
+
+    @staticmethod
+    async def _message_records(session, rows) -> List[MessageRecord]:
+        rows = list(rows)
+        if needs_dictionaries(rows):
+            register_dictionaries(await session.execute(COMPRESSION_DICTIONARIES))
+        return [MessageRecord(*row) for row in rows]
+
+    @staticmethod
+    async def _get_or_create_profile(session, user_id: str) -> UserProfile:
+        profile = await session.get(UserProfile, user_id)
+        if not profile:
+            profile = UserProfile(
+                id=user_id,
+                name="",
+                interests=json.dumps([]),
+                preferences="",
+                context="",
+                first_interaction=datetime.now(),
+                last_interaction=datetime.now()
+            )
+            session.add(profile)
+            await session.flush()
+        return profile
+
+    async def get_or_create_user_profile(self, user_id: str) -> UserProfile:
+        """Obtém ou cria um perfil de usuário"""
+        async with self.get_session() as session:
+            profile = await self._get_or_create_profile(session, user_id)
+            await session.commit()
+            return profile
+
+    async def update_user_profile(self, user_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
+        """Atualiza perfil do usuário e retorna o perfil resultante como dicionário"""
+        async with self.get_session() as session:
+            profile = await self._get_or_create_profile(session, user_id)
+            profile.apply_updates(updates)
+            profile.last_interaction = datetime.now()
+            updated = profile.to_dict()
+            await session.commit()
+            return updated
+
+    async def add_message(self, user_id: str, role: str, content: str, metadata: Dict[str, Any] = None) -> Dict[str, int]:
+        """Adiciona mensagem ao histórico em uma transação e devolve os contadores do usuário"""
+        async with self.get_session() as session:
+            # Garante que o perfil existe
+            await self._get_or_create_profile(session, user_id)
+
+            message = Message(
+                user_id=user_id,
+                role=role,
+                content=content,
+                timestamp=datetime.now()
+            )
+
+            if metadata:
+                message.set_metadata_dict(metadata)
+
+            session.add(message)
+            await session.flush()
+
+            result = await session.execute(
+                update(UserProfile)
+                .where(UserProfile.id == user_id)
+                .values(
+                    message_count=func.coalesce(UserProfile.message_count, 0) + 1,
+                    unsummarized_count=func.coalesce(UserProfile.unsummarized_count, 0) + 1,
+                    last_interaction=message.timestamp
+                )
+                .returning(UserProfile.message_count, UserProfile.unsummarized_count)
+                .execution_options(synchronize_session=False)
+            )
+            row = result.one()
+
+            await session.commit()
+            return {"message_id": message.id, "message_count": row[0], "unsummarized_count": row[1]}
+
+    async def get_recent_messages(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Obtém mensagens recentes do usuário"""
+        async with self.get_session() as session:
+            rows = (await session.execute(RECENT_MESSAGES, {"user_id": user_id, "limit": limit})).all()
+            return await self._message_records(session, reversed(rows))
+
+    async def add_conversation_summary(self, user_id: str, summary: str, message_count: int = 0,
+                                       start_message_id: int = None, end_message_id: int = None,
+                                       expected_watermark: int = None) -> bool:
+        """Adiciona resumo de conversa (ver MemoryRepository.add_conversation_summary)"""
+        async with self.get_session() as session:
+            await self._get_or_create_profile(session, user_id)
+
+            if end_message_id is not None:
+                watermark_update = update(UserProfile).where(UserProfile.id == user_id)
+                if expected_watermark is not None:
+                    watermark_update = watermark_update.where(
+                        func.coalesce(UserProfile.summary_watermark, 0) == expected_watermark
+                    )
+                remaining = select(func.count(Message.id))\
+                    .where(Message.user_id == user_id)\
+                    .where(Message.id > end_message_id)\
+                    .scalar_subquery()
+                result = await session.execute(
+                    watermark_update.values(summary_watermark=end_message_id, unsummarized_count=remaining)
+                    .execution_options(synchronize_session=False)
+                )
+                if not result.rowcount:
+                    await session.rollback()
+                    return False
+
+            session.add(ConversationSummary(
+                user_id=user_id,
+                summary=summary,
+                message_count=message_count,
+                level=0,
+                start_message_id=start_message_id,
+                end_message_id=end_message_id
+            ))
+            await session.commit()
+            return True
+
+    async def get_conversation_summaries(self, user_id: str, limit: int = 5) -> List[str]:
+        """Obtém resumos de conversas do usuário (apenas os que não foram consolidados em outro)"""
+        async with self.get_session() as session:
+            result = await session.execute(
+                select(ConversationSummary.summary)
+                .where(ConversationSummary.user_id == user_id)
+                .where(ConversationSummary.parent_id.is_(None))
+                .order_by(ConversationSummary.created_at.desc())
+                .limit(limit)
+            )
+            return list(result.scalars().all())
+
+    async def get_summary_watermark(self, user_id: str) -> int:
+        """Retorna o id da última mensagem já resumida para o usuário (0 se nenhuma)"""
+        async with self.get_session() as session:
+            result = await session.execute(
+                select(UserProfile.summary_watermark).where(UserProfile.id == user_id)
+            )
+            return result.scalar() or 0
+
+    async def get_messages_since(self, user_id: str, after_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+        """Obtém, em ordem cronológica, as mensagens do usuário com id maior que ``after_id``"""
+        async with self.get_session() as session:
+            result = await session.execute(MESSAGES_SINCE, {"user_id": user_id, "after_id": after_id, "limit": limit})
+            return await self._message_records(session, result.all())
+
+    async def get_unsummarized_message_count(self, user_id: str) -> int:
+        """Número de mensagens do usuário posteriores à marca d'água de resumos"""
+        async with self.get_session() as session:
+            watermark = select(func.coalesce(UserProfile.summary_watermark, 0))\
+                .where(UserProfile.id == user_id)\
+                .scalar_subquery()
+            result = await session.execute(
+                select(func.count(Message.id))
+                .where(Message.user_id == user_id)
+                .where(Message.id > func.coalesce(watermark, 0))
+            )
+            return result.scalar_one()
+
+    async def get_active_summaries(self, user_id: str, level: int = 0) -> List[Dict[str, Any]]:
+        """Resumos de um nível que ainda não foram consolidados, do mais antigo ao mais novo"""
+        async with self.get_session() as session:
+            result = await session.execute(
+                select(ConversationSummary)
+                .where(ConversationSummary.user_id == user_id)
+                .where(ConversationSummary.parent_id.is_(None))
+                .where(func.coalesce(ConversationSummary.level, 0) == level)
+                .order_by(ConversationSummary.created_at, ConversationSummary.id)
+            )
+            return [{
+                "id": item.id,
+                "summary": item.summary,
+                "message_count": item.message_count or 0,
+                "created_at": item.created_at,
+                "start_message_id": item.start_message_id,
+                "end_message_id": item.end_message_id
+            } for item in result.scalars().all()]
+
+    async def roll_up_summaries(self, user_id: str, summary_ids: List[int], summary: str, level: int) -> bool:
+        """Substitui vários resumos por um resumo de nível superior (ver MemoryRepository)"""
+        async with self.get_session() as session:
+            result = await session.execute(
+                select(ConversationSummary)
+                .where(ConversationSummary.id.in_(summary_ids))
+                .where(ConversationSummary.user_id == user_id)
+                .where(ConversationSummary.parent_id.is_(None))
+            )
+            children = result.scalars().all()
+            if len(children) != len(summary_ids):
+                return False
+
+            start_ids = [c.start_message_id for c in children if c.start_message_id is not None]
+            end_ids = [c.end_message_id for c in children if c.end_message_id is not None]
+            parent = ConversationSummary(
+                user_id=user_id,
+                summary=summary,
+                message_count=sum(c.message_count or 0 for c in children),
+                level=level,
+                start_message_id=min(start_ids) if start_ids else None,
+                end_message_id=max(end_ids) if end_ids else None,
+                created_at=max(c.created_at for c in children)
+            )
+            session.add(parent)
+            await session.flush()
+
+            updated = await session.execute(
+                update(ConversationSummary)
+                .where(ConversationSummary.id.in_(summary_ids))
+                .where(ConversationSummary.parent_id.is_(None))
+                .values(parent_id=parent.id)
+                .execution_options(synchronize_session=False)
+            )
+            if updated.rowcount != len(summary_ids):
+                await session.rollback()
+                return False
+
+            await session.commit()
+            return True
+
+    async def get_user_profile_dict(self, user_id: str) -> Dict[str, Any]:
+        """Retorna perfil do usuário como dicionário"""
+        async with self.get_session() as session:
+            row = (await session.execute(USER_PROFILE, {"user_id": user_id})).first()
+            return ProfileRecord(*row) if row is not None else {}
+
+    async def cleanup_old_messages(self, user_id: str, keep_last: int = 50):
+        """Remove mensagens antigas, mantendo apenas as mais recentes"""
+        async with self.get_session() as session:
+            recent_message_ids = select(Message.id)\
+                .where(Message.user_id == user_id)\
+                .order_by(Message.timestamp.desc())\
+                .limit(keep_last)\
+                .scalar_subquery()
+
+            result = await session.execute(
+                delete(Message)
+                .where(Message.user_id == user_id)
+                .where(~Message.id.in_(recent_message_ids))
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                await self._refresh_message_counters(session, user_id)
+            await session.commit()
+            return result.rowcount
+
+    @staticmethod
+    async def _refresh_message_counters(session, user_id: str):
+        """Recalcula os contadores desnormalizados do usuário a partir da tabela de mensagens"""
+        total = select(func.count(Message.id))\
+            .where(Message.user_id == user_id)\
+            .scalar_subquery()
+        unsummarized = select(func.count(Message.id))\
+            .where(Message.user_id == user_id)\
+            .where(Message.id > func.coalesce(UserProfile.summary_watermark, 0))\
+            .scalar_subquery()
+        await session.execute(
+            update(UserProfile)
+            .where(UserProfile.id == user_id)
+            .values(message_count=total, unsummarized_count=unsummarized)
+            .execution_options(synchronize_session=False)
+        )
+
+    async def get_message_count(self, user_id: str) -> int:
+        """Retorna número total de mensagens do usuário"""
+        async with self.get_session() as session:
+            result = await session.execute(
+                select(func.count(Message.id)).where(Message.user_id == user_id)
+            )
+            return result.scalar_one()
+
+    # ========== MÉTODOS PARA KNOWLEDGE BASE ==========
+
+    async def _get_knowledge_item(self, session, key: str):
+        result = await session.execute(select(KnowledgeBase).where(KnowledgeBase.key == key))
+        return result.scalars().first()
+
+    async def add_knowledge(self, key: str, value: str, category: str = None):
+        """Adiciona conhecimento à base geral"""
+        async with self.get_session() as session:
+            existing = await self._get_knowledge_item(session, key)
+            if existing:
+                existing.value = value
+                existing.category = category
+                existing.updated_at = datetime.now()
+            else:
+                session.add(KnowledgeBase(key=key, value=value, category=category))
+            await session.commit()
+
+    async def get_knowledge(self, key: str) -> str:
+        """Busca conhecimento por chave"""
+        async with self.get_session() as session:
+            result = await session.execute(select(KnowledgeBase.value).where(KnowledgeBase.key == key))
+            return result.scalars().first()
+
+    async def get_knowledge_by_category(self, category: str) -> List[Dict]:
+        """Busca conhecimento por categoria"""
+        async with self.get_session() as session:
+            result = await session.execute(select(KnowledgeBase).where(KnowledgeBase.category == category))
+            return [{"key": item.key, "value": item.value, "created_at": item.created_at}
+                    for item in result.scalars().all()]
+
+    async def update_knowledge(self, key: str, value: str, category: str = None):
+        """Atualiza conhecimento existente"""
+        async with self.get_session() as session:
+            kb = await self._get_knowledge_item(session, key)
+            if kb:
+                kb.value = value
+                if category:
+                    kb.category = category
+                kb.updated_at = datetime.now()
+                await session.commit()
+                return True
+            return False
+
+    async def delete_knowledge(self, key: str) -> bool:
+        """Remove conhecimento da base"""
+        async with self.get_session() as session:
+            kb = await self._get_knowledge_item(session, key)
+            if kb:
+                await session.delete(kb)
+                await session.commit()
+                return True
+            return False
+
+    async def get_all_knowledge(self) -> List[Dict]:
+        """Retorna todo o conhecimento da base"""
+        async with self.get_session() as session:
+            result = await session.execute(select(KnowledgeBase))
+            return [{"key": item.key, "value": item.value, "category": item.category,
+                     "created_at": item.created_at, "updated_at": item.updated_at}
+                    for item in result.scalars().all()]
+
+    async def search_knowledge(self, search_term: str, limit: Optional[int] = None, offset: int = 0,
+                               match_all: bool = True) -> List[Dict]:
+        """Busca conhecimento por termo, do mais para o menos relevante (ver MemoryRepository)"""
+        async with self.get_session() as session:
+            if not self._fulltext:
+                result = await session.execute(
+                    select(KnowledgeBase).where(
+                        (KnowledgeBase.key.contains(search_term)) |
+                        (KnowledgeBase.value.contains(search_term)) |
+                        (KnowledgeBase.category.contains(search_term))
+                    ).order_by(KnowledgeBase.id).offset(offset).limit(limit)
+                )
+                return [{"key": item.key, "value": item.value, "category": item.category, "score": None,
+                         "snippet": fulltext.like_snippet(item.value, search_term)}
+                        for item in result.scalars().all()]
+
+            statement = fulltext.search_statement(self.engine.dialect.name, search_term, limit, offset, match_all)
+            if statement is None:
+                return []
+            rows = (await session.execute(*statement)).all()
+            return [{"key": row.key, "value": row.value, "category": row.category,
+                     "score": row.score, "snippet": row.snippet} for row in rows]
+
+    async def bulk_add_knowledge(self, knowledge_items: List[Dict]) -> int:
+        """Adiciona múltiplos conhecimentos de uma vez (atualiza os existentes); retorna quantos eram novos"""
+        return (await self.bulk_upsert_knowledge(knowledge_items))["inserted"]
+
+    async def bulk_upsert_knowledge(self, knowledge_items: Iterable[Dict],
+                                    chunk_size: int = KNOWLEDGE_CHUNK_SIZE) -> Dict[str, int]:
+        """Insere ou atualiza conhecimentos em lote (ver ``MemoryRepository.bulk_upsert_knowledge``)"""
+        await self._ensure_tables()
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        for rows in _knowledge_chunks(knowledge_items, chunk_size, counts):
+            async with self.engine.begin() as conn:
+                inserted = await conn.run_sync(_upsert_knowledge_chunk, rows)
+            counts["inserted"] += inserted
+            counts["updated"] += len(rows) - inserted
+        return counts
+
+    async def delete_knowledge_by_category(self, category: str) -> int:
+        """Remove todos os conhecimentos de uma categoria em uma única instrução"""
+        async with self.get_session() as session:
+            result = await session.execute(
+                delete(KnowledgeBase.__table__).where(KnowledgeBase.__table__.c.category == category)
+            )
+            await session.commit()
+            return result.rowcount
@@ -0,0 +1,124 @@
+"""Benchmark do índice aproximado (IVF) x busca exata da memória semântica.
+
+Gera vetores sintéticos agrupados em tópicos (como lembranças de usuários que
+falam de assuntos recorrentes), distribuídos entre usuários, e mede para cada
+``nprobe``:
+
+- recall@k: fração dos k vizinhos exatos que o índice também retorna
+- latência média por consulta, global e filtrada por usuário
+
+A busca exata é a da ``VectorSet`` (produto matricial + argpartition).
+Também mede construção, gravação e carga do índice com mmap.
+
+Uso: python bench_ann.py [--rows 100000,1000000] [--dim 256] [--k 10] [--nprobe 1,4,8,16,32]
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from ann import IVFIndex
+from semantic import normalize
+
+
+def make_dataset(rows: int, dim: int, topics: int, users: int, seed: int = 0):
+    """Vetores normalizados em torno de ``topics`` centros, com dono aleatório"""
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((topics, dim)).astype(np.float32))
+    vectors = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, 100000):
+        end = min(start + 100000, rows)
+        noise = rng.standard_normal((end - start, dim)).astype(np.float32) * 0.08
+        vectors[start:end] = normalize(centers[rng.integers(0, topics, end - start)] + noise)
+    owners = rng.integers(0, users, rows)
+    return vectors, owners
+
+
+def make_queries(vectors: np.ndarray, count: int, seed: int = 1):
+    """Consultas próximas de vetores existentes (paráfrases de lembranças)"""
+    rng = np.random.default_rng(seed)
+    base = vectors[rng.integers(0, len(vectors), count)]
+    return normalize(base + rng.standard_normal(base.shape).astype(np.float32) * 0.05)
+
+
+def exact_search(vectors: np.ndarray, query: np.ndarray, k: int):
+    """Posições dos k vetores mais similares (mesmo cálculo de ``VectorSet.search``)"""
+    scores = vectors @ query
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])].tolist()
+
+
+def timed(func, queries):
+    """(resultados, latência média em ms)"""
+    start = time.perf_counter()
+    results = [func(query) for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def recall(expected, found) -> float:
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    return hits / max(1, sum(len(e) for e in expected))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="100000,1000000", help="Tamanhos do índice, separados por vírgula")
+    parser.add_argument("--dim", type=int, default=256, help="Dimensão dos vetores (HashingEmbedder usa 256)")
+    parser.add_argument("--k", type=int, default=10, help="Vizinhos por consulta")
+    parser.add_argument("--nprobe", default="1,4,8,16,32", help="Listas sondadas, separadas por vírgula")
+    parser.add_argument("--queries", type=int, default=200, help="Consultas por medição")
+    parser.add_argument("--users", type=int, default=1000, help="Usuários donos dos vetores")
+    args = parser.parse_args()
+    probes = [int(p) for p in args.nprobe.split(",")]
+
+    for rows in [int(r) for r in args.rows.split(",")]:
+        vectors, owners = make_dataset(rows, args.dim, topics=max(100, rows // 500), users=args.users)
+        queries = make_queries(vectors, args.queries)
+        query_users = owners[np.random.default_rng(2).integers(0, rows, args.queries)]
+        user_ids = [f"user_{owner}" for owner in owners]
+        ids = np.arange(1, rows + 1)
+
+        start = time.perf_counter()
+        index = IVFIndex(args.dim, nlist=max(1, int(np.sqrt(rows))))
+        index.build(ids, vectors, user_ids)
+        build_s = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            index.save(tmp)
+            save_s = time.perf_counter() - start
+            start = time.perf_counter()
+            index = IVFIndex.load(tmp, mmap=True)
+            load_ms = (time.perf_counter() - start) * 1000
+
+            print(f"\n{rows} vetores x {args.dim} dim, {index.nlist} listas, {args.users} usuários | "
+                  f"construção {build_s:.1f}s, gravação {save_s:.1f}s, carga (mmap) {load_ms:.1f}ms")
+
+            # Busca exata: global e filtrada por usuário (máscara + produto matricial)
+            expected, exact_ms = timed(lambda q: exact_search(vectors, q, args.k), queries)
+            masks = {u: owners == u for u in set(query_users.tolist())}
+            pairs = list(zip(queries, query_users))
+            expected_user, exact_user_ms = timed(
+                lambda pair: [int(i) for i in np.flatnonzero(masks[pair[1]])[
+                    exact_search(vectors[masks[pair[1]]], pair[0], args.k)]], pairs)
+
+            print(f"{'nprobe':>7} | {'recall@' + str(args.k):>9} | {'ms/consulta':>11} | {'ganho':>6} | "
+                  f"{'recall usuário':>14} | {'ms usuário':>10} | {'ganho':>6}")
+            print("-" * 82)
+            print(f"{'exata':>7} | {1.0:>9.3f} | {exact_ms:>11.2f} | {'1.0x':>6} | "
+                  f"{1.0:>14.3f} | {exact_user_ms:>10.2f} | {'1.0x':>6}")
+            for nprobe in probes:
+                found, ann_ms = timed(lambda q: [i - 1 for _, i in index.search(q, args.k, nprobe=nprobe)], queries)
+                found_user, ann_user_ms = timed(
+                    lambda pair: [i - 1 for _, i in index.search(pair[0], args.k, user_id=f"user_{pair[1]}",
+                                                                 nprobe=nprobe)], pairs)
+                print(f"{nprobe:>7} | {recall(expected, found):>9.3f} | {ann_ms:>11.2f} | "
+                      f"{exact_ms / ann_ms:>5.1f}x | {recall(expected_user, found_user):>14.3f} | "
+                      f"{ann_user_ms:>10.2f} | {exact_user_ms / ann_user_ms:>5.1f}x")
+            del index
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Benchmark de vazão: agente síncrono vs assíncrono com N usuários concorrentes.
+
+Usa um servidor LLM local (fake_llm.FakeLLMServer), então não precisa de
+chave da OpenAI nem de rede.
+
+Uso: python bench_async.py [--users 1,5,10,25,50] [--turns 3] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from fake_llm import FakeLLMServer
+
+
+async def _run_sync_agent(database_url: str, users: int, turns: int) -> float:
+    from memory import TestDBMemoryAgent
+
+    agent = TestDBMemoryAgent(database_url=database_url)
+
+    async def simulate_user(user_index: int):
+        for turn in range(turns):
+            await agent.generate_response(f"user_{user_index}", f"Mensagem {turn} do usuário {user_index}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(simulate_user(i) for i in range(users)))
+    return time.perf_counter() - start
+
+
+async def _run_async_agent(database_url: str, users: int, turns: int) -> float:
+    from async_memory import AsyncTestDBMemoryAgent
+
+    agent = AsyncTestDBMemoryAgent(database_url=database_url)
+
+    async def simulate_user(user_index: int):
+        for turn in range(turns):
+            await agent.generate_response(f"user_{user_index}", f"Mensagem {turn} do usuário {user_index}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(simulate_user(i) for i in range(users)))
+    elapsed = time.perf_counter() - start
+    await agent.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="1,5,10,25,50", help="Lista de níveis de concorrência")
+    parser.add_argument("--turns", type=int, default=3, help="Turnos de conversa por usuário")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latência simulada do LLM (s)")
+    args = parser.parse_args()
+
+    user_levels = [int(n) for n in args.users.split(",")]
+
+    with FakeLLMServer(latency=args.latency) as server, tempfile.TemporaryDirectory() as tmp:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+
+        print(f"LLM falso em {server.base_url} (latência {args.latency * 1000:.0f} ms)\n")
+        print(f"{'usuários':>8} | {'sync turnos/s':>13} | {'async turnos/s':>14} | {'ganho':>6}")
+        print("-" * 52)
+
+        for users in user_levels:
+            total_turns = users * args.turns
+            sync_url = f"sqlite:///{os.path.join(tmp, f'sync_{users}.db')}"
+            async_url = f"sqlite:///{os.path.join(tmp, f'async_{users}.db')}"
+
+            sync_elapsed = asyncio.run(_run_sync_agent(sync_url, users, args.turns))
+            async_elapsed = asyncio.run(_run_async_agent(async_url, users, args.turns))
+
+            sync_rate = total_turns / sync_elapsed
+            async_rate = total_turns / async_elapsed
+            print(f"{users:>8} | {sync_rate:>13.1f} | {async_rate:>14.1f} | {async_rate / sync_rate:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Replay de um corpus de conversas para medir o agendamento da extração de perfil.
+
+Compara, no mesmo corpus sintético e reprodutível, o gatilho fixo
+(``consolidation_threshold``) com o ``ExtractionScheduler`` sem lote e com lote.
+Cada usuário revela o nome e três interesses no meio de uma conversa comum,
+às vezes de forma explícita ("meu nome é", "eu gosto muito de") e às vezes
+implícita ("tenho estudado Rust"), que as heurísticas locais não reconhecem.
+O LLM é um extrator determinístico em processo: lê o prompt e devolve os fatos
+presentes nas mensagens, como faria o modelo.
+
+Mede as chamadas de extração, a cobertura do perfil (fatos revelados que estão
+no perfil) ao fim do replay e depois de extrair as pendências
+(``run_once(force=True)``), e o atraso médio, em mensagens do usuário, entre a
+revelação e a extração.
+
+Uso: python bench_extraction.py [--users 50] [--turns 40] [--batch-size 8] [--seed 42]
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import tempfile
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+NAMES = ["Ana", "Bruno", "Carla", "Diego", "Elisa", "Fábio", "Gabriela", "Heitor", "Isabela", "João"]
+INTERESTS = ["Python", "Rust", "Kubernetes", "Django", "PostgreSQL", "React", "Docker", "fotografia",
+             "xadrez", "jazz", "ciclismo", "culinária"]
+NAME_TEMPLATES = ["Oi, meu nome é {}.", "Antes de tudo, meu nome é {} e sou novo por aqui."]
+EXPLICIT_TEMPLATES = ["Eu gosto muito de {}, uso sempre que posso.", "Adoro {} e leio sobre isso todo dia."]
+IMPLICIT_TEMPLATES = ["Tenho estudado {} nas últimas semanas.", "Passei o fim de semana praticando {}."]
+FILLER = [
+    "ok", "obrigado!", "Entendi, faz sentido.", "Pode dar um exemplo?", "Pode explicar melhor?",
+    "Qual a diferença entre lista e tupla?", "Como faço para ordenar um dicionário?",
+    "E se o arquivo for muito grande?", "Qual a complexidade disso?", "Tem alguma alternativa mais simples?",
+    "Como testar essa função?", "Isso funciona em produção?", "Qual biblioteca você recomenda?",
+    "Como tratar erros nesse caso?", "Dá para paralelizar?", "E a memória, aumenta muito?",
+]
+
+NAME_PATTERN = re.compile(r"meu nome é (\w+)")
+INTEREST_PATTERN = re.compile(r"(?:gosto muito de|Adoro|Tenho estudado|praticando) (\w+)")
+
+Fact = Tuple[str, str]  # ("name" | "interest", valor)
+
+
+def build_corpus(users: int, turns: int, seed: int) -> Tuple[List[Tuple[str, str]], Dict[str, Dict[Fact, int]]]:
+    """(mensagens em ordem de replay, {user_id: {fato: índice da mensagem que o revela}})"""
+    rng = random.Random(seed)
+    scripts, facts = {}, {}
+    for u in range(users):
+        user_id = f"user_{u}"
+        script = [rng.choice(FILLER) for _ in range(turns)]
+        slots = rng.sample(range(turns), 4)
+        name = rng.choice(NAMES)
+        script[slots[0]] = rng.choice(NAME_TEMPLATES).format(name)
+        facts[user_id] = {("name", name): slots[0]}
+        for slot, interest in zip(slots[1:], rng.sample(INTERESTS, 3)):
+            templates = IMPLICIT_TEMPLATES if rng.random() < 0.35 else EXPLICIT_TEMPLATES
+            script[slot] = rng.choice(templates).format(interest)
+            facts[user_id][("interest", interest.lower())] = slot
+        scripts[user_id] = script
+
+    # Usuários intercalados, como em um servidor com várias conversas ao mesmo tempo
+    messages = [(user_id, scripts[user_id][turn]) for turn in range(turns) for user_id in scripts]
+    return messages, facts
+
+
+class ReplayLLM:
+    """Cliente em processo que extrai os fatos do prompt como o LLM faria"""
+
+    def __init__(self):
+        self.extraction_calls = 0
+        self.other_calls = 0
+        self.current_user = None                     # dono de um prompt de extração individual
+        self.position: Dict[str, int] = {}           # user_id -> índice da mensagem atual
+        self.extracted_at: Dict[Tuple[str, Fact], int] = {}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str = "fake", messages: list = None, **kwargs):
+        prompt = messages[-1]["content"]
+        if "Return a JSON" not in prompt:
+            self.other_calls += 1
+            return self._completion("Resumo da conversa.")
+
+        self.extraction_calls += 1
+        if "keyed by user id" in prompt:
+            sections = re.split(r"^### (\S+)$", prompt, flags=re.MULTILINE)[1:]
+            conversations = dict(zip(sections[::2], sections[1::2]))
+            result = {user_id: self._extract(user_id, text) for user_id, text in conversations.items()}
+        else:
+            user_id = self.current_user
+            result = self._extract(user_id, prompt)
+        return self._completion(json.dumps(result, ensure_ascii=False))
+
+    def _extract(self, user_id: str, text: str) -> Dict:
+        user_lines = "\n".join(line for line in text.splitlines() if line.startswith("user: "))
+        info = {"name": "", "interests": [], "preferences": "", "context": ""}
+        for name in NAME_PATTERN.findall(user_lines):
+            info["name"] = name
+            self.extracted_at.setdefault((user_id, ("name", name)), self.position.get(user_id, 0))
+        for interest in INTEREST_PATTERN.findall(user_lines):
+            info["interests"].append(interest.lower())
+            self.extracted_at.setdefault((user_id, ("interest", interest.lower())), self.position.get(user_id, 0))
+        return info
+
+    @staticmethod
+    def _completion(content: str):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+    def close(self):
+        pass
+
+
+def coverage(repository, facts: Dict[str, Dict[Fact, int]]) -> float:
+    found = total = 0
+    for user_id, user_facts in facts.items():
+        profile = repository.get_user_profile_dict(user_id)
+        interests = {interest.lower() for interest in profile.get("interests", [])}
+        for kind, value in user_facts:
+            total += 1
+            found += (profile.get("name") == value) if kind == "name" else (value in interests)
+    return found / total if total else 1.0
+
+
+def replay(database_url: str, messages, facts, scheduler_options: Dict = None) -> Dict[str, float]:
+    from memory import DBMemoryAgent
+
+    agent = DBMemoryAgent(database_url=database_url)
+    llm = ReplayLLM()
+    agent.client = llm
+    scheduler = None
+    if scheduler_options is not None:
+        scheduler = agent.attach_extraction_scheduler(**scheduler_options)
+        extract_batch = scheduler.extract_batch
+
+        def tracked_extract_batch(conversations):
+            llm.current_user = next(iter(conversations))
+            return extract_batch(conversations)
+        scheduler.extract_batch = tracked_extract_batch
+
+    for user_id, content in messages:
+        llm.current_user = user_id
+        agent.add_message(user_id, "user", content)
+        agent.add_message(user_id, "assistant", "Entendi.")
+        llm.position[user_id] = llm.position.get(user_id, 0) + 1
+
+    calls = llm.extraction_calls
+    covered = coverage(agent.repository, facts)
+    if scheduler is not None:
+        scheduler.run_once(force=True)
+    drained = coverage(agent.repository, facts)
+
+    lags = [llm.extracted_at[(user_id, fact)] - disclosed
+            for user_id, user_facts in facts.items() for fact, disclosed in user_facts.items()
+            if (user_id, fact) in llm.extracted_at]
+    agent.close()
+    return {"calls": calls, "drain_calls": llm.extraction_calls - calls, "coverage": covered,
+            "drained": drained, "lag": sum(lags) / len(lags) if lags else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=40, help="Mensagens do usuário por conversa")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "bench")  # o cliente real nunca é chamado
+
+    messages, facts = build_corpus(args.users, args.turns, args.seed)
+    strategies = [
+        ("gatilho fixo", None),
+        ("adaptativo, sem lote", {"batch_size": 1}),
+        (f"adaptativo, lote {args.batch_size}", {"batch_size": args.batch_size}),
+    ]
+
+    print(f"Corpus: {args.users} usuários x {args.turns} mensagens, "
+          f"{sum(len(f) for f in facts.values())} fatos revelados\n")
+    print(f"{'estratégia':>22} | {'extrações':>9} | {'por 100 msgs':>12} | {'cobertura':>9} | "
+          f"{'após drenar':>17} | {'atraso (msgs)':>13}")
+    print("-" * 99)
+    with tempfile.TemporaryDirectory() as tmp:
+        for position, (label, options) in enumerate(strategies):
+            database_url = f"sqlite:///{os.path.join(tmp, f'replay_{position}.db')}"
+            # Os prints de diagnóstico do agente não entram na saída
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = replay(database_url, messages, facts, options)
+            drained = f"{result['drained']:.1%}" + (f" (+{result['drain_calls']})" if result["drain_calls"] else "")
+            print(f"{label:>22} | {result['calls']:>9} | {100 * result['calls'] / len(messages):>12.1f} | "
+                  f"{result['coverage']:>9.1%} | {drained:>17} | {result['lag']:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
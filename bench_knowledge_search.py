@@ -0,0 +1,91 @@
+"""Benchmark da busca na base de conhecimento: LIKE (caminho antigo) x full-text.
+
+Para cada tamanho de base, popula um SQLite temporário com textos sintéticos
+e mede a latência média de ``search_knowledge`` para termos frequentes e raros:
+
+- LIKE: ``contains()`` em key/value/category, sem ranking e sem limite (como antes)
+- FTS5: ``search_knowledge`` com ranking BM25, 20 resultados por página e trechos
+
+Uso: python bench_knowledge_search.py [--rows 10000,100000,1000000] [--queries 20]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from db import DatabaseConfig
+from repository import MemoryRepository
+
+# Vocabulário: algumas palavras frequentes e uma cauda longa de palavras raras
+COMMON_WORDS = ["python", "empresa", "cliente", "sistema", "dados", "projeto", "equipe", "produto",
+                "serviço", "processo", "usuário", "código", "banco", "memória", "contexto"]
+CATEGORIES = ["programming", "company", "faq", "support", "product", "sales"]
+STOP_WORDS = ["de", "para", "com", "uma", "que", "em", "no", "na", "os", "as"]
+
+
+def _rare_words(count: int):
+    rng = random.Random(7)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(5, 10))) for _ in range(count)]
+
+
+def populate(repo: MemoryRepository, rows: int, rare_words, batch_size: int = 10000):
+    """Insere ``rows`` conhecimentos sintéticos em lotes (os triggers alimentam o índice FTS)"""
+    rng = random.Random(42)
+    now = datetime.now()
+    insert = "INSERT INTO knowledge_base (key, value, category, created_at, updated_at) VALUES (?, ?, ?, ?, ?)"
+    with repo.engine.begin() as connection:
+        for start in range(0, rows, batch_size):
+            batch = []
+            for i in range(start, min(start + batch_size, rows)):
+                words = [rng.choice(COMMON_WORDS) if rng.random() < 0.3 else
+                         rng.choice(STOP_WORDS) if rng.random() < 0.4 else
+                         rng.choice(rare_words) for _ in range(20)]
+                batch.append((f"kb_{i}", " ".join(words), rng.choice(CATEGORIES), now, now))
+            connection.exec_driver_sql(insert, batch)
+
+
+def time_queries(search, terms) -> float:
+    """Latência média (ms) de ``search`` sobre os termos"""
+    start = time.perf_counter()
+    for term in terms:
+        search(term)
+    return (time.perf_counter() - start) / len(terms) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000,1000000", help="Tamanhos da base, separados por vírgula")
+    parser.add_argument("--queries", type=int, default=20, help="Consultas por tipo de termo")
+    args = parser.parse_args()
+
+    rare_words = _rare_words(50000)
+    rng = random.Random(1)
+    common_terms = [rng.choice(COMMON_WORDS) for _ in range(args.queries)]
+    rare_terms = [rng.choice(rare_words) for _ in range(args.queries)]
+
+    print(f"{'linhas':>9} | {'carga (s)':>9} | {'termo':>9} | {'LIKE (ms)':>10} | {'FTS5 (ms)':>10} | {'ganho':>7}")
+    print("-" * 70)
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in [int(r) for r in args.rows.split(",")]:
+            repo = MemoryRepository(DatabaseConfig(f"sqlite:///{os.path.join(tmp, f'kb_{rows}.db')}"))
+            if not repo._fulltext:
+                print("SQLite sem FTS5: nada a comparar")
+                return
+
+            start = time.perf_counter()
+            populate(repo, rows, rare_words)
+            load_time = time.perf_counter() - start
+
+            for label, terms in [("frequente", common_terms), ("raro", rare_terms)]:
+                like_ms = time_queries(lambda t: repo._search_knowledge_like(t, None, 0), terms)
+                fts_ms = time_queries(lambda t: repo.search_knowledge(t, limit=20), terms)
+                print(f"{rows:>9} | {load_time:>9.1f} | {label:>9} | {like_ms:>10.2f} | {fts_ms:>10.2f} | "
+                      f"{like_ms / fts_ms:>6.1f}x")
+            repo.dispose()
+
+
+if __name__ == "__main__":
+    main()
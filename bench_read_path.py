@@ -0,0 +1,100 @@
+"""Microbenchmark do caminho de leitura de mensagens e perfis (linhas/s).
+
+Compara o caminho antigo (``session.query(Message)`` com objetos do ORM e
+``to_dict()``, que faz ``json.loads`` do metadata de cada linha) com o atual
+(``select()`` do Core só com as colunas usadas, ``MessageRecord`` com
+``__slots__`` e metadata lido só quando acessado). A coluna "acessando
+metadata" lê ``msg["metadata"]`` de todas as mensagens, o pior caso do caminho
+atual. Metade das mensagens tem metadata.
+
+Uso: python bench_read_path.py [--rows 1000,10000,100000] [--repeat 5] [--profiles 2000]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from db import DatabaseConfig
+from models import Message, UserProfile
+from repository import MemoryRepository
+
+USER_ID = "bench_user"
+
+
+def seed(repo: MemoryRepository, rows: int):
+    repo.update_user_profile(USER_ID, {"name": "Ana", "interests": ["python", "xadrez", "jazz"]})
+    start = datetime.now() - timedelta(seconds=rows)
+    batch = [{"user_id": USER_ID, "role": "user" if i % 2 == 0 else "assistant",
+              "content": f"Mensagem de benchmark número {i} com algum texto",
+              "timestamp": start + timedelta(seconds=i),
+              "message_metadata": json.dumps({"source": "bench", "turn": i, "tags": ["a", "b"]}) if i % 2 else None}
+             for i in range(rows)]
+    with repo.engine.begin() as connection:
+        connection.execute(insert(Message.__table__), batch)
+
+
+def legacy_recent_messages(repo: MemoryRepository, user_id: str, limit: int):
+    """Reproduz o caminho anterior: objetos do ORM e ``to_dict()`` por linha"""
+    with repo.get_session() as session:
+        messages = session.query(Message)\
+                          .filter(Message.user_id == user_id)\
+                          .order_by(Message.timestamp.desc())\
+                          .limit(limit)\
+                          .all()
+        return [msg.to_dict() for msg in reversed(messages)]
+
+
+def legacy_profile(repo: MemoryRepository, user_id: str):
+    with repo.get_session() as session:
+        profile = session.query(UserProfile).filter(UserProfile.id == user_id).first()
+        return profile.to_dict() if profile else {}
+
+
+def rows_per_second(read, rows: int, repeat: int) -> float:
+    read()  # aquece o cache de compilação e as páginas do banco
+    start = time.perf_counter()
+    for _ in range(repeat):
+        read()
+    return rows * repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1000,10000,100000", help="Tamanhos, separados por vírgula")
+    parser.add_argument("--repeat", type=int, default=5, help="Leituras por medição")
+    parser.add_argument("--profiles", type=int, default=2000, help="Leituras de perfil")
+    args = parser.parse_args()
+
+    print(f"{'linhas':>8} | {'ORM (linhas/s)':>14} | {'Core (linhas/s)':>15} | {'ganho':>6} | "
+          f"{'acessando metadata':>18} | {'ganho':>6}")
+    print("-" * 82)
+    profile_line = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in (int(value) for value in args.rows.split(",")):
+            repo = MemoryRepository(DatabaseConfig(f"sqlite:///{os.path.join(tmp, f'read_{rows}.db')}"))
+            seed(repo, rows)
+
+            def with_metadata():
+                for msg in repo.get_recent_messages(USER_ID, rows):
+                    msg["metadata"]
+
+            orm = rows_per_second(lambda: legacy_recent_messages(repo, USER_ID, rows), rows, args.repeat)
+            core = rows_per_second(lambda: repo.get_recent_messages(USER_ID, rows), rows, args.repeat)
+            parsed = rows_per_second(with_metadata, rows, args.repeat)
+            print(f"{rows:>8} | {orm:>14,.0f} | {core:>15,.0f} | {core / orm:>5.1f}x | "
+                  f"{parsed:>18,.0f} | {parsed / orm:>5.1f}x")
+            if profile_line is None:
+                orm = rows_per_second(lambda: legacy_profile(repo, USER_ID), 1, args.profiles)
+                core = rows_per_second(lambda: dict(repo.get_user_profile_dict(USER_ID)), 1, args.profiles)
+                profile_line = (f"Perfil: ORM {orm:,.0f} leituras/s | Core {core:,.0f} leituras/s | "
+                                f"{core / orm:.1f}x")
+            repo.dispose()
+    print(f"\n{profile_line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""Suíte de benchmarks do pipeline de memória, sem rede e reprodutível.
+
+Usa o ``FakeOpenAIClient`` (fake_llm.py) no lugar da OpenAI, com latência
+configurável, e mede para cada banco (SQLite em arquivo e em memória) e escala
+(usuários x mensagens por usuário x linhas de conhecimento):
+
+- ``add_message``: persistência de um turno (gatilhos de consolidação desligados)
+- ``generate_response``: turno completo (contexto, LLM, extração e resumos)
+- ``first_token``: tempo até o primeiro trecho de ``generate_response_stream``
+  (simule a geração token a token com ``--token-latency``)
+- ``build_context``: ``_build_context_for_user``
+- ``summarize``: sumarização incremental disparada pelo gatilho
+- ``extract``: extração de informações do usuário
+- ``search_knowledge``: busca na base de conhecimento
+- ``bulk_add_knowledge``: carga da base de conhecimento (linhas/s)
+- ``returning_user``: sessões de vários turnos de usuários que voltam (agente
+  novo no mesmo banco, memória de curto prazo fria, cache padrão ligado)
+
+Cada operação tem o resultado conferido (respostas que não são de erro,
+contagens esperadas, perfis e resumos gravados); uma falha interrompe a suíte
+com código 1 em vez de entrar nas médias.
+
+Os resultados são gravados em JSON (com commit, versões e parâmetros) para
+comparar execuções entre commits; ``--compare`` aponta as regressões e sai com
+código 1 se alguma passar de ``--threshold``.
+
+Uso: python bench_suite.py [--scales small,medium] [--databases file,memory] [--latency 0]
+                           [--token-latency 0]
+                           [--output bench_results/atual.json] [--compare bench_results/base.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import sqlalchemy
+
+from fake_llm import FakeOpenAIClient
+
+SESSION_TURNS = 3  # turnos por sessão em returning_user
+
+# usuários, mensagens por usuário, linhas de conhecimento
+SCALES = {
+    "small": (10, 20, 1000),
+    "medium": (100, 50, 10000),
+    "large": (1000, 100, 100000),
+}
+
+WORDS = ["python", "empresa", "cliente", "sistema", "dados", "projeto", "equipe", "produto",
+         "serviço", "processo", "usuário", "código", "banco", "memória", "contexto", "viagem",
+         "música", "cozinha", "futebol", "livro"]
+CATEGORIES = ["programming", "company", "faq", "support", "product", "sales"]
+
+
+def parse_scale(name: str):
+    """``small``/``medium``/``large`` ou ``USUÁRIOSxMENSAGENSxCONHECIMENTO`` (ex.: 50x20x5000)"""
+    if name in SCALES:
+        return SCALES[name]
+    try:
+        users, messages, knowledge = (int(part) for part in name.split("x"))
+    except ValueError:
+        raise ValueError(f"Escala inválida: {name} (use small, medium, large ou UxMxK)")
+    return users, messages, knowledge
+
+
+def summarize_timings(timings: List[float]) -> Dict[str, float]:
+    """Estatísticas (em ms) de uma lista de durações em segundos"""
+    ordered = sorted(timings)
+    ms = [t * 1000 for t in ordered]
+    return {
+        "ops": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 4),
+        "median_ms": round(statistics.median(ms), 4),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 4),
+        "min_ms": round(ms[0], 4),
+        "ops_per_s": round(len(ms) / max(sum(ordered), 1e-9), 2),
+    }
+
+
+class BenchmarkCheckError(AssertionError):
+    """Uma operação medida devolveu um resultado inesperado"""
+
+
+def measure(func: Callable[[int], object], iterations: int,
+            check: Callable[[int, object], bool] = None) -> Dict[str, float]:
+    """Cronometra ``func(i)``; ``check(i, resultado)`` (fora da medição) confere cada resultado"""
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        result = func(i)
+        timings.append(time.perf_counter() - start)
+        if check is not None and not check(i, result):
+            raise BenchmarkCheckError(f"Resultado inesperado na operação {i}: {result!r}")
+    return summarize_timings(timings)
+
+
+def _knowledge_items(rows: int, rng: random.Random):
+    for i in range(rows):
+        words = [rng.choice(WORDS) for _ in range(12)]
+        yield {"key": f"kb_{i}", "value": " ".join(words) + f" item{i}", "category": rng.choice(CATEGORIES)}
+
+
+def _seed_messages(repository, users: int, messages: int):
+    for m in range(messages):
+        for u in range(users):
+            role = "user" if m % 2 == 0 else "assistant"
+            repository.add_message(f"user_{u}", role, f"Mensagem {m} sobre {WORDS[(u + m) % len(WORDS)]}")
+
+
+def run_scale(database_url: str, scale, iterations: int, turns: int, latency: float,
+              seed: int = 42, token_latency: float = 0.0) -> Dict[str, Dict]:
+    """Roda todos os benchmarks em um banco novo; retorna {benchmark: estatísticas}"""
+    from memory import TestDBMemoryAgent
+
+    users, messages, knowledge_rows = scale
+    rng = random.Random(seed)
+    agent = TestDBMemoryAgent(database_url=database_url)
+    memory_agent = agent.memory_agent
+    memory_agent.client = FakeOpenAIClient(latency=latency, token_latency=token_latency)
+    repository = memory_agent.repository
+    results = {}
+
+    # Carga da base de conhecimento (uma operação; a vazão é por linha)
+    start = time.perf_counter()
+    inserted = repository.bulk_add_knowledge(_knowledge_items(knowledge_rows, rng))
+    elapsed = time.perf_counter() - start
+    if inserted != knowledge_rows:
+        raise BenchmarkCheckError(f"bulk_add_knowledge inseriu {inserted} de {knowledge_rows} linhas")
+    results["bulk_add_knowledge"] = dict(summarize_timings([elapsed]), rows=knowledge_rows,
+                                         rows_per_s=round(knowledge_rows / max(elapsed, 1e-9), 1))
+
+    _seed_messages(repository, users, messages)
+    user_ids = [f"user_{u}" for u in range(users)]
+
+    # Persistência pura: sem extração, resumo ou limpeza durante a medição
+    thresholds = (memory_agent.consolidation_threshold, memory_agent.summary_trigger,
+                  memory_agent.max_messages_per_user)
+    memory_agent.consolidation_threshold = memory_agent.summary_trigger = sys.maxsize
+    memory_agent.max_messages_per_user = sys.maxsize
+    results["add_message"] = measure(
+        lambda i: memory_agent.add_message(user_ids[i % users], "user", f"Nova mensagem {i}"), iterations,
+        check=lambda i, counters: counters["message_count"] == messages + i // users + 1)
+    (memory_agent.consolidation_threshold, memory_agent.summary_trigger,
+     memory_agent.max_messages_per_user) = thresholds
+
+    # Sistema + histórico recente (as mensagens semeadas e as de add_message)
+    results["build_context"] = measure(
+        lambda i: agent._build_context_for_user(user_ids[rng.randrange(users)]), iterations,
+        check=lambda i, context: len(context) > 1)
+
+    terms = [rng.choice(WORDS) if i % 2 else f"item{rng.randrange(knowledge_rows)}" for i in range(iterations)]
+    results["search_knowledge"] = measure(
+        lambda i: repository.search_knowledge(terms[i], limit=20), iterations,
+        check=lambda i, items: bool(items) and all(terms[i] in item["value"] for item in items))
+
+    # Cada usuário tem mensagens não resumidas desde a carga: um resumo por usuário
+    summarized = min(users, iterations)
+    results["summarize"] = measure(
+        lambda i: memory_agent._summarize_conversation(user_ids[i]), summarized,
+        check=lambda i, _: bool(repository.get_conversation_summaries(user_ids[i])))
+    # O perfil é lido pelo repositório do agente (com o cache padrão), como nos turnos
+    results["extract"] = measure(
+        lambda i: memory_agent._extract_user_information(user_ids[i % users]), min(iterations, users * 5),
+        check=lambda i, _: bool(agent.get_user_profile(user_ids[i % users]).get("interests")))
+
+    calls_before = memory_agent.client.request_count
+    loop = asyncio.new_event_loop()
+    try:
+        results["generate_response"] = measure(
+            lambda i: loop.run_until_complete(
+                agent.generate_response(user_ids[i % users], f"Pergunta de benchmark {i}")), turns,
+            check=lambda i, response: response == memory_agent.client.response_text)
+        # Chamadas ao LLM por turno: resposta + extração (+ resumos, quando disparados)
+        results["generate_response"]["llm_calls_per_turn"] = round(
+            (memory_agent.client.request_count - calls_before) / max(turns, 1), 2)
+
+        first_token = []
+
+        async def stream_turn(i: int):
+            start = time.perf_counter()
+            chunks = []
+            async for chunk in agent.generate_response_stream(user_ids[i % users], f"Pergunta em streaming {i}"):
+                if len(first_token) <= i:
+                    first_token.append(time.perf_counter() - start)
+                chunks.append(chunk)
+            if "".join(chunks) != memory_agent.client.response_text:
+                raise BenchmarkCheckError(f"Resposta em streaming inesperada no turno {i}: {''.join(chunks)!r}")
+
+        for i in range(turns):
+            loop.run_until_complete(stream_turn(i))
+        results["first_token"] = summarize_timings(first_token)
+
+        agent = _returning_agent(agent, database_url, latency, token_latency)
+        results["returning_user"] = _returning_user_sessions(agent, loop, user_ids, turns)
+    finally:
+        loop.close()
+        agent.close()
+    return results
+
+
+def _returning_agent(agent, database_url: str, latency: float, token_latency: float):
+    """Agente para usuários que voltam: novo no mesmo banco, com o cache padrão.
+
+    SQLite em memória não sobrevive ao agente: reaproveita o mesmo, com a
+    memória de curto prazo e os caches esvaziados.
+    """
+    from memory import TestDBMemoryAgent
+
+    if database_url == "sqlite:///:memory:":
+        agent.memory_agent.conversation_history.clear()
+        agent.memory_agent.repository.clear_cache()
+        return agent
+    agent.close()
+    agent = TestDBMemoryAgent(database_url=database_url)
+    agent.memory_agent.client = FakeOpenAIClient(latency=latency, token_latency=token_latency)
+    return agent
+
+
+def _returning_user_sessions(agent, loop, user_ids: List[str], turns: int) -> Dict[str, float]:
+    """Sessões de ``SESSION_TURNS`` turnos, cada uma de um usuário com histórico no banco"""
+    memory_agent = agent.memory_agent
+    history_before = {}
+
+    def turn(i: int):
+        user_id = user_ids[(i // SESSION_TURNS) % len(user_ids)]
+        history_before.setdefault(user_id, memory_agent.repository.get_message_count(user_id))
+        return loop.run_until_complete(agent.generate_response(user_id, f"Voltei, pergunta {i}"))
+
+    def check(i: int, response) -> bool:
+        user_id = user_ids[(i // SESSION_TURNS) % len(user_ids)]
+        # O contexto traz o histórico relido do banco, não só os turnos desta sessão
+        return (response == memory_agent.client.response_text
+                and len(agent._build_context_for_user(user_id)) > 2 * (i % SESSION_TURNS + 1)
+                and isinstance(agent.get_user_profile(user_id), dict)
+                and history_before[user_id] > 0)
+
+    return measure(turn, turns, check=check)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    """Imprime a variação do tempo médio por benchmark; retorna as regressões acima de ``threshold``"""
+    old = {(r["database"], r["scale"], r["benchmark"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nComparação com {baseline['meta'].get('commit') or 'base'} "
+          f"({baseline['meta'].get('timestamp', '?')})")
+    for param in ("latency", "token_latency", "iterations", "turns", "seed"):
+        if baseline["meta"].get(param) != current["meta"].get(param):
+            print(f"⚠️ Parâmetro diferente entre as execuções: {param} "
+                  f"({baseline['meta'].get(param)} → {current['meta'].get(param)})")
+    print(f"{'banco':>7} | {'escala':>14} | {'benchmark':>18} | {'antes (ms)':>10} | {'agora (ms)':>10} | {'variação':>8}")
+    print("-" * 84)
+    for result in current["results"]:
+        key = (result["database"], result["scale"], result["benchmark"])
+        if key not in old:
+            continue
+        before, now = old[key]["mean_ms"], result["mean_ms"]
+        change = (now - before) / before if before else 0.0
+        flag = " ⚠️" if change > threshold else ""
+        print(f"{key[0]:>7} | {key[1]:>14} | {key[2]:>18} | {before:>10.3f} | {now:>10.3f} | {change:>+7.1%}{flag}")
+        if change > threshold:
+            regressions.append(" / ".join(key))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="small,medium",
+                        help="Escalas: small, medium, large ou UxMxK (usuários x mensagens x conhecimento)")
+    parser.add_argument("--databases", default="file,memory", help="Bancos: file (SQLite arquivo), memory")
+    parser.add_argument("--iterations", type=int, default=200, help="Operações por benchmark")
+    parser.add_argument("--turns", type=int, default=50, help="Turnos medidos em generate_response")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latência simulada do LLM (s)")
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="Latência simulada entre os trechos de uma resposta em streaming (s)")
+    parser.add_argument("--seed", type=int, default=42, help="Semente dos dados sintéticos")
+    parser.add_argument("--output", help="Arquivo JSON de resultados (padrão: bench_results/<commit>.json)")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Piora relativa considerada regressão")
+    args = parser.parse_args()
+
+    # O agente cria um cliente OpenAI no construtor; ele é trocado pelo falso antes de qualquer chamada
+    os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+    scales = [(name, parse_scale(name)) for name in args.scales.split(",")]
+    databases = args.databases.split(",")
+    commit = _git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+            "latency": args.latency,
+            "token_latency": args.token_latency,
+            "iterations": args.iterations,
+            "turns": args.turns,
+            "seed": args.seed,
+        },
+        "results": [],
+    }
+
+    print(f"{'banco':>7} | {'escala':>14} | {'benchmark':>18} | {'ops':>6} | {'média (ms)':>10} | "
+          f"{'p95 (ms)':>9} | {'ops/s':>10}")
+    print("-" * 92)
+    with tempfile.TemporaryDirectory() as tmp:
+        for database in databases:
+            for name, scale in scales:
+                label = "x".join(str(n) for n in scale) if name not in SCALES else name
+                if database == "file":
+                    database_url = f"sqlite:///{os.path.join(tmp, f'bench_{label}.db')}"
+                elif database == "memory":
+                    database_url = "sqlite:///:memory:"
+                else:
+                    parser.error(f"Banco desconhecido: {database}")
+
+                # Os prints de diagnóstico do agente não entram na saída
+                try:
+                    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                        results = run_scale(database_url, scale, args.iterations, args.turns, args.latency,
+                                            args.seed, args.token_latency)
+                except BenchmarkCheckError as e:
+                    print(f"❌ {database} / {label}: {e}")
+                    sys.exit(1)
+
+                for benchmark, stats in results.items():
+                    report["results"].append(dict(stats, database=database, scale=label, benchmark=benchmark,
+                                                  users=scale[0], messages=scale[1], knowledge=scale[2]))
+                    print(f"{database:>7} | {label:>14} | {benchmark:>18} | {stats['ops']:>6} | "
+                          f"{stats['mean_ms']:>10.3f} | {stats['p95_ms']:>9.3f} | {stats['ops_per_s']:>10.1f}")
+
+    run_name = commit or datetime.now().strftime("%Y%m%d-%H%M%S")
+    output = args.output or os.path.join("bench_results", f"{run_name}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados gravados em {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressão(ões) acima de {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNenhuma regressão acima do limite")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Microbenchmark do caminho de escrita de mensagens (mensagens/s).
+
+Compara o caminho antigo (upsert do perfil em sessão separada, dois commits e
+dois COUNT(*) para os gatilhos do agente) com o caminho atual
+(``MemoryRepository.add_message`` em uma transação, devolvendo os contadores
+desnormalizados) e com o ``WriteBehindRepository`` (mensagens acumuladas em
+memória e gravadas em lote com ``executemany``; o tempo inclui o flush final).
+
+Uso: python bench_write_path.py [--messages 2000] [--users 20]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from db import DatabaseConfig
+from models import Message
+from repository import MemoryRepository
+from write_behind import WriteBehindRepository
+
+
+def legacy_add_message(repo: MemoryRepository, user_id: str, role: str, content: str):
+    """Reproduz o caminho anterior: 2 sessões, 2 commits e 2 consultas COUNT"""
+    with repo.get_session() as session:
+        repo.get_or_create_user_profile(user_id)
+        session.add(Message(user_id=user_id, role=role, content=content, timestamp=datetime.now()))
+        session.commit()
+    repo.get_message_count(user_id)  # gatilho de resumo
+    repo.get_message_count(user_id)  # gatilho de limpeza
+
+
+def fast_add_message(repo: MemoryRepository, user_id: str, role: str, content: str):
+    """Caminho atual: uma transação; os gatilhos usam os contadores devolvidos"""
+    counters = repo.add_message(user_id, role, content)
+    counters["unsummarized_count"]
+    counters["message_count"]
+
+
+def run(write, database_url: str, messages: int, users: int, repository_class=MemoryRepository) -> float:
+    repo = repository_class(DatabaseConfig(database_url))
+    start = time.perf_counter()
+    for i in range(messages):
+        write(repo, f"user_{i % users}", "user", f"Mensagem de benchmark número {i}")
+    if isinstance(repo, WriteBehindRepository):
+        repo.close()
+    elapsed = time.perf_counter() - start
+    repo.dispose()
+    return messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, url_for in [
+            ("SQLite arquivo", lambda name: f"sqlite:///{os.path.join(tmp, name)}"),
+            ("SQLite memória", lambda name: "sqlite://"),
+        ]:
+            before = run(legacy_add_message, url_for("legacy.db"), args.messages, args.users)
+            after = run(fast_add_message, url_for("fast.db"), args.messages, args.users)
+            buffered = run(fast_add_message, url_for("buffered.db"), args.messages, args.users,
+                           WriteBehindRepository)
+            print(f"{label:>15}: antes {before:8.1f} msg/s | depois {after:8.1f} msg/s | {after / before:4.1f}x"
+                  f" | write-behind {buffered:9.1f} msg/s | {buffered / before:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
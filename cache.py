@@ -0,0 +1,413 @@
+"""Cache read-through (LRU + TTL) na frente dos repositórios.
+
+Perfis e resumos mudam apenas quando a consolidação roda, mas eram lidos do
+banco a cada turno. ``CachedRepository`` (e ``AsyncCachedRepository``) guardam
+essas leituras em memória e as invalidam nas escritas feitas pelo próprio
+repositório; escritas de outros processos aparecem no máximo após ``ttl``.
+
+Cada leitura anota a geração da chave antes de ir ao banco e só grava o
+resultado se nenhuma invalidação aconteceu nesse meio tempo: uma leitura lenta
+não sobrescreve o valor gravado por uma escrita concorrente.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional
+
+import instrumentation
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Cache LRU com tempo de vida por entrada e contadores de acerto/erro.
+
+    ``invalidate``/``clear`` avançam a geração das chaves; ``set`` com a
+    geração lida por ``generation`` antes da consulta ao banco descarta o valor
+    se ela mudou. As gerações guardadas também são limitadas a ``max_size``:
+    as esquecidas sobem o piso (``_floor``), o que no pior caso só deixa de
+    guardar uma leitura.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # chave -> (expira_em, valor)
+        self._generations: "OrderedDict[Hashable, int]" = OrderedDict()  # chave -> última invalidação
+        self._clock = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = _MISSING) -> Any:
+        """Retorna o valor em cache, ou ``default`` se ausente ou expirado"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def generation(self, key: Hashable) -> int:
+        """Geração atual da chave; passe-a a ``set`` depois de ler o banco"""
+        with self._lock:
+            return self._generations.get(key, self._floor)
+
+    def set(self, key: Hashable, value: Any, generation: int = None) -> bool:
+        """Guarda o valor; com ``generation``, só se a chave não foi invalidada desde então"""
+        with self._lock:
+            if generation is not None and self._generations.get(key, self._floor) != generation:
+                return False
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def peek(self, key: Hashable) -> Any:
+        """Retorna o valor sem contar acerto/erro nem alterar a ordem LRU (None se ausente)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._clock += 1
+            self._generations[key] = self._clock
+            self._generations.move_to_end(key)
+            while len(self._generations) > self.max_size:
+                self._floor = max(self._floor, self._generations.popitem(last=False)[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._clock += 1
+            self._floor = self._clock
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class _CachedRepositoryBase:
+    """Estado e regras comuns às versões síncrona e assíncrona.
+
+    Métodos não interceptados são repassados ao repositório original.
+    """
+
+    def __init__(self, repository, ttl: float = 300.0, max_profiles: int = 10000,
+                 max_summaries: int = 10000, max_knowledge: int = 2048, max_search_rows: int = 100):
+        self.repository = repository
+        # Buscas com mais linhas que isso (ex.: sem limit) não são guardadas
+        self.max_search_rows = max_search_rows
+        self.profiles = TTLCache(max_profiles, ttl)
+        self.summaries = TTLCache(max_summaries, ttl)  # user_id -> (limit, resumos)
+        self.knowledge = TTLCache(max_knowledge, ttl)
+        instrumentation.registry.add_collector(self._collect_metrics)
+
+    def __getattr__(self, name: str):
+        return getattr(self.repository, name)
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Contadores de acerto/erro de cada cache"""
+        return {
+            "profiles": self.profiles.stats(),
+            "summaries": self.summaries.stats(),
+            "knowledge": self.knowledge.stats()
+        }
+
+    def _collect_metrics(self):
+        """Acertos/erros dos caches para ``instrumentation`` (lidos só na exportação)"""
+        for name, cache in (("profiles", self.profiles), ("summaries", self.summaries), ("knowledge", self.knowledge)):
+            yield "memory_cache_hits_total", {"cache": name}, cache.hits
+            yield "memory_cache_misses_total", {"cache": name}, cache.misses
+
+    def _remove_collector(self):
+        instrumentation.registry.remove_collector(self._collect_metrics)
+
+    def invalidate_user(self, user_id: str):
+        """Descarta perfil e resumos do usuário (ex.: após alterá-los por fora do repositório)"""
+        self.profiles.invalidate(user_id)
+        self.summaries.invalidate(user_id)
+
+    def clear_cache(self):
+        self.profiles.clear()
+        self.summaries.clear()
+        self.knowledge.clear()
+
+    def _cached_summaries(self, user_id: str, limit: int):
+        # Os resumos vêm do mais recente para o mais antigo, então uma lista
+        # buscada com limite maior atende qualquer limite menor
+        entry = self.summaries.get(user_id)
+        if entry is not _MISSING and entry[0] >= limit:
+            return entry[1][:limit]
+        return _MISSING
+
+    def _touch_profile(self, user_id: str):
+        # add_message só altera last_interaction: atualiza a cópia em cache em vez de descartá-la.
+        # Um perfil vazio em cache significa que ele ainda não existia; add_message acabou de criá-lo
+        profile = self.profiles.peek(user_id)
+        if profile:
+            profile["last_interaction"] = datetime.now()
+        elif profile is not None:
+            self.profiles.invalidate(user_id)
+
+
+class CachedRepository(_CachedRepositoryBase):
+    """Cache read-through na frente de ``MemoryRepository`` (ou ``WriteBehindRepository``)"""
+
+    # ========== LEITURAS EM CACHE ==========
+
+    def get_user_profile_dict(self, user_id: str) -> Dict[str, Any]:
+        profile = self.profiles.get(user_id)
+        if profile is _MISSING:
+            generation = self.profiles.generation(user_id)
+            # Cópia em dict: o repositório devolve um ProfileRecord (imutável) e _touch_profile altera a entrada
+            profile = dict(self.repository.get_user_profile_dict(user_id))
+            self.profiles.set(user_id, profile, generation)
+        return dict(profile)
+
+    def get_conversation_summaries(self, user_id: str, limit: int = 5) -> List[str]:
+        summaries = self._cached_summaries(user_id, limit)
+        if summaries is _MISSING:
+            generation = self.summaries.generation(user_id)
+            summaries = self.repository.get_conversation_summaries(user_id, limit)
+            self.summaries.set(user_id, (limit, summaries), generation)
+        return list(summaries)
+
+    def get_knowledge(self, key: str) -> str:
+        value = self.knowledge.get(("key", key))
+        if value is _MISSING:
+            generation = self.knowledge.generation(("key", key))
+            value = self.repository.get_knowledge(key)
+            self.knowledge.set(("key", key), value, generation)
+        return value
+
+    def get_knowledge_by_category(self, category: str) -> List[Dict]:
+        items = self.knowledge.get(("category", category))
+        if items is _MISSING:
+            generation = self.knowledge.generation(("category", category))
+            items = self.repository.get_knowledge_by_category(category)
+            self.knowledge.set(("category", category), items, generation)
+        return list(items)
+
+    def search_knowledge(self, search_term: str, limit: Optional[int] = None, offset: int = 0,
+                         match_all: bool = True) -> List[Dict]:
+        cache_key = ("search", search_term, limit, offset, match_all)
+        items = self.knowledge.get(cache_key)
+        if items is _MISSING:
+            generation = self.knowledge.generation(cache_key)
+            items = self.repository.search_knowledge(search_term, limit, offset, match_all)
+            if len(items) <= self.max_search_rows:
+                self.knowledge.set(cache_key, items, generation)
+        return list(items)
+
+    # ========== ESCRITAS QUE INVALIDAM ==========
+
+    def add_message(self, user_id: str, role: str, content: str, metadata: Dict[str, Any] = None) -> Dict[str, int]:
+        result = self.repository.add_message(user_id, role, content, metadata)
+        self._touch_profile(user_id)
+        return result
+
+    def update_user_profile(self, user_id: str, updates: Dict[str, Any]):
+        self.profiles.invalidate(user_id)
+        profile = self.repository.update_user_profile(user_id, updates)
+        # Nova geração: leituras iniciadas antes do commit não sobrescrevem o perfil novo.
+        # O repositório devolve o perfil atualizado: o cache já fica quente para o próximo turno
+        self.profiles.invalidate(user_id)
+        self.profiles.set(user_id, profile)
+        return profile
+
+    def add_conversation_summary(self, user_id: str, *args, **kwargs) -> bool:
+        try:
+            return self.repository.add_conversation_summary(user_id, *args, **kwargs)
+        finally:
+            self.summaries.invalidate(user_id)
+
+    def roll_up_summaries(self, user_id: str, *args, **kwargs) -> bool:
+        try:
+            return self.repository.roll_up_summaries(user_id, *args, **kwargs)
+        finally:
+            self.summaries.invalidate(user_id)
+
+    def add_knowledge(self, *args, **kwargs):
+        try:
+            return self.repository.add_knowledge(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+    def update_knowledge(self, *args, **kwargs):
+        try:
+            return self.repository.update_knowledge(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+    def delete_knowledge(self, *args, **kwargs):
+        try:
+            return self.repository.delete_knowledge(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+    def bulk_add_knowledge(self, *args, **kwargs):
+        try:
+            return self.repository.bulk_add_knowledge(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+    def bulk_upsert_knowledge(self, *args, **kwargs):
+        try:
+            return self.repository.bulk_upsert_knowledge(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+    def delete_knowledge_by_category(self, *args, **kwargs):
+        try:
+            return self.repository.delete_knowledge_by_category(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+
+    # ========== CICLO DE VIDA ==========
+
+    def dispose(self):
+        """Retira as métricas do cache de ``instrumentation`` e libera o repositório"""
+        self._remove_collector()
+        self.repository.dispose()
+
+class AsyncCachedRepository(_CachedRepositoryBase):
+    """Cache read-through na frente de ``AsyncMemoryRepository``"""
+
+    # ========== LEITURAS EM CACHE ==========
+
+    async def get_user_profile_dict(self, user_id: str) -> Dict[str, Any]:
+        profile = self.profiles.get(user_id)
+        if profile is _MISSING:
+            generation = self.profiles.generation(user_id)
+            profile = dict(await self.repository.get_user_profile_dict(user_id))
+            self.profiles.set(user_id, profile, generation)
+        return dict(profile)
+
+    async def get_conversation_summaries(self, user_id: str, limit: int = 5) -> List[str]:
+        summaries = self._cached_summaries(user_id, limit)
+        if summaries is _MISSING:
+            generation = self.summaries.generation(user_id)
+            summaries = await self.repository.get_conversation_summaries(user_id, limit)
+            self.summaries.set(user_id, (limit, summaries), generation)
+        return list(summaries)
+
+    async def get_knowledge(self, key: str) -> str:
+        value = self.knowledge.get(("key", key))
+        if value is _MISSING:
+            generation = self.knowledge.generation(("key", key))
+            value = await self.repository.get_knowledge(key)
+            self.knowledge.set(("key", key), value, generation)
+        return value
+
+    async def get_knowledge_by_category(self, category: str) -> List[Dict]:
+        items = self.knowledge.get(("category", category))
+        if items is _MISSING:
+            generation = self.knowledge.generation(("category", category))
+            items = await self.repository.get_knowledge_by_category(category)
+            self.knowledge.set(("category", category), items, generation)
+        return list(items)
+
+    async def search_knowledge(self, search_term: str, limit: Optional[int] = None, offset: int = 0,
+                               match_all: bool = True) -> List[Dict]:
+        cache_key = ("search", search_term, limit, offset, match_all)
+        items = self.knowledge.get(cache_key)
+        if items is _MISSING:
+            generation = self.knowledge.generation(cache_key)
+            items = await self.repository.search_knowledge(search_term, limit, offset, match_all)
+            if len(items) <= self.max_search_rows:
+                self.knowledge.set(cache_key, items, generation)
+        return list(items)
+
+    # ========== ESCRITAS QUE INVALIDAM ==========
+
+    async def add_message(self, user_id: str, role: str, content: str, metadata: Dict[str, Any] = None) -> Dict[str, int]:
+        result = await self.repository.add_message(user_id, role, content, metadata)
+        self._touch_profile(user_id)
+        return result
+
+    async def update_user_profile(self, user_id: str, updates: Dict[str, Any]):
+        self.profiles.invalidate(user_id)
+        profile = await self.repository.update_user_profile(user_id, updates)
+        # Nova geração: leituras iniciadas antes do commit não sobrescrevem o perfil novo.
+        # O repositório devolve o perfil atualizado: o cache já fica quente para o próximo turno
+        self.profiles.invalidate(user_id)
+        self.profiles.set(user_id, profile)
+        return profile
+
+    async def add_conversation_summary(self, user_id: str, *args, **kwargs) -> bool:
+        try:
+            return await self.repository.add_conversation_summary(user_id, *args, **kwargs)
+        finally:
+            self.summaries.invalidate(user_id)
+
+    async def roll_up_summaries(self, user_id: str, *args, **kwargs) -> bool:
+        try:
+            return await self.repository.roll_up_summaries(user_id, *args, **kwargs)
+        finally:
+            self.summaries.invalidate(user_id)
+
+    async def add_knowledge(self, *args, **kwargs):
+        try:
+            return await self.repository.add_knowledge(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+    async def update_knowledge(self, *args, **kwargs):
+        try:
+            return await self.repository.update_knowledge(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+    async def delete_knowledge(self, *args, **kwargs):
+        try:
+            return await self.repository.delete_knowledge(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+    async def bulk_add_knowledge(self, *args, **kwargs):
+        try:
+            return await self.repository.bulk_add_knowledge(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+    async def bulk_upsert_knowledge(self, *args, **kwargs):
+        try:
+            return await self.repository.bulk_upsert_knowledge(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+    async def delete_knowledge_by_category(self, *args, **kwargs):
+        try:
+            return await self.repository.delete_knowledge_by_category(*args, **kwargs)
+        finally:
+            self.knowledge.clear()
+
+    # ========== CICLO DE VIDA ==========
+
+    async def dispose(self):
+        """Retira as métricas do cache de ``instrumentation`` e libera o repositório"""
+        self._remove_collector()
+        await self.repository.dispose()
@@ -0,0 +1,168 @@
+"""Codec de compressão do texto armazenado (mensagens e resumos antigos).
+
+Mensagens de chat são curtas: comprimidas uma a uma, quase não diminuem. Um
+dicionário compartilhado, montado a partir das próprias conversas, dá ao
+compressor o vocabulário comum e faz a diferença nesses textos curtos.
+
+- zstd (pacote opcional ``zstandard``), com dicionário treinado por
+  ``zstandard.train_dictionary``;
+- zlib (biblioteca padrão), DEFLATE cru com dicionário pré-definido (``zdict``,
+  até 32 KB) das sequências de palavras mais frequentes.
+
+Formato de cada valor: 1 byte de cabeçalho (algoritmo e se usa dicionário), o id
+do dicionário (8 bytes, prefixo do SHA-256 dele) e os dados comprimidos.
+Dicionários ficam na tabela ``compression_dictionaries`` e são registrados aqui
+(``register_dictionary``) para a descompressão.
+"""
+import hashlib
+import threading
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # opcional: sem ele, zlib
+    zstandard = None
+
+ZLIB, ZSTD = 1, 2
+ALGORITHMS = {"zlib": ZLIB, "zstd": ZSTD}
+_WITH_DICTIONARY = 0x10
+_ID_SIZE = 8
+ZLIB_DICTIONARY_SIZE = 32 * 1024  # janela do DEFLATE: bytes além disso não são usados
+
+_dictionaries: Dict[bytes, bytes] = {}  # id -> dicionário
+_local = threading.local()  # (des)compressores zstd por thread (não são thread-safe)
+
+
+def default_algorithm() -> str:
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def dictionary_id(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()[:_ID_SIZE]
+
+
+def register_dictionary(data: bytes) -> bytes:
+    """Disponibiliza um dicionário para ``decode``; retorna o id dele"""
+    key = dictionary_id(data)
+    _dictionaries[key] = data
+    return key
+
+
+def has_dictionary(blob: bytes) -> bool:
+    """Se ``decode(blob)`` tem o dicionário de que precisa"""
+    return not blob[0] & _WITH_DICTIONARY or bytes(blob[1:1 + _ID_SIZE]) in _dictionaries
+
+
+def _zstd_dictionary(data: bytes):
+    # Dicionário treinado (com o número mágico do zstd) ou conteúdo cru
+    return zstandard.ZstdCompressionDict(data)
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("Instale o pacote 'zstandard' para usar zstd (ou use algorithm='zlib')")
+
+
+class Codec:
+    """Comprime textos com um algoritmo e, opcionalmente, um dicionário compartilhado"""
+
+    def __init__(self, algorithm: str = None, level: int = None, dictionary: bytes = None):
+        self.algorithm = algorithm or default_algorithm()
+        if self.algorithm not in ALGORITHMS:
+            raise ValueError(f"Algoritmo desconhecido: {self.algorithm}")
+        if self.algorithm == "zstd":
+            _require_zstandard()
+        self.level = level if level is not None else (19 if self.algorithm == "zstd" else 9)
+        self.dictionary = dictionary
+        self._header = bytes([ALGORITHMS[self.algorithm] | (_WITH_DICTIONARY if dictionary else 0)])
+        if dictionary:
+            self._header += register_dictionary(dictionary)
+        self._zstd = None
+
+    def encode(self, text: str) -> Optional[bytes]:
+        """Valor comprimido, ou None se não ficar menor que o texto"""
+        raw = text.encode("utf-8")
+        if self.algorithm == "zstd":
+            if self._zstd is None:
+                self._zstd = zstandard.ZstdCompressor(
+                    level=self.level, write_checksum=False, write_content_size=True, write_dict_id=False,
+                    dict_data=_zstd_dictionary(self.dictionary) if self.dictionary else None)
+            payload = self._zstd.compress(raw)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY,
+                                          **({"zdict": self.dictionary} if self.dictionary else {}))
+            payload = compressor.compress(raw) + compressor.flush()
+        blob = self._header + payload
+        return blob if len(blob) < len(raw) else None
+
+
+def decode(blob: bytes) -> str:
+    """Texto original de um valor de ``Codec.encode``"""
+    blob = bytes(blob)
+    header = blob[0]
+    algorithm = header & 0x0F
+    offset, dictionary = 1, None
+    if header & _WITH_DICTIONARY:
+        key = blob[1:1 + _ID_SIZE]
+        dictionary = _dictionaries.get(key)
+        if dictionary is None:
+            raise KeyError(f"Dicionário de compressão {key.hex()} não registrado")
+        offset += _ID_SIZE
+    payload = blob[offset:]
+
+    if algorithm == ZSTD:
+        _require_zstandard()
+        decompressors = getattr(_local, "zstd", None)
+        if decompressors is None:
+            decompressors = _local.zstd = {}
+        key = blob[1:offset]
+        decompressor = decompressors.get(key)
+        if decompressor is None:
+            decompressor = decompressors[key] = zstandard.ZstdDecompressor(
+                dict_data=_zstd_dictionary(dictionary) if dictionary else None)
+        return decompressor.decompress(payload).decode("utf-8")
+    if algorithm == ZLIB:
+        decompressor = zlib.decompressobj(-15, **({"zdict": dictionary} if dictionary else {}))
+        return (decompressor.decompress(payload) + decompressor.flush()).decode("utf-8")
+    raise ValueError(f"Formato de compressão desconhecido: {header:#x}")
+
+
+# ========== DICIONÁRIOS ==========
+
+def train_dictionary(samples: Iterable[str], algorithm: str = None, size: int = 16 * 1024) -> bytes:
+    """Dicionário para textos parecidos com ``samples`` (ex.: mensagens recentes)"""
+    samples = [sample for sample in samples if sample]
+    algorithm = algorithm or default_algorithm()
+    if algorithm == "zstd":
+        _require_zstandard()
+        try:
+            return zstandard.train_dictionary(size, [sample.encode("utf-8") for sample in samples]).as_bytes()
+        except zstandard.ZstdError:
+            pass  # poucas amostras para treinar: usa o dicionário de conteúdo cru
+    return build_raw_dictionary(samples, min(size, ZLIB_DICTIONARY_SIZE) if algorithm == "zlib" else size)
+
+
+def build_raw_dictionary(samples: List[str], size: int = ZLIB_DICTIONARY_SIZE) -> bytes:
+    """Sequências de 1 a 4 palavras que mais economizariam, as mais valiosas no fim.
+
+    O DEFLATE encontra referências mais baratas perto do fim do dicionário, onde
+    a distância até o texto comprimido é menor.
+    """
+    counts: Counter = Counter()
+    for sample in samples:
+        words = sample.split()
+        for n in range(1, 5):
+            for start in range(len(words) - n + 1):
+                counts[" ".join(words[start:start + n])] += 1
+    ranked = sorted((gram for gram, count in counts.items() if count > 1 and len(gram) > 3),
+                    key=lambda gram: counts[gram] * len(gram), reverse=True)
+    picked, total = [], 0
+    for gram in ranked:
+        piece = (gram + " ").encode("utf-8")
+        if total + len(piece) > size:
+            continue
+        picked.append(piece)
+        total += len(piece)
+    return b"".join(reversed(picked))
@@ -0,0 +1,205 @@
+"""Job de compressão do texto das mensagens antigas.
+
+Mensagens mais antigas que ``older_than_days`` passam a ficar em
+``messages.content_compressed`` (``content`` fica vazio), comprimidas com zstd,
+ou com zlib se o pacote ``zstandard`` não estiver instalado, e um dicionário
+compartilhado treinado com as mensagens recentes (ver codec.py). A leitura
+continua transparente: ``get_recent_messages``, ``iter_messages``,
+``export_user`` e ``Message.to_dict()`` devolvem o texto original.
+
+Resumos que já foram absorvidos por um resumo de nível superior (``parent_id``)
+também são comprimidos (``conversation_summaries.summary_compressed``): saem
+de todas as leituras do turno e só voltam em ``export_user``. Os resumos
+ativos continuam em texto, porque entram no contexto de toda resposta.
+
+Percorre as tabelas por faixas de id, fora do caminho das requisições, com
+limite opcional de linhas por segundo. Roda como tarefa agendada
+(``start``/``stop``) ou pela linha de comando; ``--report`` mostra os bytes
+economizados e o custo de descompressão na leitura.
+
+Uso: python compression.py [--database-url sqlite:///memory.db] [--older-than-days 30] [--algorithm zstd|zlib]
+                           [--rows-per-second 5000] [--interval 3600] [--report] [--vacuum]
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+import codec
+from db import DatabaseConfig
+import instrumentation
+from repository import MemoryRepository
+
+
+class CompressionJob:
+    """Comprime as mensagens antigas de todos os usuários"""
+
+    def __init__(self, repository: MemoryRepository, older_than_days: float = 30, algorithm: str = None,
+                 level: int = None, train: bool = True, dictionary_size: int = 16 * 1024, sample_size: int = 2000,
+                 batch_size: int = 1000, max_rows_per_second: float = None):
+        self.repository = repository
+        self.older_than_days = older_than_days
+        self.algorithm = algorithm or codec.default_algorithm()
+        self.level = level
+        self.train = train
+        self.dictionary_size = dictionary_size
+        self.sample_size = sample_size
+        self.batch_size = batch_size
+        self.max_rows_per_second = max_rows_per_second
+        self._codec: Optional[codec.Codec] = None
+        self._after_id = 0  # retoma de onde a passada anterior parou (mensagens só crescem no fim)
+        self._task: Optional[asyncio.Task] = None
+
+    def get_codec(self) -> codec.Codec:
+        """Codec com o dicionário mais recente do banco; treina um na primeira vez"""
+        if self._codec is None:
+            dictionary = None
+            if self.train:
+                dictionary = self.repository.get_compression_dictionary(self.algorithm)
+                if dictionary is None:
+                    samples = self.repository.sample_message_contents(self.sample_size)
+                    if samples:
+                        dictionary = codec.train_dictionary(samples, self.algorithm, self.dictionary_size)
+                        key = self.repository.add_compression_dictionary(self.algorithm, dictionary)
+                        print(f"📚 Trained {self.algorithm} dictionary {key} ({len(dictionary)} bytes, "
+                              f"{len(samples)} samples)")
+            self._codec = codec.Codec(self.algorithm, self.level, dictionary)
+        return self._codec
+
+    def run_once(self) -> Dict[str, Any]:
+        """Executa uma passada; retorna as estatísticas"""
+        stats = {"rows": 0, "compressed": 0, "bytes_before": 0, "bytes_after": 0, "batches": 0,
+                 "summaries_compressed": 0}
+        before = datetime.now() - timedelta(days=self.older_than_days)
+        started = time.monotonic()
+        message_codec = self.get_codec()
+
+        after_id = self._after_id
+        while after_id is not None:
+            batch, next_after_id = self.repository.compress_messages(message_codec, before, after_id,
+                                                                     self.batch_size)
+            for key, value in batch.items():
+                stats[key] += value
+            stats["batches"] += 1
+            if next_after_id is None:
+                # Próxima passada começa antes da primeira mensagem recente deste lote
+                self._after_id = after_id
+            after_id = next_after_id
+            self._throttle(stats["rows"], started)
+
+        # Resumos absorvidos: poucos (um a cada dezenas de mensagens) e sem ordem de
+        # absorção por id, então cada passada percorre a tabela toda
+        after_id = 0
+        while after_id is not None:
+            batch, after_id = self.repository.compress_summaries(message_codec, before, after_id, self.batch_size)
+            for key in ("rows", "bytes_before", "bytes_after"):
+                stats[key] += batch[key]
+            stats["summaries_compressed"] += batch["compressed"]
+            stats["batches"] += 1
+            self._throttle(stats["rows"], started)
+
+        stats["seconds"] = round(time.monotonic() - started, 3)
+        instrumentation.inc("memory_messages_compressed_total", stats["compressed"])
+        instrumentation.inc("memory_summaries_compressed_total", stats["summaries_compressed"])
+        instrumentation.inc("memory_compression_bytes_saved_total", stats["bytes_before"] - stats["bytes_after"])
+        if stats["compressed"] or stats["summaries_compressed"]:
+            print(f"🗜️ Compressed {stats['compressed']} messages and {stats['summaries_compressed']} summaries: "
+                  f"{stats['bytes_before']:,} -> {stats['bytes_after']:,} bytes")
+        return stats
+
+    def _throttle(self, rows: int, started: float):
+        """Dorme o necessário para não passar de ``max_rows_per_second``"""
+        if not self.max_rows_per_second:
+            return
+        wait = rows / self.max_rows_per_second - (time.monotonic() - started)
+        if wait > 0:
+            time.sleep(wait)
+
+    # ========== EXECUÇÃO AGENDADA ==========
+
+    async def start(self, interval: float = 3600.0):
+        """Executa ``run_once`` a cada ``interval`` segundos em segundo plano"""
+        self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, interval: float):
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                print(f" Compression job failed: {e}")
+            await asyncio.sleep(interval)
+
+
+def report(repository: MemoryRepository, sample_size: int = 1000) -> Dict[str, Any]:
+    """Bytes economizados (estimados por amostra) e custo de descompressão por mensagem lida"""
+    stats = repository.get_storage_stats()
+    blobs = repository.sample_compressed_messages(sample_size)
+    ratio = decode_us = None
+    if blobs:
+        started = time.perf_counter()
+        texts = [codec.decode(blob) for blob in blobs]
+        decode_us = (time.perf_counter() - started) / len(blobs) * 1e6
+        ratio = sum(len(text.encode("utf-8")) for text in texts) / sum(len(blob) for blob in blobs)
+    original = round(stats["compressed_bytes"] * ratio) if ratio else 0
+    return dict(stats, ratio=ratio, estimated_original_bytes=original,
+                bytes_saved=original - stats["compressed_bytes"], decode_us=decode_us)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite:///memory.db", help="URL do banco")
+    parser.add_argument("--older-than-days", type=float, default=30, help="Comprime mensagens mais antigas que isso")
+    parser.add_argument("--algorithm", choices=sorted(codec.ALGORITHMS), help="Padrão: zstd se instalado, senão zlib")
+    parser.add_argument("--level", type=int, help="Nível de compressão")
+    parser.add_argument("--no-dictionary", action="store_true", help="Comprime sem dicionário compartilhado")
+    parser.add_argument("--rows-per-second", type=float, help="Limite de mensagens processadas por segundo")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Ids por lote")
+    parser.add_argument("--interval", type=float, help="Repete a cada N segundos (padrão: uma vez)")
+    parser.add_argument("--report", action="store_true", help="Só mostra o relatório, sem comprimir")
+    parser.add_argument("--vacuum", action="store_true", help="SQLite: VACUUM no fim para devolver o espaço ao disco")
+    args = parser.parse_args()
+
+    repository = MemoryRepository(DatabaseConfig(args.database_url))
+    try:
+        if args.report:
+            result = report(repository)
+            print(f"Mensagens: {result['messages']:,} | comprimidas: {result['compressed']:,} | "
+                  f"texto sem compressão: {result['text_bytes']:,} bytes | comprimido: "
+                  f"{result['compressed_bytes']:,} bytes")
+            if result["ratio"]:
+                print(f"Economia estimada: {result['bytes_saved']:,} bytes (taxa {result['ratio']:.2f}x) | "
+                      f"descompressão: {result['decode_us']:.1f} µs/mensagem "
+                      f"(~{result['decode_us'] * 10:.0f} µs em get_recent_messages(10))")
+            return
+        job = CompressionJob(repository, older_than_days=args.older_than_days, algorithm=args.algorithm,
+                             level=args.level, train=not args.no_dictionary, batch_size=args.batch_size,
+                             max_rows_per_second=args.rows_per_second)
+        while True:
+            stats = job.run_once()
+            print(f"Comprimidas: {stats['compressed']} mensagens e {stats['summaries_compressed']} resumos "
+                  f"de {stats['rows']} linhas | "
+                  f"{stats['bytes_before']:,} -> {stats['bytes_after']:,} bytes | "
+                  f"lotes: {stats['batches']} | {stats['seconds']}s")
+            if args.interval is None:
+                break
+            time.sleep(args.interval)
+        if args.vacuum and repository.engine.dialect.name == "sqlite":
+            with repository.engine.connect() as connection:
+                connection.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        repository.dispose()
+
+
+if __name__ == "__main__":
+    main()
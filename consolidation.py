@@ -0,0 +1,246 @@
+import asyncio
+import inspect
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple, Union
+
+import instrumentation
+from repository import MemoryRepository
+
+EXTRACT = "extract"
+SUMMARIZE = "summarize"
+
+
+class Job:
+    """Tarefa de consolidação para um usuário"""
+    __slots__ = ("kind", "user_id", "attempts", "id")
+
+    def __init__(self, kind: str, user_id: str, attempts: int = 0, id: Optional[int] = None):
+        self.kind = kind
+        self.user_id = user_id
+        self.attempts = attempts
+        self.id = id
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return (self.kind, self.user_id)
+
+    def __repr__(self):
+        return f"Job(kind={self.kind!r}, user_id={self.user_id!r}, attempts={self.attempts})"
+
+
+class InMemoryJobQueue:
+    """Fila em processo (asyncio.Queue) com deduplicação por (kind, user_id).
+
+    Tarefas iguais ainda pendentes são coalescidas: a consolidação lê o estado
+    atual do usuário quando executa, então rodar uma vez é suficiente.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._pending: Set[Tuple[str, str]] = set()
+
+    def put_nowait(self, kind: str, user_id: str) -> bool:
+        """Enfileira sem bloquear; retorna False se a fila estiver cheia"""
+        if (kind, user_id) in self._pending:
+            return True
+        try:
+            self._queue.put_nowait(Job(kind, user_id))
+        except asyncio.QueueFull:
+            return False
+        self._pending.add((kind, user_id))
+        return True
+
+    async def put(self, kind: str, user_id: str):
+        """Enfileira aguardando espaço na fila (backpressure)"""
+        if (kind, user_id) in self._pending:
+            return
+        self._pending.add((kind, user_id))
+        await self._queue.put(Job(kind, user_id))
+
+    async def get(self) -> Job:
+        job = await self._queue.get()
+        # Sai do conjunto de pendentes ao iniciar: novos gatilhos durante a
+        # execução geram uma nova tarefa que verá o estado mais recente
+        self._pending.discard(job.key)
+        job.attempts += 1
+        return job
+
+    def complete(self, job: Job):
+        self._queue.task_done()
+
+    def retry(self, job: Job, error: str):
+        # Reenfileira antes do task_done para que join() não termine no meio da retentativa
+        if job.key not in self._pending:
+            try:
+                self._queue.put_nowait(job)
+                self._pending.add(job.key)
+            except asyncio.QueueFull:
+                print(f" Consolidation queue full, dropping retry of {job}")
+        self._queue.task_done()
+
+    def fail(self, job: Job, error: str):
+        self._queue.task_done()
+
+    # Versões assíncronas (mesma interface de DatabaseJobQueue); aqui nada bloqueia
+
+    async def put_nowait_async(self, kind: str, user_id: str) -> bool:
+        return self.put_nowait(kind, user_id)
+
+    async def complete_async(self, job: Job):
+        self.complete(job)
+
+    async def retry_async(self, job: Job, error: str):
+        self.retry(job, error)
+
+    async def fail_async(self, job: Job, error: str):
+        self.fail(job, error)
+
+    async def recover(self):
+        """Nada a recuperar: a fila em memória não sobrevive ao processo"""
+
+    async def join(self):
+        await self._queue.join()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+
+class DatabaseJobQueue:
+    """Fila durável na tabela ``consolidation_jobs`` do mesmo banco.
+
+    Sobrevive a reinícios e pode ser consumida por vários processos; tarefas
+    são reservadas com um UPDATE condicional (pending -> running). Os métodos
+    síncronos acessam o banco no thread do chamador; dentro do event loop use
+    as versões ``*_async``, que rodam em threads via ``asyncio.to_thread``.
+    """
+
+    def __init__(self, repository: MemoryRepository, poll_interval: float = 0.5, max_size: int = 10000):
+        self.repository = repository
+        self.poll_interval = poll_interval
+        self.max_size = max_size
+
+    def put_nowait(self, kind: str, user_id: str) -> bool:
+        if self.repository.get_pending_consolidation_count() >= self.max_size:
+            return False
+        self.repository.enqueue_consolidation_job(kind, user_id)
+        return True
+
+    async def put_nowait_async(self, kind: str, user_id: str) -> bool:
+        return await asyncio.to_thread(self.put_nowait, kind, user_id)
+
+    async def put(self, kind: str, user_id: str):
+        while not await self.put_nowait_async(kind, user_id):
+            await asyncio.sleep(self.poll_interval)
+
+    async def get(self) -> Job:
+        while True:
+            record = await asyncio.to_thread(self.repository.claim_consolidation_job)
+            if record:
+                return Job(record["kind"], record["user_id"], attempts=record["attempts"], id=record["id"])
+            await asyncio.sleep(self.poll_interval)
+
+    def complete(self, job: Job):
+        self.repository.complete_consolidation_job(job.id)
+
+    def retry(self, job: Job, error: str):
+        self.repository.fail_consolidation_job(job.id, error, retry=True)
+
+    def fail(self, job: Job, error: str):
+        self.repository.fail_consolidation_job(job.id, error, retry=False)
+
+    async def complete_async(self, job: Job):
+        await asyncio.to_thread(self.complete, job)
+
+    async def retry_async(self, job: Job, error: str):
+        await asyncio.to_thread(self.retry, job, error)
+
+    async def fail_async(self, job: Job, error: str):
+        await asyncio.to_thread(self.fail, job, error)
+
+    async def recover(self):
+        """Devolve à fila tarefas que estavam em execução quando o processo caiu"""
+        await asyncio.to_thread(self.repository.requeue_running_consolidation_jobs)
+
+    async def join(self):
+        while await asyncio.to_thread(self.repository.get_pending_consolidation_count, True):
+            await asyncio.sleep(self.poll_interval)
+
+    def qsize(self) -> int:
+        return self.repository.get_pending_consolidation_count()
+
+
+JobHandler = Callable[[str], Union[None, Awaitable[None]]]
+
+
+class ConsolidationWorker:
+    """Executa tarefas de consolidação em segundo plano com concorrência limitada.
+
+    ``handlers`` mapeia o tipo da tarefa para uma função que recebe o
+    ``user_id``. Funções síncronas (chamadas bloqueantes ao LLM) rodam em
+    threads via ``asyncio.to_thread``; corrotinas são aguardadas diretamente.
+    Falhas são reexecutadas até ``max_retries`` vezes com backoff exponencial.
+    """
+
+    def __init__(self, handlers: Dict[str, JobHandler], queue=None, concurrency: int = 2,
+                 max_retries: int = 3, retry_backoff: float = 0.5):
+        self.handlers = handlers
+        self.queue = queue if queue is not None else InMemoryJobQueue()
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._tasks = []
+        self.processed = 0
+        self.failed = 0
+
+    def submit(self, kind: str, user_id: str) -> bool:
+        """Enfileira sem bloquear; False indica fila cheia (o chamador decide o que fazer)"""
+        return self.queue.put_nowait(kind, user_id)
+
+    async def submit_async(self, kind: str, user_id: str) -> bool:
+        """``submit`` para chamadores no event loop (a fila no banco roda em thread)"""
+        return await self.queue.put_nowait_async(kind, user_id)
+
+    async def submit_wait(self, kind: str, user_id: str):
+        """Enfileira aguardando espaço na fila"""
+        await self.queue.put(kind, user_id)
+
+    async def start(self):
+        await self.queue.recover()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self, drain: bool = True):
+        """Para os workers; com ``drain`` aguarda a fila esvaziar antes"""
+        if drain:
+            await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            handler = self.handlers.get(job.kind)
+            try:
+                if handler is None:
+                    raise ValueError(f"Tipo de tarefa desconhecido: {job.kind}")
+                if inspect.iscoroutinefunction(handler):
+                    await handler(job.user_id)
+                else:
+                    await asyncio.to_thread(handler, job.user_id)
+            except asyncio.CancelledError:
+                # Já cancelada: devolve a tarefa sem aguardar outra vez
+                self.queue.retry(job, "cancelled")
+                raise
+            except Exception as e:
+                if job.attempts < self.max_retries:
+                    await asyncio.sleep(self.retry_backoff * (2 ** (job.attempts - 1)))
+                    await self.queue.retry_async(job, str(e))
+                else:
+                    self.failed += 1
+                    instrumentation.inc("memory_consolidation_jobs_total", kind=job.kind, status="failed")
+                    await self.queue.fail_async(job, str(e))
+                    print(f" Consolidation job {job} failed: {str(e)}")
+            else:
+                self.processed += 1
+                instrumentation.inc("memory_consolidation_jobs_total", kind=job.kind, status="ok")
+                await self.queue.complete_async(job)
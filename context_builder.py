@@ -0,0 +1,150 @@
+"""Montagem do contexto enviado ao LLM dentro de um orçamento de tokens.
+
+As partes entram por prioridade (sistema > perfil > resumos > turnos recentes >
+conhecimento); o que não couber é truncado ou descartado, começando pelas de
+menor prioridade. A contagem usa o tiktoken quando instalado e, sem ele, uma
+estimativa de ~4 caracteres por token.
+"""
+import math
+from functools import lru_cache
+from typing import Dict, List
+
+try:
+    import tiktoken
+except ImportError:  # dependência opcional
+    tiktoken = None
+
+# Custo fixo de cada mensagem no formato de chat (papel + separadores) e da
+# preparação da resposta, conforme a contagem documentada pela OpenAI
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+CHARS_PER_TOKEN = 4
+
+TOKEN_COUNT_KEY = "token_count"
+
+
+class TokenCounter:
+    """Conta tokens de textos e mensagens, com cache por texto"""
+
+    def __init__(self, model: str = "gpt-3.5-turbo", cache_size: int = 4096):
+        self.model = model
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                # Sem acesso aos arquivos de encoding (ex.: máquina offline): usa a estimativa
+                self.encoding = None
+        self._count_cached = lru_cache(maxsize=cache_size)(self._count)
+
+    def _count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def count(self, text: str) -> int:
+        """Tokens de um texto (resumos, prompts e conhecimento se repetem entre turnos)"""
+        if not text:
+            return 0
+        return self._count_cached(text)
+
+    def count_message(self, message: Dict) -> int:
+        """Tokens de uma mensagem de chat.
+
+        Mensagens da memória de curto prazo guardam a contagem em
+        ``message["token_count"]``; assim cada mensagem é contada uma única vez.
+        """
+        cached = message.get(TOKEN_COUNT_KEY)
+        if cached is None:
+            cached = self._count(message.get("content") or "") + MESSAGE_OVERHEAD
+            message[TOKEN_COUNT_KEY] = cached
+        return cached
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Corta o texto para caber em ``max_tokens`` (mantém o início)"""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.encoding is not None:
+            return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max_tokens])
+        return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+class ContextBuilder:
+    """Preenche o orçamento de tokens do prompt por prioridade"""
+
+    def __init__(self, counter: TokenCounter, budget: int = 3000):
+        self.counter = counter
+        self.budget = budget
+
+    def build(self, system: str, profile: str = "", summaries: List[str] = None,
+              history: List[Dict] = None, knowledge: List[str] = None) -> List[Dict]:
+        """Monta as mensagens do prompt.
+
+        ``summaries`` e ``knowledge`` vêm do mais para o menos relevante e
+        ``history`` da mensagem mais antiga para a mais recente. Resumos e
+        conhecimento entram inteiros ou são descartados; do histórico entram os
+        turnos mais recentes que couberem (a última mensagem é truncada se não
+        couber sozinha).
+        """
+        remaining = self.budget - REPLY_OVERHEAD
+
+        # 1-2. Sistema e perfil formam a primeira mensagem; são truncados, nunca descartados
+        remaining -= MESSAGE_OVERHEAD
+        system = self.counter.truncate(system, remaining)
+        remaining -= self.counter.count(system)
+        profile = self.counter.truncate(profile, remaining) if profile else ""
+        remaining -= self.counter.count(profile)
+        messages = [{"role": "system", "content": system + profile}]
+
+        # 3. Resumos, do mais recente para o mais antigo
+        summary_header = "Resumos de conversas anteriores:\n"
+        selected_summaries, remaining = self._fill(summary_header, summaries or [], remaining)
+
+        # 4. Turnos recentes, do mais novo para o mais antigo
+        selected_history = []
+        for msg in reversed(history or []):
+            cost = self.counter.count_message(msg)
+            if cost > remaining:
+                if not selected_history and remaining > MESSAGE_OVERHEAD:
+                    content = self.counter.truncate(msg["content"], remaining - MESSAGE_OVERHEAD)
+                    selected_history.append({"role": msg["role"], "content": content})
+                    remaining = 0
+                break
+            selected_history.append({"role": msg["role"], "content": msg["content"]})
+            remaining -= cost
+        selected_history.reverse()
+
+        # 5. Conhecimento com o que sobrar
+        knowledge_header = "Memórias e conhecimento relevantes:\n"
+        selected_knowledge, remaining = self._fill(knowledge_header, knowledge or [], remaining)
+
+        if selected_summaries:
+            messages.append({"role": "system", "content": summary_header + "\n\n".join(selected_summaries)})
+        if selected_knowledge:
+            messages.append({"role": "system", "content": knowledge_header + "\n".join(selected_knowledge)})
+        messages.extend(selected_history)
+        return messages
+
+    def _fill(self, header: str, items: List[str], remaining: int):
+        """Seleciona itens inteiros, em ordem, enquanto couberem (com o cabeçalho)"""
+        if not items:
+            return [], remaining
+        fixed = MESSAGE_OVERHEAD + self.counter.count(header)
+        if fixed >= remaining:
+            return [], remaining
+        budget = remaining - fixed
+        selected = []
+        for item in items:
+            # +2 tokens, aproximadamente, pelo separador entre itens
+            cost = self.counter.count(item) + 2
+            if cost > budget:
+                continue
+            selected.append(item)
+            budget -= cost
+        if not selected:
+            return [], remaining
+        return selected, budget
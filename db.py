@@ -1,16 +1,42 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional
 
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 # Classe de Configuração do Banco
 class DatabaseConfig:
-    def __init__(self, database_url: str = "sqlite:///memory.db", database_type="sqlite", **kwargs):
+    def __init__(self, database_url: str = "sqlite:///memory.db", database_type="sqlite",
+                 pool_size: int = 5, max_overflow: int = 10, pool_recycle: int = 1800,
+                 pool_timeout: float = 30, busy_timeout_ms: int = 5000,
+                 replica_urls: List[str] = None, sticky_seconds: float = 5.0,
+                 replica_retry_seconds: float = 30.0, **kwargs):
         self.database_type = database_type.lower()
-        
+        # Parâmetros do pool (compartilhado por todos os repositórios da mesma URL)
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_recycle = pool_recycle
+        self.pool_timeout = pool_timeout
+        # SQLite: quanto um escritor espera pelo lock antes de "database is locked"
+        self.busy_timeout_ms = busy_timeout_ms
+        # Réplicas de leitura (URLs completas): leituras vão para elas, escritas para o primário.
+        # Depois de escrever, o usuário lê do primário por sticky_seconds (read-your-writes);
+        # uma réplica com erro de conexão fica fora por replica_retry_seconds
+        self.replica_urls = list(replica_urls or [])
+        self.sticky_seconds = sticky_seconds
+        self.replica_retry_seconds = replica_retry_seconds
+
         if self.database_type == "sqlite":
             #db_path = kwargs.get("db_path", "memory.db")
             self.connection_string = database_url #f"sqlite:///{db_path}"
+        elif self.database_type == "postgresql" and make_url(database_url).get_backend_name() == "postgresql":
+            # URL completa do PostgreSQL (ex.: réplicas): usada como está
+            self.connection_string = database_url
         elif self.database_type == "postgresql":
             host = kwargs.get("host", "localhost")
             port = kwargs.get("port", 5432)
@@ -20,3 +46,241 @@ class DatabaseConfig:
             self.connection_string = f"postgresql://{username}:{password}@{host}:{port}/{database}"
         else:
             raise ValueError("Tipo de banco não suportado. Use 'sqlite' ou 'postgresql'")
+
+    @property
+    def async_connection_string(self) -> str:
+        """Connection string com driver assíncrono (aiosqlite/asyncpg)"""
+        if self.connection_string.startswith("sqlite:"):
+            return self.connection_string.replace("sqlite:", "sqlite+aiosqlite:", 1)
+        if self.connection_string.startswith("postgresql:"):
+            return self.connection_string.replace("postgresql:", "postgresql+asyncpg:", 1)
+        return self.connection_string
+
+    def replica_configs(self) -> List["DatabaseConfig"]:
+        """Uma configuração por réplica, com os mesmos parâmetros de pool"""
+        return [DatabaseConfig(url, make_url(url).get_backend_name(),
+                               pool_size=self.pool_size, max_overflow=self.max_overflow,
+                               pool_recycle=self.pool_recycle, pool_timeout=self.pool_timeout,
+                               busy_timeout_ms=self.busy_timeout_ms)
+                for url in self.replica_urls]
+
+    @property
+    def is_sqlite_memory(self) -> bool:
+        """SQLite em memória: um banco por conexão, sem WAL nem pool compartilhado"""
+        url = make_url(self.connection_string)
+        return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+    def engine_options(self) -> Dict[str, Any]:
+        """Argumentos de ``create_engine``/``create_async_engine`` para esta configuração"""
+        options: Dict[str, Any] = {"echo": False}  # Mude para True para ver as queries SQL
+        if self.connection_string.startswith("sqlite"):
+            if not self.is_sqlite_memory:
+                # Arquivo SQLite: pool de conexões reaproveitadas (WAL permite leitores concorrentes)
+                options.update(pool_size=self.pool_size, max_overflow=self.max_overflow,
+                               pool_timeout=self.pool_timeout)
+            return options
+        options.update(pool_size=self.pool_size, max_overflow=self.max_overflow,
+                       pool_recycle=self.pool_recycle, pool_timeout=self.pool_timeout,
+                       pool_pre_ping=self.database_type == "postgresql")
+        return options
+
+
+# ========== REGISTRO DE ENGINES DO PROCESSO ==========
+#
+# Todos os repositórios que apontam para a mesma URL compartilham um único
+# engine (e o seu pool de conexões). Cada repositório adquire uma referência ao
+# ser criado e a devolve no ``dispose()``; o pool só é fechado quando a última
+# referência é devolvida. O esquema (create_all + migrações) roda uma vez por
+# banco no processo, no primeiro acesso.
+
+_registry_lock = threading.Lock()
+_schema_lock = threading.Lock()
+_engines: Dict[str, list] = {}        # url -> [engine, referências]
+_async_engines: Dict[str, list] = {}  # url assíncrona -> [engine, referências]
+_schemas: Dict[str, Any] = {}         # url síncrona -> resultado da inicialização do esquema
+
+
+def _set_sqlite_pragmas(busy_timeout_ms: int, wal: bool):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        if wal:
+            # WAL: leitores não bloqueiam o escritor; NORMAL é seguro em WAL e evita fsync por commit
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.close()
+    return on_connect
+
+
+def _configure(engine: Engine, config: DatabaseConfig) -> Engine:
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas(config.busy_timeout_ms, not config.is_sqlite_memory))
+    return engine
+
+
+def acquire_engine(config: DatabaseConfig) -> Engine:
+    """Engine compartilhado da URL de ``config`` (criado na primeira chamada)"""
+    url = config.connection_string
+    with _registry_lock:
+        entry = _engines.get(url)
+        if entry is None:
+            entry = _engines[url] = [_configure(create_engine(url, **config.engine_options()), config), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def _find(registry: Dict[str, list], engine):
+    for url, entry in registry.items():
+        if entry[0] is engine:
+            return url, entry
+    return None, None
+
+
+def release_engine(engine: Engine):
+    """Devolve uma referência; fecha o pool quando nenhum repositório usa mais o engine"""
+    with _registry_lock:
+        url, entry = _find(_engines, engine)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del _engines[url]
+            # SQLite em memória some com as conexões: o esquema precisa ser recriado
+            if make_url(url).database in (None, "", ":memory:"):
+                _schemas.pop(url, None)
+    engine.dispose()
+
+
+def acquire_async_engine(config: DatabaseConfig):
+    """Engine assíncrono compartilhado da URL de ``config``"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = config.async_connection_string
+    with _registry_lock:
+        entry = _async_engines.get(url)
+        if entry is None:
+            engine = create_async_engine(url, **config.engine_options())
+            _configure(engine.sync_engine, config)
+            entry = _async_engines[url] = [engine, 0]
+        entry[1] += 1
+        return entry[0]
+
+
+async def release_async_engine(engine):
+    """Versão assíncrona de ``release_engine``"""
+    with _registry_lock:
+        url, entry = _find(_async_engines, engine)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del _async_engines[url]
+    await engine.dispose()
+
+
+class ReplicaRouter:
+    """Escolhe onde cada leitura roda: uma réplica saudável ou o primário.
+
+    - A réplica com menos leituras em andamento é a escolhida; empates se
+      alternam em rodízio.
+    - Uma chave (usuário) que escreveu há menos de ``sticky_seconds`` lê do
+      primário, para não ver uma réplica atrasada (read-your-writes).
+    - Uma réplica com erro fica fora por ``retry_seconds`` e a leitura tenta a
+      próxima; sem réplicas disponíveis, o primário atende.
+    """
+
+    def __init__(self, configs: List[DatabaseConfig], sticky_seconds: float = 5.0,
+                 retry_seconds: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.urls = [config.connection_string for config in configs]
+        self.engines = [acquire_engine(config) for config in configs]
+        self.sticky_seconds = sticky_seconds
+        self.retry_seconds = retry_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._in_flight = [0] * len(self.engines)
+        self._down_until = [0.0] * len(self.engines)
+        self._turn = 0
+        self._writes: Dict[Hashable, float] = {}  # chave -> fim da janela de read-your-writes
+        self._sweep_at = 1024
+
+    def note_write(self, key: Hashable):
+        """Registra uma escrita de ``key``: as leituras dela vão para o primário por ``sticky_seconds``"""
+        if key is None or not self.sticky_seconds:
+            return
+        now = self.clock()
+        with self._lock:
+            self._writes[key] = now + self.sticky_seconds
+            if len(self._writes) >= self._sweep_at:
+                self._writes = {k: until for k, until in self._writes.items() if until > now}
+                self._sweep_at = max(1024, 2 * len(self._writes))
+
+    def candidates(self, key: Optional[Hashable] = None) -> List[int]:
+        """Índices das réplicas a tentar, em ordem (vazio: ler do primário)"""
+        now = self.clock()
+        with self._lock:
+            if key is not None and self._writes.get(key, 0.0) > now:
+                return []
+            healthy = [index for index in range(len(self.engines)) if self._down_until[index] <= now]
+            if not healthy:
+                return []
+            start = self._turn % len(healthy)
+            self._turn += 1
+            rotated = healthy[start:] + healthy[:start]
+            return sorted(rotated, key=lambda index: self._in_flight[index])
+
+    @contextmanager
+    def reading(self, index: int):
+        """Conta a leitura em andamento na réplica ``index``"""
+        with self._lock:
+            self._in_flight[index] += 1
+        try:
+            yield self.engines[index]
+        finally:
+            with self._lock:
+                self._in_flight[index] -= 1
+
+    def mark_down(self, index: int):
+        with self._lock:
+            self._down_until[index] = self.clock() + self.retry_seconds
+
+    def status(self) -> List[Dict[str, Any]]:
+        now = self.clock()
+        with self._lock:
+            return [{"url": url, "up": self._down_until[index] <= now, "in_flight": self._in_flight[index]}
+                    for index, url in enumerate(self.urls)]
+
+    def dispose(self):
+        for engine in self.engines:
+            release_engine(engine)
+        self.engines = []
+
+
+def ensure_schema(config: DatabaseConfig, create: Callable[[], Any]) -> Any:
+    """Executa ``create`` uma única vez por banco no processo e guarda o resultado"""
+    url = config.connection_string
+    if url in _schemas:
+        return _schemas[url]
+    with _schema_lock:
+        if url not in _schemas:
+            _schemas[url] = create()
+        return _schemas[url]
+
+
+def schema_ready(config: DatabaseConfig) -> bool:
+    return config.connection_string in _schemas
+
+
+def mark_schema_ready(config: DatabaseConfig, result: Any):
+    """Registra o esquema criado por fora de ``ensure_schema`` (ex.: pelo repositório assíncrono)"""
+    with _schema_lock:
+        _schemas.setdefault(config.connection_string, result)
+
+
+def dispose_engines():
+    """Fecha todos os engines síncronos do registro (ex.: ao encerrar o processo ou em testes)"""
+    with _registry_lock:
+        engines = [entry[0] for entry in _engines.values()]
+        _engines.clear()
+        _schemas.clear()
+    for engine in engines:
+        engine.dispose()
@@ -0,0 +1,287 @@
+"""Agendamento adaptativo da extração de perfil, guiado pelo ganho de informação.
+
+O gatilho fixo (``consolidation_threshold`` mensagens na memória de curto prazo)
+continua verdadeiro a cada turno depois de atingido: uma chamada extra ao LLM
+por mensagem. O ``ExtractionScheduler`` guarda, por usuário, as mensagens ainda
+não consolidadas e um placar de ganho de informação calculado localmente:
+
+- autorrevelação ("meu nome é", "eu gosto de", "I like", "I work as"...) vale
+  uma extração sozinha;
+- termos novos na conversa do usuário (nomes próprios pesam mais que
+  palavras-chave) somam aos poucos;
+- mensagens curtas ("ok", "obrigado") e do assistente não somam.
+
+Um usuário fica pronto quando o placar chega a ``gain_threshold``, quando
+acumula ``max_pending`` mensagens ou quando tem ganho pendente há mais de
+``max_staleness`` segundos (redes de segurança para o que as heurísticas não
+pegam). Usuários prontos são extraídos juntos, até ``batch_size`` por
+chamada ao LLM, quando o lote enche ou o mais antigo espera ``max_batch_delay``
+segundos. Sem tarefa em segundo plano (``start``), o agente descarrega os lotes
+no próprio ``add_message``.
+
+O estado por usuário (pendências e vocabulário já visto) fica em um LRU de até
+``max_users`` usuários, como a memória de curto prazo; só usuários sem
+mensagens pendentes são descartados.
+"""
+import asyncio
+import inspect
+import re
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+# Padrões de autorrevelação (português e inglês)
+SELF_DISCLOSURE = re.compile(
+    r"\b(meu nome (?:é|e)|me chamo|pode me chamar|eu sou|sou (?:um|uma|de|do|da)|eu gosto|gosto (?:de|muito)|"
+    r"adoro|eu amo|odeio|não gosto|prefiro|minha preferência|trabalho (?:com|como|na|no|em)|"
+    r"moro (?:em|na|no)|tenho \d+ anos|meu hobby|meus hobbies|estou aprendendo|"
+    r"my name is|call me|i am a|i'm a|i like|i love|i hate|i prefer|i work|i live|i'm from|i am from|"
+    r"my hobby|my hobbies|i'm learning|i am learning)\b",
+    re.IGNORECASE
+)
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_SENTENCE = re.compile(r"[.!?\n]+")
+
+STOPWORDS = frozenset("""
+a o as os um uma uns umas de do da dos das em no na nos nas por para pra com sem sob sobre que quem qual
+quais como quando onde porque porquê se mas ou e é são era foi ser estar está estou estão tem tenho ter
+isso isto esse essa este esta aquele aquela ele ela eles elas eu você vocês nós me te se lhe meu minha
+seu sua nosso nossa muito muita pouco mais menos já ainda também só bem mal sim não obrigado obrigada
+olá oi tchau então agora aqui ali hoje ontem amanhã pode posso poderia quero queria gostaria sobre
+the a an of to in on at by for with without from and or but is are was were be been being have has had
+do does did this that these those it its i you he she we they me my your our their what which who
+how when where why yes no not very more less just also only please thanks thank hello okay can could
+would should will
+""".split())
+
+
+def message_terms(content: str) -> Tuple[Set[str], Set[str]]:
+    """(palavras-chave, nomes próprios) de uma mensagem, em minúsculas.
+
+    Nome próprio = palavra capitalizada fora do início da frase.
+    """
+    keywords, entities = set(), set()
+    for sentence in _SENTENCE.split(content):
+        for position, word in enumerate(_WORD.findall(sentence)):
+            lower = word.lower()
+            if lower in STOPWORDS or len(word) < 3 or word.isdigit():
+                continue
+            if word[0].isupper() and position > 0:
+                entities.add(lower)
+            elif len(word) >= 4:
+                keywords.add(lower)
+    return keywords, entities
+
+
+class _UserState:
+    """Estado não consolidado de um usuário"""
+    __slots__ = ("pending", "gain", "since", "vocabulary")
+
+    def __init__(self):
+        self.pending: List[Dict[str, str]] = []
+        self.gain = 0.0
+        self.since: Optional[float] = None  # quando entrou a primeira mensagem não consolidada
+        self.vocabulary: "OrderedDict[str, None]" = OrderedDict()
+
+
+ExtractBatch = Callable[[Dict[str, List[Dict[str, str]]]], Union[None, Awaitable[None]]]
+
+
+class ExtractionScheduler:
+    """Decide quando vale extrair o perfil de cada usuário e agrupa as extrações em lotes.
+
+    ``extract_batch`` recebe ``{user_id: [{"role", "content"}, ...]}`` com as
+    mensagens não consolidadas de cada usuário do lote (função síncrona ou
+    corrotina). Se ela falhar, as mensagens voltam para o estado pendente.
+    """
+
+    def __init__(self, extract_batch: ExtractBatch, gain_threshold: float = 1.0, batch_size: int = 8,
+                 max_batch_delay: float = 30.0, max_pending: int = 50, max_staleness: float = 3600.0,
+                 min_words: int = 3,
+                 disclosure_weight: float = 1.0, entity_weight: float = 0.3, keyword_weight: float = 0.1,
+                 max_vocabulary: int = 2000, max_users: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.extract_batch = extract_batch
+        self.gain_threshold = gain_threshold
+        self.batch_size = batch_size
+        self.max_batch_delay = max_batch_delay
+        self.max_pending = max_pending
+        self.max_staleness = max_staleness
+        self.min_words = min_words
+        self.disclosure_weight = disclosure_weight
+        self.entity_weight = entity_weight
+        self.keyword_weight = keyword_weight
+        self.max_vocabulary = max_vocabulary
+        self.max_users = max_users
+        self.clock = clock
+        self._states: "OrderedDict[str, _UserState]" = OrderedDict()  # LRU por usuário
+        self._ready: "OrderedDict[str, float]" = OrderedDict()  # user_id -> quando ficou pronto
+        self._lock = threading.Lock()
+        self._task = None
+        self.messages = 0
+        self.extractions = 0
+        self.batches = 0
+
+    # ========== PLACAR ==========
+
+    def score(self, state: _UserState, content: str) -> float:
+        """Ganho de informação de uma mensagem do usuário; atualiza o vocabulário visto"""
+        if len(content.split()) < self.min_words:
+            return 0.0
+        gain = self.disclosure_weight if SELF_DISCLOSURE.search(content) else 0.0
+
+        keywords, entities = message_terms(content)
+        new_entities = [term for term in entities if term not in state.vocabulary]
+        new_keywords = [term for term in keywords if term not in state.vocabulary]
+        gain += self.entity_weight * min(len(new_entities), 2) / 2
+        gain += self.keyword_weight * min(len(new_keywords), 5) / 5
+
+        for term in new_entities + new_keywords:
+            state.vocabulary[term] = None
+        while len(state.vocabulary) > self.max_vocabulary:
+            state.vocabulary.popitem(last=False)
+        return gain
+
+    def observe(self, user_id: str, role: str, content: str) -> float:
+        """Registra uma mensagem nova; retorna o ganho atribuído a ela"""
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                state = self._states[user_id] = _UserState()
+            self._states.move_to_end(user_id)
+            self.messages += 1
+            state.pending.append({"role": role, "content": content})
+            if len(self._states) > self.max_users:
+                self._evict_idle()
+            if state.since is None:
+                state.since = self.clock()
+
+            gain = self.score(state, content) if role == "user" else 0.0
+            state.gain += gain
+            now = self.clock()
+            if user_id not in self._ready and (
+                    state.gain >= self.gain_threshold or len(state.pending) >= self.max_pending
+                    or (state.gain > 0 and now - state.since >= self.max_staleness)):
+                self._ready[user_id] = now
+            return gain
+
+    def _evict_idle(self):
+        """Descarta os usuários menos recentes sem pendências além de ``max_users`` (com o lock)"""
+        excess = len(self._states) - self.max_users
+        if excess > 0:
+            idle = [user_id for user_id, state in self._states.items() if not state.pending]
+            for user_id in islice(idle, excess):
+                del self._states[user_id]
+
+    # ========== LOTES ==========
+
+    def due(self) -> bool:
+        """Há um lote cheio ou um usuário pronto esperando há mais de ``max_batch_delay``"""
+        with self._lock:
+            if len(self._ready) >= self.batch_size:
+                return True
+            oldest = next(iter(self._ready.values()), None)
+            return oldest is not None and self.clock() - oldest >= self.max_batch_delay
+
+    def take_batch(self, force: bool = False) -> Dict[str, List[Dict[str, str]]]:
+        """Retira até ``batch_size`` usuários prontos (com ``force``, também os que têm algum ganho pendente)"""
+        with self._lock:
+            user_ids = list(self._ready)[:self.batch_size]
+            if force and len(user_ids) < self.batch_size:
+                user_ids += [user_id for user_id, state in self._states.items()
+                             if state.gain > 0 and user_id not in self._ready][:self.batch_size - len(user_ids)]
+            batch = {}
+            for user_id in user_ids:
+                self._ready.pop(user_id, None)
+                state = self._states[user_id]
+                batch[user_id] = state.pending[-self.max_pending:]
+                state.pending, state.gain, state.since = [], 0.0, None
+            return batch
+
+    def restore(self, batch: Dict[str, List[Dict[str, str]]]):
+        """Devolve um lote que falhou: as mensagens voltam a ser pendentes e o usuário, pronto"""
+        with self._lock:
+            for user_id, messages in batch.items():
+                state = self._states.setdefault(user_id, _UserState())
+                state.pending = (messages + state.pending)[-self.max_pending:]
+                state.gain = max(state.gain, self.gain_threshold)
+                state.since = state.since or self.clock()
+                self._ready.setdefault(user_id, self.clock())
+
+    # ========== EXECUÇÃO ==========
+
+    def run_once(self, force: bool = False) -> int:
+        """Extrai os lotes devidos (todos com ganho pendente, com ``force``); requer ``extract_batch`` síncrono.
+
+        Retorna quantos usuários foram consolidados.
+        """
+        done = 0
+        while force or self.due():
+            batch = self.take_batch(force)
+            if not batch:
+                break
+            try:
+                self.extract_batch(batch)
+            except Exception:
+                self.restore(batch)
+                raise
+            done += self._record(batch)
+        return done
+
+    async def run_once_async(self, force: bool = False) -> int:
+        """Como ``run_once``; corrotinas são aguardadas e funções síncronas rodam em threads"""
+        done = 0
+        while force or self.due():
+            batch = self.take_batch(force)
+            if not batch:
+                break
+            try:
+                if inspect.iscoroutinefunction(self.extract_batch):
+                    await self.extract_batch(batch)
+                else:
+                    await asyncio.to_thread(self.extract_batch, batch)
+            except Exception:
+                self.restore(batch)
+                raise
+            done += self._record(batch)
+        return done
+
+    def _record(self, batch: Dict[str, Any]) -> int:
+        with self._lock:
+            self.batches += 1
+            self.extractions += len(batch)
+            self._evict_idle()  # os usuários do lote ficaram sem pendências
+        return len(batch)
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None
+
+    async def start(self, interval: float = 1.0):
+        """Descarrega os lotes devidos a cada ``interval`` segundos em segundo plano"""
+        self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self, drain: bool = False):
+        """Para a tarefa; com ``drain`` extrai em seguida todos os usuários com ganho pendente"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if drain:
+            await self.run_once_async(force=True)
+
+    async def _run(self, interval: float):
+        while True:
+            try:
+                await self.run_once_async()
+            except Exception as e:
+                print(f" Extraction batch failed: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"messages": self.messages, "extractions": self.extractions, "batches": self.batches,
+                    "ready_users": len(self._ready), "tracked_users": len(self._states),
+                    "pending_users": sum(1 for state in self._states.values() if state.pending)}
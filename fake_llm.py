@@ -0,0 +1,202 @@
+"""LLM falso compatível com a API de chat da OpenAI, para benchmarks sem rede.
+
+- ``FakeLLMServer``: servidor HTTP local que responde a ``POST /v1/chat/completions``
+- ``FakeOpenAIClient``: cliente em processo com a mesma interface de
+  ``openai.OpenAI().chat.completions.create`` (sem HTTP nem serialização)
+
+Ambos respondem após uma latência configurável e aceitam ``stream=True``
+(server-sent events no servidor, um iterador de chunks no cliente), com
+``token_latency`` entre os trechos. Prompts de extração recebem um JSON
+válido; os demais recebem texto fixo (``response_text``).
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+EXTRACTION_FIELDS = {"name": "", "interests": ["benchmark"], "preferences": "", "context": ""}
+EXTRACTION_RESPONSE = json.dumps(EXTRACTION_FIELDS)
+
+
+def _build_completion(content: str, model: str) -> dict:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}
+    }
+
+
+CHAT_RESPONSE = "Resposta simulada pelo servidor local."
+
+
+def _fake_content(messages: list, response_text: str = CHAT_RESPONSE) -> str:
+    last_message = (messages or [{}])[-1].get("content", "")
+    if "keyed by user id" in last_message:  # extração em lote: uma entrada por "### user_id"
+        return json.dumps({user_id: EXTRACTION_FIELDS for user_id in re.findall(r"^### (\S+)$", last_message, re.M)})
+    if "Return a JSON" in last_message:
+        return EXTRACTION_RESPONSE
+    return response_text
+
+
+def _build_chunks(content: str, model: str, include_usage: bool = False) -> list:
+    """Chunks ``chat.completion.chunk`` de um streaming: uma palavra por chunk"""
+    base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+    chunks = []
+    for position, piece in enumerate(re.findall(r"\S+\s*", content)):
+        delta = {"role": "assistant", "content": piece} if position == 0 else {"content": piece}
+        chunks.append(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+    chunks.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+    if include_usage:
+        chunks.append(dict(base, choices=[], usage={"prompt_tokens": 10, "completion_tokens": len(chunks) - 1,
+                                                      "total_tokens": 10 + len(chunks) - 1}))
+    return chunks
+
+
+def _namespace(value):
+    """dict/list -> SimpleNamespace recursivo (acesso por atributo, como nos objetos do cliente)"""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_namespace(item) for item in value]
+    return value
+
+
+class FakeLLMServer:
+    """Servidor HTTP em thread que simula o endpoint de chat completions"""
+
+    def __init__(self, latency: float = 0.05, host: str = "127.0.0.1", port: int = 0,
+                 token_latency: float = 0.0, response_text: str = CHAT_RESPONSE):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.response_text = response_text
+        self.request_count = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                server.request_count += 1
+                time.sleep(server.latency)
+
+                content = _fake_content(payload.get("messages"), server.response_text)
+                if payload.get("stream"):
+                    self._stream(content, payload)
+                    return
+                body = json.dumps(_build_completion(content, payload.get("model", "fake"))).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, content: str, payload: dict):
+                include_usage = bool((payload.get("stream_options") or {}).get("include_usage"))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                try:
+                    for chunk in _build_chunks(content, payload.get("model", "fake"), include_usage):
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                        if server.token_latency:
+                            time.sleep(server.token_latency)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # cliente encerrou o stream antes do fim
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeOpenAIClient:
+    """Substituto em processo de ``openai.OpenAI`` (só ``chat.completions.create``).
+
+    Uso: ``agent.memory_agent.client = FakeOpenAIClient(latency=0.01)``
+    """
+
+    def __init__(self, latency: float = 0.0, token_latency: float = 0.0, response_text: str = CHAT_RESPONSE):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.response_text = response_text
+        self.request_count = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str = "fake", messages: list = None, stream: bool = False,
+                stream_options: dict = None, **kwargs):
+        self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        content = _fake_content(messages, self.response_text)
+        if stream:
+            include_usage = bool((stream_options or {}).get("include_usage"))
+            return FakeStream(_build_chunks(content, model, include_usage), self.token_latency)
+        completion = _build_completion(content, model)
+        choice = completion["choices"][0]
+        return SimpleNamespace(
+            id=completion["id"], model=model,
+            choices=[SimpleNamespace(index=0, finish_reason=choice["finish_reason"],
+                                     message=SimpleNamespace(**choice["message"]))],
+            usage=SimpleNamespace(**completion["usage"])
+        )
+
+    def close(self):
+        pass
+
+
+class FakeStream:
+    """Iterador de chunks no formato de ``openai.Stream`` (com ``close()``)"""
+
+    def __init__(self, chunks: list, token_latency: float = 0.0):
+        self._chunks = iter(chunks)
+        self.token_latency = token_latency
+        self.closed = False
+        self._first = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        if self.token_latency and not self._first:
+            time.sleep(self.token_latency)
+        self._first = False
+        return _namespace(next(self._chunks))
+
+    def close(self):
+        self.closed = True
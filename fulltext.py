@@ -0,0 +1,179 @@
+"""Busca textual completa (full-text) da base de conhecimento.
+
+- SQLite: tabela virtual FTS5 ``knowledge_base_fts`` (external content sobre
+  ``knowledge_base``) mantida em sincronia por triggers; ranking BM25 e
+  trechos com ``snippet()``.
+- PostgreSQL: coluna gerada ``search_vector`` (tsvector) com índice GIN;
+  ranking ``ts_rank_cd`` (o PostgreSQL não tem BM25 nativo) e trechos com
+  ``ts_headline``.
+
+``install`` é chamado pelas migrações; se o SQLite não tiver FTS5 o
+repositório continua usando LIKE.
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+
+FTS_TABLE = "knowledge_base_fts"
+SEARCH_VECTOR_COLUMN = "search_vector"
+SEARCH_VECTOR_INDEX = "ix_knowledge_base_search_vector"
+TEXT_SEARCH_CONFIG = "portuguese"
+
+HIGHLIGHT_START = "["
+HIGHLIGHT_END = "]"
+SNIPPET_TOKENS = 16
+MIN_PREFIX_LENGTH = 3  # palavras menores não viram prefixo ("a*" casaria com quase tudo)
+
+# Pesos do BM25 por coluna (key, value, category): a chave é a pista mais forte
+BM25_WEIGHTS = (5.0, 1.0, 2.0)
+
+_SQLITE_DDL = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        key, value, category,
+        content='knowledge_base', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON knowledge_base BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, key, value, category)
+        VALUES (new.id, new.key, new.value, new.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON knowledge_base BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, key, value, category)
+        VALUES ('delete', old.id, old.key, old.value, old.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF key, value, category ON knowledge_base BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, key, value, category)
+        VALUES ('delete', old.id, old.key, old.value, old.category);
+        INSERT INTO {FTS_TABLE}(rowid, key, value, category)
+        VALUES (new.id, new.key, new.value, new.category);
+    END""",
+    # Indexa as linhas que já existiam antes da tabela virtual
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+_POSTGRESQL_DDL = [
+    f"""ALTER TABLE knowledge_base ADD COLUMN IF NOT EXISTS {SEARCH_VECTOR_COLUMN} tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('{TEXT_SEARCH_CONFIG}'::regconfig, coalesce(replace(key, '_', ' '), '')), 'A') ||
+            setweight(to_tsvector('{TEXT_SEARCH_CONFIG}'::regconfig, coalesce(category, '')), 'B') ||
+            setweight(to_tsvector('{TEXT_SEARCH_CONFIG}'::regconfig, coalesce(value, '')), 'C')
+        ) STORED""",
+    f"""CREATE INDEX IF NOT EXISTS {SEARCH_VECTOR_INDEX}
+        ON knowledge_base USING GIN ({SEARCH_VECTOR_COLUMN})""",
+]
+
+_SQLITE_SEARCH = text(f"""
+    SELECT kb.key, kb.value, kb.category,
+           -bm25({FTS_TABLE}, {', '.join(str(w) for w in BM25_WEIGHTS)}) AS score,
+           snippet({FTS_TABLE}, 1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', {SNIPPET_TOKENS}) AS snippet
+    FROM {FTS_TABLE}
+    JOIN knowledge_base AS kb ON kb.id = {FTS_TABLE}.rowid
+    WHERE {FTS_TABLE} MATCH :query
+    ORDER BY bm25({FTS_TABLE}, {', '.join(str(w) for w in BM25_WEIGHTS)})
+    LIMIT :limit OFFSET :offset
+""")
+
+_POSTGRESQL_SEARCH = text(f"""
+    SELECT kb.key, kb.value, kb.category,
+           ts_rank_cd(kb.{SEARCH_VECTOR_COLUMN}, q) AS score,
+           ts_headline('{TEXT_SEARCH_CONFIG}', kb.value, q,
+                       'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords={SNIPPET_TOKENS}, MinWords=5') AS snippet
+    FROM knowledge_base AS kb, to_tsquery('{TEXT_SEARCH_CONFIG}', :query) AS q
+    WHERE kb.{SEARCH_VECTOR_COLUMN} @@ q
+    ORDER BY score DESC, kb.id
+    LIMIT :limit OFFSET :offset
+""")
+
+
+def install(connection: Connection) -> list:
+    """Cria o índice full-text da base de conhecimento, se ainda não existir"""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        if _sqlite_fts_exists(connection):
+            return []
+        try:
+            for statement in _SQLITE_DDL:
+                connection.exec_driver_sql(statement)
+        except OperationalError as e:
+            # SQLite compilado sem FTS5: a busca segue com LIKE
+            print(f" Full-text search unavailable (FTS5): {str(e)}")
+            return []
+        return [FTS_TABLE]
+
+    if dialect == "postgresql":
+        columns = {col["name"] for col in inspect(connection).get_columns("knowledge_base")}
+        if SEARCH_VECTOR_COLUMN in columns:
+            return []
+        for statement in _POSTGRESQL_DDL:
+            connection.exec_driver_sql(statement)
+        return [f"knowledge_base.{SEARCH_VECTOR_COLUMN}", SEARCH_VECTOR_INDEX]
+
+    return []
+
+
+def is_available(connection: Connection) -> bool:
+    """Indica se o banco tem o índice full-text instalado"""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        return _sqlite_fts_exists(connection)
+    if dialect == "postgresql":
+        columns = {col["name"] for col in inspect(connection).get_columns("knowledge_base")}
+        return SEARCH_VECTOR_COLUMN in columns
+    return False
+
+
+def _sqlite_fts_exists(connection: Connection) -> bool:
+    return connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    ).first() is not None
+
+
+def tokenize(search_term: str) -> List[str]:
+    """Palavras da consulta, sem pontuação nem operadores da sintaxe de busca"""
+    return re.findall(r"\w+", search_term.lower())
+
+
+def build_query(dialect: str, search_term: str, match_all: bool = True) -> Optional[str]:
+    """Converte o termo em uma consulta segura da sintaxe de cada banco.
+
+    Palavras com ``MIN_PREFIX_LENGTH`` letras ou mais viram prefixos (``pyth``
+    encontra ``python``). Por padrão todas as palavras precisam aparecer (AND),
+    como na antiga busca por substring da frase; com ``match_all=False`` basta
+    uma delas (OR) e o ranking ordena pelas mais relevantes. Retorna None se o
+    termo não tiver palavras.
+    """
+    tokens = tokenize(search_term)
+    if not tokens:
+        return None
+    if dialect == "postgresql":
+        terms = [f"{token}:*" if len(token) >= MIN_PREFIX_LENGTH else token for token in tokens]
+        return (" & " if match_all else " | ").join(terms)
+    terms = [f'"{token}"*' if len(token) >= MIN_PREFIX_LENGTH else f'"{token}"' for token in tokens]
+    return (" AND " if match_all else " OR ").join(terms)
+
+
+def search_statement(dialect: str, search_term: str, limit: Optional[int], offset: int,
+                     match_all: bool = True) -> Optional[Tuple[Any, Dict[str, Any]]]:
+    """Retorna (instrução, parâmetros) da busca ranqueada, ou None se não houver consulta"""
+    query = build_query(dialect, search_term, match_all)
+    if query is None:
+        return None
+    if dialect == "postgresql":
+        return _POSTGRESQL_SEARCH, {"query": query, "limit": limit, "offset": offset}
+    # No SQLite, LIMIT -1 significa sem limite
+    return _SQLITE_SEARCH, {"query": query, "limit": -1 if limit is None else limit, "offset": offset}
+
+
+def like_snippet(value: str, search_term: str, width: int = 80) -> str:
+    """Trecho destacado para o caminho sem índice full-text (LIKE)"""
+    position = value.lower().find(search_term.lower())
+    if position < 0:
+        return value[:width]
+    start = max(position - width // 2, 0)
+    end = position + len(search_term)
+    snippet = (value[start:position] + HIGHLIGHT_START + value[position:end] + HIGHLIGHT_END
+               + value[end:end + width // 2])
+    return ("…" if start > 0 else "") + snippet + ("…" if end + width // 2 < len(value) else "")
@@ -0,0 +1,428 @@
+"""Instrumentação do caminho quente: spans de tempo, tokens do LLM e contadores.
+
+Desligada por padrão e sem custo nesse estado: ``enable()`` troca os métodos de
+``DBMemoryAgent``, ``MemoryRepository`` (e das versões assíncronas e de
+write-behind) por versões cronometradas, e ``disable()`` devolve os originais.
+
+- spans: histograma ``memory_span_seconds{span="Classe.método"}`` e erros por span
+- LLM: ``memory_llm_seconds{caller, model}`` e ``memory_llm_tokens_total{caller, model, type}``,
+  com ``caller`` = span que fez a chamada (extração, resumo, resposta...);
+  respostas em streaming também medem ``memory_llm_first_token_seconds``
+- contadores: consolidações, mensagens removidas pela limpeza, acertos/erros dos caches
+
+Exporta em texto do Prometheus (``prometheus_text()`` / ``start_http_server()``)
+e, se o pacote ``opentelemetry`` estiver instalado, em spans e métricas
+OpenTelemetry (``enable(opentelemetry=True)``).
+
+Uso:
+    import instrumentation
+    instrumentation.enable()
+    ...
+    print(instrumentation.prometheus_text())
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+try:
+    from opentelemetry import metrics as otel_metrics
+    from opentelemetry import trace as otel_trace
+except ImportError:  # opcional: só para exportar em OpenTelemetry
+    otel_metrics = otel_trace = None
+
+# Limites dos histogramas (segundos): de operações de banco a chamadas lentas ao LLM
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Métodos que não viram span: acesso a sessões e ciclo de vida
+SKIPPED_METHODS = {"get_session", "create_tables", "dispose", "close", "flush"}
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("memory_span", default=None)
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Contadores e histogramas rotulados, em memória e seguros entre threads"""
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], _Histogram] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable] = []
+        self._tracer = None
+        self._otel_instruments: Dict[str, object] = {}
+
+    # ========== REGISTRO ==========
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """Soma ``value`` ao contador (no-op com a instrumentação desligada)"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+        if self._otel_instruments:
+            self._otel_counter(name).add(value, labels)
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Registra uma duração no histograma (no-op com a instrumentação desligada)"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(seconds)
+        if self._otel_instruments:
+            self._otel_histogram(name).record(seconds, labels)
+
+    def add_collector(self, collector: Callable):
+        """Função chamada na exportação que devolve ``[(nome, rótulos, valor)]`` de contadores.
+
+        Métodos ligados são guardados por referência fraca (o objeto pode ser coletado).
+        """
+        if inspect.ismethod(collector):
+            self._collectors.append(weakref.WeakMethod(collector))
+        else:
+            self._collectors.append(lambda: collector)
+
+    def remove_collector(self, collector: Callable):
+        """Deixa de chamar ``collector`` na exportação (ex.: ao fechar o objeto que o registrou)"""
+        self._collectors = [ref for ref in self._collectors if ref() not in (None, collector)]
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _collected(self) -> Dict[Tuple[str, Tuple], float]:
+        totals: Dict[Tuple[str, Tuple], float] = {}
+        alive = []
+        for ref in self._collectors:
+            collector = ref()
+            if collector is None:
+                continue
+            alive.append(ref)
+            for name, labels, value in collector():
+                key = (name, tuple(sorted(labels.items())))
+                totals[key] = totals.get(key, 0.0) + value
+        self._collectors = alive
+        return totals
+
+    # ========== SPANS ==========
+
+    def span(self, name: str) -> "Span":
+        """Cronometra um trecho: ``with registry.span("etapa"): ...``"""
+        return Span(self, name)
+
+    # ========== EXPORTAÇÃO ==========
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Estado atual: {contador: {rótulos: valor}, histograma: {rótulos: {count, sum}}}"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (h.count, h.sum) for key, h in self._histograms.items()}
+        if self.enabled:
+            counters.update(self._collected())
+        result: Dict[str, Dict] = {}
+        for (name, labels), value in counters.items():
+            result.setdefault(name, {})[labels] = value
+        for (name, labels), (count, total) in histograms.items():
+            result.setdefault(name, {})[labels] = {"count": count, "sum": total}
+        return result
+
+    def prometheus_text(self) -> str:
+        """Métricas no formato de exposição de texto do Prometheus"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+        if self.enabled:
+            counters.update(self._collected())
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            self._header(lines, name, "counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for name in sorted({name for name, _ in histograms}):
+            self._header(lines, name, "histogram")
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: List[str], name: str, kind: str):
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    # ========== OPENTELEMETRY ==========
+
+    def _enable_opentelemetry(self):
+        if otel_trace is None:
+            raise ImportError("Instale o pacote 'opentelemetry-api' (e um SDK/exportador) para usar OpenTelemetry")
+        self._tracer = otel_trace.get_tracer("memory")
+        self._otel_instruments = {"__meter__": otel_metrics.get_meter("memory")}
+
+    def _otel_counter(self, name: str):
+        instrument = self._otel_instruments.get(name)
+        if instrument is None:
+            instrument = self._otel_instruments[name] = self._otel_instruments["__meter__"].create_counter(
+                name, description=self._help.get(name, ""))
+        return instrument
+
+    def _otel_histogram(self, name: str):
+        instrument = self._otel_instruments.get(name)
+        if instrument is None:
+            instrument = self._otel_instruments[name] = self._otel_instruments["__meter__"].create_histogram(
+                name, unit="s", description=self._help.get(name, ""))
+        return instrument
+
+
+class Span:
+    """Trecho cronometrado; registra duração, erros e o span pai (para rotular chamadas ao LLM)"""
+    __slots__ = ("registry", "name", "start", "token", "otel")
+
+    def __init__(self, registry: MetricsRegistry, name: str):
+        self.registry = registry
+        self.name = name
+        self.otel = None
+
+    def __enter__(self):
+        self.token = _current_span.set(self.name)
+        if self.registry._tracer is not None:
+            self.otel = self.registry._tracer.start_as_current_span(self.name)
+            self.otel.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        _current_span.reset(self.token)
+        if self.otel is not None:
+            self.otel.__exit__(exc_type, exc, tb)
+        self.registry.observe("memory_span_seconds", elapsed, span=self.name)
+        if exc_type is not None:
+            self.registry.inc("memory_span_errors_total", span=self.name)
+        return False
+
+
+def _labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (key + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+registry = MetricsRegistry()
+registry.describe("memory_span_seconds", "Duração dos métodos do agente e do repositório")
+registry.describe("memory_span_errors_total", "Exceções por método")
+registry.describe("memory_llm_seconds", "Duração das chamadas ao LLM, por método chamador")
+registry.describe("memory_llm_first_token_seconds", "Tempo até o primeiro trecho das respostas em streaming")
+registry.describe("memory_llm_tokens_total", "Tokens consumidos (prompt/completion), por método chamador")
+registry.describe("memory_llm_cache_total", "Consultas ao cache de respostas do LLM, por resultado")
+registry.describe("memory_consolidations_total", "Consolidações disparadas (worker, na hora ou em lote)")
+registry.describe("memory_consolidation_jobs_total", "Tarefas concluídas pelo worker de consolidação, por status")
+registry.describe("memory_messages_cleaned_total", "Mensagens removidas pela limpeza/retenção")
+registry.describe("memory_cache_hits_total", "Acertos dos caches de perfil, resumos e conhecimento")
+registry.describe("memory_cache_misses_total", "Erros dos caches de perfil, resumos e conhecimento")
+registry.describe("memory_db_reads_total", "Leituras com réplicas configuradas, por destino (replica/primary)")
+registry.describe("memory_replica_errors_total", "Falhas de réplica que levaram a leitura para outro banco")
+registry.describe("memory_messages_compressed_total", "Mensagens antigas comprimidas pelo job de compressão")
+registry.describe("memory_summaries_compressed_total", "Resumos absorvidos comprimidos pelo job de compressão")
+registry.describe("memory_compression_bytes_saved_total", "Bytes de texto economizados pelo job de compressão")
+registry.describe("memory_write_behind_dead_letters_total", "Mensagens do write-behind descartadas após falhas repetidas")
+
+
+# ========== INSTRUMENTAÇÃO DAS CLASSES ==========
+
+_patched: List[Tuple[type, str, Callable]] = []
+
+
+def _timed(func: Callable, name: str) -> Callable:
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with Span(registry, name):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with Span(registry, name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _record_llm(response, model: str, caller: str, elapsed: float):
+    registry.observe("memory_llm_seconds", elapsed, caller=caller, model=model)
+    record_llm_usage(getattr(response, "usage", None), model, caller)
+
+
+def record_llm_usage(usage, model: str, caller: str):
+    """Soma os tokens de ``usage`` (de uma resposta ou do último chunk de um streaming)"""
+    if usage is not None:
+        registry.inc("memory_llm_tokens_total", getattr(usage, "prompt_tokens", 0) or 0,
+                     caller=caller, model=model, type="prompt")
+        registry.inc("memory_llm_tokens_total", getattr(usage, "completion_tokens", 0) or 0,
+                     caller=caller, model=model, type="completion")
+
+
+def _timed_llm(func: Callable, name: str) -> Callable:
+    """Cronometra ``_chat_completion`` e lê ``response.usage``; ``caller`` é o span que chamou"""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, **kwargs):
+            caller = _current_span.get() or "-"
+            with Span(registry, name):
+                start = time.perf_counter()
+                response = await func(self, **kwargs)
+                if not kwargs.get("stream"):  # streams são medidos por quem os consome
+                    _record_llm(response, kwargs.get("model", "-"), caller, time.perf_counter() - start)
+            return response
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, **kwargs):
+        caller = _current_span.get() or "-"
+        with Span(registry, name):
+            start = time.perf_counter()
+            response = func(self, **kwargs)
+            if not kwargs.get("stream"):  # streams são medidos por quem os consome
+                _record_llm(response, kwargs.get("model", "-"), caller, time.perf_counter() - start)
+        return response
+    return wrapper
+
+
+def _instrument_class(cls: type):
+    """Troca os métodos definidos em ``cls`` por versões cronometradas"""
+    for attr, value in list(vars(cls).items()):
+        if (attr.startswith("__") or attr in SKIPPED_METHODS or not inspect.isfunction(value)
+                or inspect.isgeneratorfunction(value) or inspect.isasyncgenfunction(value)):
+            continue
+        name = f"{cls.__name__}.{attr}"
+        wrapper = _timed_llm(value, name) if attr == "_chat_completion" else _timed(value, name)
+        _patched.append((cls, attr, value))
+        setattr(cls, attr, wrapper)
+
+
+def _instrumented_classes() -> List[type]:
+    # Importados aqui: os próprios módulos importam este para os contadores
+    from async_memory import AsyncDBMemoryAgent, AsyncTestDBMemoryAgent
+    from async_repository import AsyncMemoryRepository
+    from memory import DBMemoryAgent, TestDBMemoryAgent
+    from repository import MemoryRepository
+    from write_behind import WriteBehindRepository
+    return [MemoryRepository, WriteBehindRepository, AsyncMemoryRepository,
+            DBMemoryAgent, TestDBMemoryAgent, AsyncDBMemoryAgent, AsyncTestDBMemoryAgent]
+
+
+def enable(opentelemetry: bool = False):
+    """Liga a instrumentação (idempotente); ``opentelemetry=True`` também emite spans/métricas OTel"""
+    if opentelemetry:
+        registry._enable_opentelemetry()
+    if registry.enabled:
+        return
+    for cls in _instrumented_classes():
+        _instrument_class(cls)
+    registry.enabled = True
+
+
+def disable():
+    """Desliga a instrumentação e restaura os métodos originais (os valores coletados são mantidos)"""
+    registry.enabled = False
+    while _patched:
+        cls, attr, original = _patched.pop()
+        setattr(cls, attr, original)
+    registry._tracer = None
+    registry._otel_instruments = {}
+
+
+def is_enabled() -> bool:
+    return registry.enabled
+
+
+def span(name: str) -> Span:
+    """Span manual para trechos fora dos métodos instrumentados"""
+    return registry.span(name)
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    registry.observe(name, value, **labels)
+
+
+def prometheus_text() -> str:
+    return registry.prometheus_text()
+
+
+def snapshot() -> Dict[str, Dict]:
+    return registry.snapshot()
+
+
+def reset():
+    registry.reset()
+
+
+def start_http_server(port: int = 9464, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve ``GET /metrics`` em texto do Prometheus numa thread em segundo plano"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    return httpd
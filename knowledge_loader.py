@@ -0,0 +1,80 @@
+"""Carga em massa da base de conhecimento a partir de arquivos JSONL ou CSV.
+
+Os arquivos são lidos linha a linha e gravados em lotes com
+``bulk_upsert_knowledge`` (INSERT ... ON CONFLICT), então a memória usada não
+depende do tamanho do arquivo. Cada registro tem ``key``, ``value`` e,
+opcionalmente, ``category``; chaves existentes são atualizadas.
+
+Uso: python knowledge_loader.py arquivo.jsonl [arquivo.csv ...] [--database-url sqlite:///memory.db]
+"""
+import argparse
+import csv
+import gzip
+import json
+import time
+from typing import Dict, Iterator
+
+from db import DatabaseConfig
+from repository import KNOWLEDGE_CHUNK_SIZE, MemoryRepository
+
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def iter_knowledge_file(path: str, file_format: str = None) -> Iterator[Dict]:
+    """Gera os registros de um arquivo JSONL ou CSV (com cabeçalho), um por vez.
+
+    O formato vem da extensão (``.jsonl``/``.ndjson``/``.csv``, com ou sem ``.gz``)
+    quando ``file_format`` não é informado.
+    """
+    if file_format is None:
+        name = path[:-3] if path.endswith(".gz") else path
+        file_format = "csv" if name.endswith(".csv") else "jsonl"
+
+    with _open(path) as f:
+        if file_format == "csv":
+            for row in csv.DictReader(f):
+                yield {"key": row.get("key"), "value": row.get("value"), "category": row.get("category")}
+        elif file_format == "jsonl":
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{path}:{line_number}: JSON inválido ({e})") from e
+        else:
+            raise ValueError(f"Formato não suportado: {file_format}. Use 'jsonl' ou 'csv'")
+
+
+def load_knowledge_file(repository, path: str, file_format: str = None,
+                        chunk_size: int = KNOWLEDGE_CHUNK_SIZE) -> Dict[str, int]:
+    """Carrega um arquivo na base de conhecimento; retorna as contagens do upsert"""
+    return repository.bulk_upsert_knowledge(iter_knowledge_file(path, file_format), chunk_size=chunk_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="Arquivos JSONL ou CSV (opcionalmente .gz)")
+    parser.add_argument("--database-url", default="sqlite:///memory.db", help="URL do banco")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Força o formato (padrão: pela extensão)")
+    parser.add_argument("--chunk-size", type=int, default=KNOWLEDGE_CHUNK_SIZE, help="Linhas por lote")
+    args = parser.parse_args()
+
+    repository = MemoryRepository(DatabaseConfig(args.database_url))
+    for path in args.files:
+        start = time.perf_counter()
+        counts = load_knowledge_file(repository, path, args.format, args.chunk_size)
+        elapsed = time.perf_counter() - start
+        total = counts["inserted"] + counts["updated"]
+        print(f"{path}: {counts['inserted']} inseridos, {counts['updated']} atualizados, "
+              f"{counts['skipped']} ignorados em {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} linhas/s)")
+    repository.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Cache persistente de respostas do LLM (tabela ``llm_cache`` do próprio banco).
+
+Duas camadas:
+
+- exata: chave = SHA-256 de (modelo, mensagens, parâmetros). Prompts idênticos
+  (ex.: a mesma janela de mensagens reenviada para extração) não voltam à API;
+- semântica (opcional): para as finalidades em ``semantic_purposes``, uma
+  pergunta quase idêntica a outra já respondida (similaridade de cosseno da
+  última mensagem >= ``semantic_threshold``, com o ``HashingEmbedder``) reaproveita
+  a resposta. Só compara prompts com o mesmo contexto (modelo, parâmetros e
+  mensagens anteriores), buscado pelo índice de ``context_key``.
+
+As entradas expiram após ``ttl`` segundos; acima de ``max_entries`` as usadas há
+mais tempo são removidas (a cada ``evict_every`` gravações).
+Respostas servidas do cache vêm com ``usage=None``: tokens só contam quando há
+chamada real à API.
+"""
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from consolidation import EXTRACT, SUMMARIZE
+import instrumentation
+from semantic import HashingEmbedder, normalize
+
+ROLLUP = "rollup"
+CHAT = "chat"
+
+# Extração e resumos usam temperatura baixa e prompts que se repetem; respostas
+# de conversa dependem do contexto de cada usuário e ficam fora por padrão
+DEFAULT_PURPOSES = (EXTRACT, SUMMARIZE, ROLLUP)
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class LLMCache:
+    """Cache de chamadas a ``chat.completions.create`` sobre um ``MemoryRepository``"""
+
+    def __init__(self, repository, ttl: float = 7 * 24 * 3600, max_entries: Optional[int] = 10000,
+                 purposes: Iterable[str] = DEFAULT_PURPOSES, semantic_purposes: Iterable[str] = (),
+                 semantic_threshold: float = 0.95, embedder=None, evict_every: int = 100):
+        self.repository = repository
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.purposes = set(purposes) | set(semantic_purposes)
+        self.semantic_purposes = set(semantic_purposes)
+        self.semantic_threshold = semantic_threshold
+        self.embedder = embedder or HashingEmbedder()
+        self.evict_every = evict_every
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    # ========== CHAVES ==========
+
+    @staticmethod
+    def key(model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+        """SHA-256 de (modelo, mensagens, parâmetros); parâmetros None são ignorados"""
+        params = {name: value for name, value in params.items() if value is not None}
+        return hashlib.sha256(_canonical([model, messages, params]).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def context_key(purpose: str, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+        """Chave de tudo menos o texto da última mensagem (escopo da camada semântica)"""
+        return LLMCache.key(model, [{"purpose": purpose}] + messages[:-1] + [{"role": messages[-1].get("role")}],
+                            params)
+
+    # ========== LEITURA E GRAVAÇÃO ==========
+
+    def get(self, purpose: str, model: str, messages: List[Dict[str, Any]], **params):
+        """Resposta em cache no formato do cliente OpenAI, ou None"""
+        if purpose not in self.purposes or not messages:
+            return None
+        response = self.repository.get_llm_cache_entry(self.key(model, messages, params))
+        if response is None and purpose in self.semantic_purposes:
+            response = self._semantic_get(purpose, model, messages, params)
+            if response is not None:
+                self.semantic_hits += 1
+                instrumentation.inc("memory_llm_cache_total", purpose=purpose, result="semantic_hit")
+                return self._completion(response, model)
+        if response is None:
+            self.misses += 1
+            instrumentation.inc("memory_llm_cache_total", purpose=purpose, result="miss")
+            return None
+        self.hits += 1
+        instrumentation.inc("memory_llm_cache_total", purpose=purpose, result="hit")
+        return self._completion(response, model)
+
+    def put(self, purpose: str, model: str, messages: List[Dict[str, Any]], response, **params):
+        """Guarda a resposta de uma chamada real (respostas vazias não são guardadas)"""
+        if purpose not in self.purposes or not messages:
+            return
+        content = response.choices[0].message.content
+        if not content:
+            return
+        usage = getattr(response, "usage", None)
+        stored = _canonical({
+            "content": content,
+            "usage": {"prompt_tokens": getattr(usage, "prompt_tokens", 0),
+                      "completion_tokens": getattr(usage, "completion_tokens", 0)} if usage else None,
+        })
+        context_key = vector = None
+        if purpose in self.semantic_purposes:
+            context_key = self.context_key(purpose, model, messages, params)
+            vector = self._embed(messages[-1].get("content") or "").tobytes()
+        self.repository.put_llm_cache_entry(self.key(model, messages, params), model, purpose, stored,
+                                            datetime.now() + timedelta(seconds=self.ttl), context_key, vector)
+
+        with self._lock:
+            self._puts += 1
+            evict = self.evict_every and self._puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Remove expiradas e o excesso sobre ``max_entries``; retorna quantas saíram"""
+        return self.repository.evict_llm_cache(self.max_entries)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.semantic_hits + self.misses
+        return {"hits": self.hits, "semantic_hits": self.semantic_hits, "misses": self.misses,
+                "hit_rate": (self.hits + self.semantic_hits) / total if total else 0.0}
+
+    # ========== CAMADA SEMÂNTICA ==========
+
+    def _embed(self, text: str) -> np.ndarray:
+        return normalize(self.embedder.embed([text]).astype(np.float32))[0]
+
+    def _semantic_get(self, purpose: str, model: str, messages: List[Dict[str, Any]],
+                      params: Dict[str, Any]) -> Optional[str]:
+        rows = self.repository.get_llm_cache_vectors(self.context_key(purpose, model, messages, params))
+        if not rows:
+            return None
+        matrix = np.stack([np.frombuffer(row["vector"], dtype=np.float32) for row in rows])
+        scores = matrix @ self._embed(messages[-1].get("content") or "")
+        for position in np.argsort(-scores)[:5]:
+            if scores[position] < self.semantic_threshold:
+                break
+            response = self.repository.get_llm_cache_entry(rows[position]["key"])
+            if response is not None:
+                return response
+        return None
+
+    # ========== RESPOSTA ==========
+
+    @staticmethod
+    def _completion(stored: str, model: str):
+        """Reconstrói um objeto no formato de ``ChatCompletion`` (atributos usados pelos agentes)"""
+        data = json.loads(stored)
+        message = SimpleNamespace(role="assistant", content=data["content"])
+        return SimpleNamespace(id="chatcmpl-cache", model=model, cached=True, usage=None,
+                               choices=[SimpleNamespace(index=0, finish_reason="stop", message=message)])
@@ -367,37 +367,53 @@ async def test_knowledge_base_mass_generation():
     print(f"   Conhecimento removido: {deleted}")
     
     # Teste 7: Performance com muitos dados
-    print("\n⚡ Teste 7: Performance com Muitos Dados")
+    print("\n⚡ Teste 7: Performance com Muitos Dados (1.000.000 de conhecimentos)")
     
-    # Gera 100 conhecimentos de teste
     import time
+    total_rows = 1_000_000
+    
+    def performance_dataset(count, version=1):
+        # Gerador: os itens são produzidos sob demanda e gravados em lotes (memória constante)
+        for i in range(count):
+            yield {
+                "key": f"performance_test_{i:07d}",
+                "value": f"Este é o conhecimento de teste número {i} (versão {version}) para verificar performance",
+                "category": "performance_test"
+            }
+    
+    # Referência: gravação item a item (uma transação por conhecimento) em uma amostra
+    sample_size = 2000
     start_time = time.time()
+    for item in performance_dataset(sample_size):
+        db.add_knowledge(item["key"], item["value"], item["category"])
+    item_rate = sample_size / (time.time() - start_time)
+    print(f"   Item a item: {item_rate:,.0f} conhecimentos/s "
+          f"(~{total_rows / item_rate / 60:.0f} min estimados para {total_rows:,})")
     
-    large_dataset = []
-    for i in range(100):
-        large_dataset.append({
-            "key": f"performance_test_{i:03d}",
-            "value": f"Este é o conhecimento de teste número {i} para verificar performance",
-            "category": "performance_test"
-        })
+    # Upsert em lote: INSERT ... ON CONFLICT (key) DO UPDATE, 1000 linhas por instrução
+    start_time = time.time()
+    counts = db.bulk_upsert_knowledge(performance_dataset(total_rows))
+    elapsed = time.time() - start_time
+    print(f"   Upsert em lote: {counts['inserted']:,} inseridos, {counts['updated']:,} atualizados "
+          f"em {elapsed:.1f} segundos ({total_rows / elapsed:,.0f} conhecimentos/s)")
     
-    added_large = db.bulk_add_knowledge(large_dataset)
-    end_time = time.time()
+    # Segunda carga com as mesmas chaves: tudo vira atualização
+    start_time = time.time()
+    counts = db.bulk_upsert_knowledge(performance_dataset(total_rows, version=2))
+    elapsed = time.time() - start_time
+    print(f"   Recarga: {counts['inserted']:,} inseridos, {counts['updated']:,} atualizados "
+          f"em {elapsed:.1f} segundos")
+    print(f"   Valor atualizado: {db.get_knowledge('performance_test_0000042')}")
     
-    print(f"   Conhecimentos de performance adicionados: {added_large}")
-    print(f"   Tempo de inserção: {end_time - start_time:.2f} segundos")
+    # Limpeza de dados de teste
+    print("\n🧹 Limpeza de Dados de Teste")
+    removed = db.delete_knowledge_by_category("performance_test")
+    print(f"   Conhecimentos de performance removidos: {removed:,}")
     
     # Verifica total final
     final_count = len(db.get_all_knowledge())
     print(f"   Total final de conhecimentos: {final_count}")
     
-    # Limpeza de dados de teste
-    print("\n🧹 Limpeza de Dados de Teste")
-    performance_items = db.get_knowledge_by_category("performance_test")
-    for item in performance_items:
-        db.delete_knowledge(item['key'])
-    print(f"   Conhecimentos de performance removidos: {len(performance_items)}")
-    
     print("\n✅ Teste de geração de massa da KnowledgeBase concluído com sucesso!")
     
     return db
@@ -1,40 +1,156 @@
-from collections import deque
+import asyncio
 from datetime import datetime
 import json
-from typing import Dict, List
+import time
+from typing import AsyncIterator, Dict, Iterable, List
 import openai
 from dotenv import load_dotenv
 
+from cache import CachedRepository
+from compression import CompressionJob
+from consolidation import EXTRACT, SUMMARIZE, ConsolidationWorker
+from context_builder import ContextBuilder, TokenCounter
 from db import DatabaseConfig
-from prompt import get_create_system_message, get_extract_system_message
+import instrumentation
+from llm_cache import CHAT, DEFAULT_PURPOSES, ROLLUP, LLMCache
+from extraction_scheduler import ExtractionScheduler
+from prompt import (CHAT_SYSTEM_MESSAGE, get_batch_extract_system_message, get_create_system_message,
+                    get_extract_system_message, get_rollup_system_message, get_user_profile_message)
 from repository import MemoryRepository
+from retention import RetentionJob
+from semantic import MESSAGE, SUMMARY, SemanticMemory, SemanticRepository, format_memory
+from sharding import ShardedRepository
+from short_term import ShortTermMemory
+from write_behind import WriteBehindRepository
 
 _ = load_dotenv()  # força a execução
 
+ERROR_RESPONSE = "Desculpe, ocorreu um erro ao processar sua mensagem."
+STREAM_CALLER = "generate_response_stream"  # label ``caller`` das métricas de streaming
+
+
+def _chunk_text(chunk) -> str:
+    """Texto de um chunk de streaming (o chunk final de ``usage`` não tem ``choices``)"""
+    if not chunk.choices:
+        return ""
+    return getattr(chunk.choices[0].delta, "content", None) or ""
+
+
+def _conversation_text(messages: List[Dict]) -> str:
+    return "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+
+
+def _extraction_prompt(conversations: Dict[str, List[Dict]]) -> str:
+    """Prompt de extração de um lote; com um só usuário, o mesmo prompt da extração individual"""
+    if len(conversations) == 1:
+        messages, = conversations.values()
+        return get_extract_system_message(conversation_text=_conversation_text(messages))
+    return get_batch_extract_system_message("\n\n".join(
+        f"### {user_id}\n{_conversation_text(messages)}" for user_id, messages in conversations.items()
+    ))
+
+
+def _parse_extraction(extracted_info: str, conversations: Dict[str, List[Dict]]) -> Dict[str, Dict]:
+    """{user_id: campos não vazios} a partir da resposta da extração em lote"""
+    try:
+        extracted = json.loads(extracted_info)
+    except json.JSONDecodeError:
+        print(f" Error parsing extracted information: {extracted_info}")
+        return {}
+    if not isinstance(extracted, dict):
+        return {}
+    if len(conversations) == 1:
+        extracted = {next(iter(conversations)): extracted}
+    
+    updates = {}
+    for user_id in conversations:
+        user_info = extracted.get(user_id)
+        if isinstance(user_info, dict):
+            user_info = {k: v for k, v in user_info.items() if v}
+            if user_info:  # Só atualiza se tiver informações
+                updates[user_id] = user_info
+    return updates
+
+
 class DBMemoryAgent:
     """Sistema de memória usando SQLAlchemy para persistência"""
     
     def __init__(self, model: str = "gpt-3.5-turbo", short_term_limit: int = 10, 
-                 max_tokens: int = 4000, database_url: str = "sqlite:///memory.db"):
+                 max_tokens: int = 4000, database_url: str = "sqlite:///memory.db",
+                 max_resident_users: int = 1000, write_behind: bool = False,
+                 cache_ttl: float = 300.0, semantic_memory: bool = False,
+                 semantic_index_path: str = None, shards: Dict[str, str] = None,
+                 replica_urls: List[str] = None):
         # Configuração OpenAI
         self.client = openai.OpenAI()
         self.model = model
         self.max_tokens = max_tokens
         
         # Gerenciador de banco de dados
-        self.db = DatabaseConfig(database_url)
-        self.repository = MemoryRepository(self.db)
+        # write_behind=True acumula as mensagens e grava em lotes (ver WriteBehindRepository)
+        repository_factory = WriteBehindRepository if write_behind else MemoryRepository
+        if shards:
+            # Usuários distribuídos entre vários bancos (nome -> URL); o primeiro guarda o estado global
+            if semantic_memory:
+                raise ValueError("semantic_memory não é suportada com shards")
+            self.repository = ShardedRepository(shards, repository_factory=repository_factory)
+            self.db = self.repository.config
+        else:
+            # replica_urls: réplicas de leitura do banco (ver DatabaseConfig)
+            self.db = DatabaseConfig(database_url, replica_urls=replica_urls)
+            self.repository = repository_factory(self.db)
+        # Cache de perfis, resumos e conhecimento na frente do banco (cache_ttl=0 desativa)
+        if cache_ttl:
+            self.repository = CachedRepository(self.repository, ttl=cache_ttl)
         
-        # Memória de Curto Prazo - Contexto atual da conversa (ainda em memória para performance)
-        self.conversation_history = deque(maxlen=short_term_limit)
+        # Memória de Curto Prazo - Contexto atual da conversa, um buffer por usuário
+        # com limite LRU de usuários residentes e reidratação a partir do banco
+        self.conversation_history = ShortTermMemory(
+            per_user_limit=short_term_limit,
+            max_resident_users=max_resident_users,
+            loader=lambda user_id, limit: self.repository.get_recent_messages(user_id, limit=limit)
+        )
+        
+        # Memória semântica opcional: lembranças recuperadas por similaridade,
+        # inclusive de mensagens já removidas pela limpeza; com semantic_index_path
+        # a busca usa um índice aproximado persistido nesse diretório
+        self.semantic_memory = SemanticMemory(
+            self.repository, max_resident_users=max_resident_users, index_path=semantic_index_path
+        ) if semantic_memory else None
+        if self.semantic_memory is not None:
+            # Escritas na base de conhecimento e remoções atualizam os vetores na hora
+            self.repository = SemanticRepository(self.repository, self.semantic_memory)
         
         # Configurações de consolidação
         self.consolidation_threshold = 5  # Número de mensagens para consolidar
-        self.summary_trigger = 15  # Gatilho para criar resumo
+        self.summary_trigger = 15  # Mensagens novas (desde o último resumo) para criar resumo
+        self.summary_batch_limit = 40  # Máximo de mensagens por resumo incremental
+        self.summary_rollup_fanout = 3  # Resumos de um mesmo nível que geram um resumo de resumos
+        self.summary_context_limit = 6  # Resumos incluídos no contexto de cada resposta
         self.max_messages_per_user = 100  # Limite de mensagens por usuário no BD
+        
+        # Worker opcional de consolidação em segundo plano (ver attach_consolidation_worker)
+        self.consolidation_worker = None
+        
+        # Job opcional de retenção; substitui a limpeza por usuário em add_message (ver attach_retention_job)
+        self.retention_job = None
+        
+        # Job opcional de compressão das mensagens antigas (ver attach_compression_job)
+        self.compression_job = None
+        
+        # Cache opcional de respostas do LLM (ver attach_llm_cache)
+        self.llm_cache = None
+        
+        # Agendador opcional da extração; substitui o gatilho fixo (ver attach_extraction_scheduler)
+        self.extraction_scheduler = None
     
-    def add_message(self, user_id: str, role: str, content: str, metadata: Dict = None):
-        """Adiciona uma mensagem à memória de curto prazo e ao banco"""
+    def add_message(self, user_id: str, role: str, content: str, metadata: Dict = None,
+                    consolidate: bool = True) -> Dict:
+        """Adiciona uma mensagem à memória de curto prazo e ao banco.
+
+        Com ``consolidate=False`` extração, resumo e limpeza ficam para depois
+        (``_check_triggers`` com os contadores devolvidos).
+        """
         message = {
             "role": role,
             "content": content,
@@ -44,29 +160,179 @@ class DBMemoryAgent:
         }
         
         # Adiciona à memória de curto prazo
-        self.conversation_history.append(message)
+        self.conversation_history.append(user_id, message)
+        
+        # Persiste no banco de dados (uma transação; devolve os contadores do usuário)
+        counters = self.repository.add_message(user_id, role, content, metadata)
         
-        # Persiste no banco de dados
-        self.repository.add_message(user_id, role, content, metadata)
+        if self.semantic_memory is not None:
+            self.semantic_memory.remember(user_id, MESSAGE, content, counters["message_id"])
         
+        if self.extraction_scheduler is not None:
+            self.extraction_scheduler.observe(user_id, role, content)
+        
+        if consolidate:
+            self._check_triggers(user_id, counters)
+        return counters
+
+    def _check_triggers(self, user_id: str, counters: Dict):
+        """Dispara extração, resumo e limpeza conforme os contadores do usuário"""
         # Verifica se precisa consolidar conhecimento
-        if len([msg for msg in self.conversation_history if msg["user_id"] == user_id]) >= self.consolidation_threshold:
-            self._extract_and_consolidate_information(user_id)
+        if self.extraction_scheduler is not None:
+            # Sem a tarefa em segundo plano, os lotes devidos são extraídos aqui
+            if not self.extraction_scheduler.started and self.extraction_scheduler.due():
+                try:
+                    self.extraction_scheduler.run_once()
+                except Exception as e:
+                    print(f" Error extracting information: {str(e)}")
+        elif self.conversation_history.count(user_id) >= self.consolidation_threshold:
+            self._schedule_consolidation(EXTRACT, user_id)
         
-        # Cria resumo se conversa ficar muito longa
-        if self.repository.get_message_count(user_id) >= self.summary_trigger:
-            self._create_conversation_summary(user_id)
+        # Cria resumo quando acumular mensagens suficientes desde o último resumo
+        if counters["unsummarized_count"] >= self.summary_trigger:
+            self._schedule_consolidation(SUMMARIZE, user_id)
             
         # Limpa mensagens antigas se necessário
-        if self.repository.get_message_count(user_id) > self.max_messages_per_user:
+        if self.retention_job is None and counters["message_count"] > self.max_messages_per_user:
             deleted = self.repository.cleanup_old_messages(user_id, keep_last=self.max_messages_per_user // 2)
+            instrumentation.inc("memory_messages_cleaned_total", deleted, source="agent")
             print(f"🗑️ Removed {deleted} old messages for user {user_id}")
 
+    def flush(self):
+        """Grava as mensagens ainda no buffer de write-behind (no-op sem write_behind)"""
+        flush = getattr(self.repository, "flush", None)
+        if flush is not None:
+            flush()
+
+    def close(self):
+        """Grava o buffer de write-behind, salva o índice semântico e libera as conexões do banco"""
+        close = getattr(self.repository, "close", None)
+        if close is not None:
+            close()
+        if self.semantic_memory is not None:
+            self.semantic_memory.close()
+        self.repository.dispose()
+
+    def attach_consolidation_worker(self, queue=None, concurrency: int = 2,
+                                    max_retries: int = 3) -> ConsolidationWorker:
+        """Move extração e resumos para um worker em segundo plano.
+
+        Depois disso ``add_message`` apenas enfileira as tarefas; o worker deve
+        ser iniciado com ``await worker.start()`` dentro do event loop.
+        """
+        self.consolidation_worker = ConsolidationWorker(
+            handlers={EXTRACT: self._extract_user_information, SUMMARIZE: self._summarize_conversation},
+            queue=queue,
+            concurrency=concurrency,
+            max_retries=max_retries
+        )
+        return self.consolidation_worker
+
+    def attach_retention_job(self, max_age_days: float = None, archive_dir: str = None,
+                             max_rows_per_second: float = None) -> RetentionJob:
+        """Move a limpeza de mensagens antigas para um job global, fora do caminho das requisições.
+
+        Depois disso ``add_message`` não poda mais mensagens; o job aplica
+        ``max_messages_per_user`` (e a expiração, se informada) a todos os
+        usuários. Inicie com ``await job.start(interval)`` ou chame ``job.run_once()``.
+        """
+        self.retention_job = RetentionJob(
+            self.repository,
+            max_messages_per_user=self.max_messages_per_user,
+            max_age_days=max_age_days,
+            archive_dir=archive_dir,
+            max_rows_per_second=max_rows_per_second
+        )
+        return self.retention_job
+
+    def attach_compression_job(self, older_than_days: float = 30, algorithm: str = None,
+                               max_rows_per_second: float = None) -> CompressionJob:
+        """Comprime em segundo plano o texto das mensagens mais antigas que ``older_than_days``.
+
+        A leitura continua igual (o texto volta descomprimido). Não disponível
+        com shards. Inicie com ``await job.start(interval)`` ou chame ``job.run_once()``.
+        """
+        self.compression_job = CompressionJob(
+            self.repository,
+            older_than_days=older_than_days,
+            algorithm=algorithm,
+            max_rows_per_second=max_rows_per_second
+        )
+        return self.compression_job
+
+    def attach_llm_cache(self, ttl: float = 7 * 24 * 3600, max_entries: int = 10000,
+                         purposes: Iterable[str] = DEFAULT_PURPOSES, semantic_purposes: Iterable[str] = (),
+                         semantic_threshold: float = 0.95) -> LLMCache:
+        """Guarda as respostas do LLM no banco e as reaproveita em prompts repetidos.
+
+        Por padrão só extração e resumos usam o cache; inclua ``"chat"`` em
+        ``purposes`` (ou ``semantic_purposes``) para reaproveitar respostas da conversa.
+        """
+        self.llm_cache = LLMCache(
+            self.repository,
+            ttl=ttl,
+            max_entries=max_entries,
+            purposes=purposes,
+            semantic_purposes=semantic_purposes,
+            semantic_threshold=semantic_threshold
+        )
+        return self.llm_cache
+
+    def attach_extraction_scheduler(self, gain_threshold: float = 1.0, batch_size: int = 8,
+                                    max_batch_delay: float = 30.0, max_pending: int = 50,
+                                    max_staleness: float = 3600.0) -> ExtractionScheduler:
+        """Troca o gatilho fixo de extração por um agendador guiado pelo ganho de informação.
+
+        A extração deixa de rodar a cada mensagem: só quando as heurísticas locais
+        indicam informação nova sobre o usuário, com vários usuários por chamada ao
+        LLM. Opcionalmente, ``await scheduler.start(interval)`` tira os lotes de
+        ``add_message``; ``run_once(force=True)`` extrai tudo o que estiver pendente.
+        """
+        self.extraction_scheduler = ExtractionScheduler(
+            self._extract_batch,
+            gain_threshold=gain_threshold,
+            batch_size=batch_size,
+            max_batch_delay=max_batch_delay,
+            max_pending=max_pending,
+            max_staleness=max_staleness,
+            max_users=self.conversation_history.max_resident_users
+        )
+        return self.extraction_scheduler
+
+    def _chat_completion(self, purpose: str = CHAT, **kwargs):
+        """Única porta de chamada ao LLM (cache de respostas e ponto de instrumentação)"""
+        if self.llm_cache is not None and not kwargs.get("stream"):
+            cached = self.llm_cache.get(purpose, **kwargs)
+            if cached is not None:
+                return cached
+        response = self.client.chat.completions.create(**kwargs)
+        if self.llm_cache is not None and not kwargs.get("stream"):
+            self.llm_cache.put(purpose, response=response, **kwargs)
+        return response
+
+    def _schedule_consolidation(self, kind: str, user_id: str):
+        """Enfileira a consolidação ou, sem worker (ou com a fila cheia), executa agora"""
+        if self.consolidation_worker is not None and self.consolidation_worker.submit(kind, user_id):
+            instrumentation.inc("memory_consolidations_total", kind=kind, mode="worker")
+            return
+        instrumentation.inc("memory_consolidations_total", kind=kind, mode="inline")
+        
+        if kind == EXTRACT:
+            self._extract_and_consolidate_information(user_id)
+        else:
+            self._create_conversation_summary(user_id)
+
     def _extract_and_consolidate_information(self, user_id: str):
         """Extrai informações importantes da conversa e consolida no perfil do usuário"""
+        try:
+            self._extract_user_information(user_id)
+        except Exception as e:
+            print(f" Error extracting information: {str(e)}")
+
+    def _extract_user_information(self, user_id: str):
+        """Extração propriamente dita; erros de API são propagados para permitir retentativas"""
         # Pega as últimas mensagens para análise
-        recent_messages = [msg for msg in list(self.conversation_history)[-5:] 
-                          if msg["user_id"] == user_id]
+        recent_messages = self.conversation_history.recent(user_id, 5)
         
         if not recent_messages:
             return
@@ -78,88 +344,135 @@ class DBMemoryAgent:
         
         extraction_prompt = get_extract_system_message(conversation_text=conversation_text)
         
+        response = self._chat_completion(
+            purpose=EXTRACT,
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": extraction_prompt}],
+            max_tokens=500,
+            temperature=0.3
+        )
+        
+        extracted_info = response.choices[0].message.content
+        
+        # Tenta fazer parse do JSON
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": extraction_prompt}],
-                max_tokens=500,
-                temperature=0.3
-            )
+            user_info = json.loads(extracted_info)
+            # Remove campos vazios
+            user_info = {k: v for k, v in user_info.items() if v}
             
-            extracted_info = response.choices[0].message.content
-            
-            # Tenta fazer parse do JSON
-            try:
-                user_info = json.loads(extracted_info)
-                # Remove campos vazios
-                user_info = {k: v for k, v in user_info.items() if v}
-                
-                if user_info:  # Só atualiza se tiver informações
-                    self.repository.update_user_profile(user_id, user_info)
-                    print(f" User profile {user_id} updated: {user_info}")
-                    
-            except json.JSONDecodeError:
-                print(f" Error parsing extracted information: {extracted_info}")
+            if user_info:  # Só atualiza se tiver informações
+                self.repository.update_user_profile(user_id, user_info)
+                print(f" User profile {user_id} updated: {user_info}")
                 
-        except Exception as e:
-            print(f" Error extracting information: {str(e)}")
+        except json.JSONDecodeError:
+            print(f" Error parsing extracted information: {extracted_info}")
+
+    def _extract_batch(self, conversations: Dict[str, List[Dict]]):
+        """Extrai o perfil de vários usuários em uma única chamada ao LLM (lotes do ExtractionScheduler)"""
+        extraction_prompt = _extraction_prompt(conversations)
+        response = self._chat_completion(
+            purpose=EXTRACT,
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": extraction_prompt}],
+            max_tokens=500 * len(conversations),
+            temperature=0.3
+        )
+        instrumentation.inc("memory_consolidations_total", len(conversations), kind=EXTRACT, mode="batch")
+        
+        extracted_info = response.choices[0].message.content
+        for user_id, user_info in _parse_extraction(extracted_info, conversations).items():
+            self.repository.update_user_profile(user_id, user_info)
+            print(f" User profile {user_id} updated: {user_info}")
 
     def _create_conversation_summary(self, user_id: str):
         """Cria resumo da conversa atual e limpa parte da memória de curto prazo"""
-        # Busca mensagens recentes do usuário no banco
-        recent_messages = self.repository.get_recent_messages(user_id, limit=20)
+        try:
+            self._summarize_conversation(user_id)
+        except Exception as e:
+            print(f" Error creating summary: {str(e)}")
+
+    def _summarize_conversation(self, user_id: str):
+        """Sumarização incremental: resume só as mensagens após a marca d'água do usuário.
+        
+        Erros de API são propagados para permitir retentativas.
+        """
+        watermark = self.repository.get_summary_watermark(user_id)
+        new_messages = self.repository.get_messages_since(user_id, watermark, limit=self.summary_batch_limit)
         
-        if len(recent_messages) < 3:
+        if len(new_messages) < 3:
             return
         
         conversation_text = "\n".join([
-            f"{msg['role']}: {msg['content']}" for msg in recent_messages
+            f"{msg['role']}: {msg['content']}" for msg in new_messages
         ])
         
         summary_prompt = get_create_system_message(conversation_text=conversation_text)
 
-        try:
-            response = self.client.chat.completions.create(
+        response = self._chat_completion(
+            purpose=SUMMARIZE,
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": summary_prompt}],
+            max_tokens=300,
+            temperature=0.3
+        )
+        
+        summary = response.choices[0].message.content
+        
+        # Armazena o resumo e avança a marca d'água na mesma transação
+        stored = self.repository.add_conversation_summary(
+            user_id, summary, len(new_messages),
+            start_message_id=new_messages[0]["id"],
+            end_message_id=new_messages[-1]["id"],
+            expected_watermark=watermark
+        )
+        if not stored:
+            # Outro worker já resumiu essas mensagens
+            return
+        
+        print(f" Conversation summary created for user {user_id}")
+        
+        if self.semantic_memory is not None:
+            self.semantic_memory.remember(user_id, SUMMARY, summary)
+        
+        self._roll_up_summaries(user_id)
+        
+        # Limpa parte da memória de curto prazo
+        self._compress_short_term_memory(user_id)
+
+    def _roll_up_summaries(self, user_id: str):
+        """Consolida resumos acumulados em um resumo de nível superior (resumo de resumos)"""
+        level = 0
+        while True:
+            active = self.repository.get_active_summaries(user_id, level)
+            if len(active) < self.summary_rollup_fanout:
+                return
+            
+            summaries_text = "\n\n".join(item["summary"] for item in active)
+            response = self._chat_completion(
+                purpose=ROLLUP,
                 model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": summary_prompt}],
+                messages=[{"role": "user", "content": get_rollup_system_message(summaries_text=summaries_text)}],
                 max_tokens=300,
                 temperature=0.3
             )
             
-            summary = response.choices[0].message.content
-            
-            # Armazena o resumo no banco
-            self.repository.add_conversation_summary(user_id, summary, len(recent_messages))
-            
-            print(f" Conversation summary created for user {user_id}")
-            
-            # Limpa parte da memória de curto prazo
-            self._compress_short_term_memory(user_id)
+            rolled = self.repository.roll_up_summaries(
+                user_id, [item["id"] for item in active], response.choices[0].message.content, level + 1
+            )
+            if not rolled:
+                return
             
-        except Exception as e:
-            print(f" Error creating summary: {str(e)}")
+            print(f" Summaries of user {user_id} rolled up to level {level + 1}")
+            level += 1
 
     def _compress_short_term_memory(self, user_id: str):
         """Remove mensagens antigas da memória de curto prazo, mantendo as mais recentes"""
         # Mantém apenas as últimas 5 mensagens do usuário
-        user_messages = [msg for msg in self.conversation_history 
-                        if msg["user_id"] == user_id]
-        
-        if len(user_messages) > 5:
-            # Remove mensagens mais antigas
-            messages_to_keep = user_messages[-5:]
-            
-            # Reconstrói a fila mantendo apenas as mensagens recentes
-            new_history = deque(maxlen=self.conversation_history.maxlen)
-            for msg in self.conversation_history:
-                if msg["user_id"] != user_id or msg in messages_to_keep:
-                    new_history.append(msg)
-            
-            self.conversation_history = new_history
+        self.conversation_history.compress(user_id, keep_last=5)
 
     def get_user_profile(self, user_id: str) -> Dict:
         """Retorna o perfil completo do usuário"""
-        return self.repository.get_user_profile_dict(user_id)
+        return dict(self.repository.get_user_profile_dict(user_id))
     
     def get_conversation_summaries(self, user_id: str, limit: int = 5) -> List[str]:
         """Retorna resumos de conversas do usuário"""
@@ -169,16 +482,31 @@ class TestDBMemoryAgent:
     """Versão de teste com SQLAlchemy"""
     
     def __init__(self, model: str = "gpt-3.5-turbo", short_term_limit: int = 10, 
-                 max_tokens: int = 4000, database_url: str = "sqlite:///test_memory.db"):
+                 max_tokens: int = 4000, database_url: str = "sqlite:///test_memory.db",
+                 max_resident_users: int = 1000, write_behind: bool = False,
+                 context_budget: int = 3000, cache_ttl: float = 300.0,
+                 semantic_memory: bool = False,
+                 semantic_index_path: str = None, shards: Dict[str, str] = None,
+                 replica_urls: List[str] = None):
         self.model = model
         self.short_term_limit = short_term_limit
-        self.max_tokens = max_tokens
+        self.max_tokens = max_tokens  # Orçamento da resposta (completion)
+        # Orçamento do prompt: sistema > perfil > resumos > turnos recentes > conhecimento
+        self.context_builder = ContextBuilder(TokenCounter(model), budget=context_budget)
         self.memory_agent = DBMemoryAgent(
             model=model, 
             short_term_limit=short_term_limit, 
             max_tokens=max_tokens,
-            database_url=database_url
+            database_url=database_url,
+            max_resident_users=max_resident_users,
+            write_behind=write_behind,
+            cache_ttl=cache_ttl,
+            semantic_memory=semantic_memory,
+            semantic_index_path=semantic_index_path,
+            shards=shards,
+            replica_urls=replica_urls
         )
+        self.semantic_context_limit = 5  # Lembranças semânticas incluídas no contexto
 
     async def generate_response(self, user_id: str, user_message: str) -> str:
         """Gera resposta considerando toda a memória disponível"""
@@ -190,7 +518,8 @@ class TestDBMemoryAgent:
         
         try:
             # Chama OpenAI com contexto completo
-            response = self.memory_agent.client.chat.completions.create(
+            response = self.memory_agent._chat_completion(
+                purpose=CHAT,
                 model=self.model,
                 messages=context_messages,
                 max_tokens=self.max_tokens,
@@ -207,69 +536,113 @@ class TestDBMemoryAgent:
         except Exception as e:
             error_msg = f"Erro ao gerar resposta: {str(e)}"
             print(error_msg)
-            return "Desculpe, ocorreu um erro ao processar sua mensagem."
+            return ERROR_RESPONSE
+
+    async def generate_response_stream(self, user_id: str, user_message: str) -> AsyncIterator[str]:
+        """Versão em streaming de generate_response: produz os trechos da resposta à medida que chegam.
+
+        A resposta completa é gravada quando o stream termina; se o consumidor
+        desistir antes (``aclose()`` ou cancelamento), o que já chegou é gravado
+        com ``metadata={"partial": True}`` e a chamada ao LLM é encerrada.
+        Extração e resumo só rodam depois do último trecho.
+        """
+        counters = self.memory_agent.add_message(user_id, "user", user_message, consolidate=False)
+        context_messages = self._build_context_for_user(user_id)
+        
+        parts: List[str] = []
+        stream = None
+        pending = None     # chamada em andamento numa thread (criação do stream ou next())
+        completed = False  # stream lido até o fim
+        finished = False   # terminou sem interrupção do consumidor (com ou sem erro)
+        start = time.perf_counter()
+        try:
+            # As chamadas bloqueiam na rede: rodam fora do event loop. O shield mantém a
+            # chamada viva se o consumidor cancelar, para o stream só ser fechado depois dela
+            pending = asyncio.ensure_future(asyncio.to_thread(
+                self.memory_agent._chat_completion,
+                purpose=CHAT,
+                model=self.model,
+                messages=context_messages,
+                max_tokens=self.max_tokens,
+                temperature=0.7,
+                stream=True,
+                stream_options={"include_usage": True}
+            ))
+            stream = await asyncio.shield(pending)
+            while True:
+                pending = asyncio.ensure_future(asyncio.to_thread(next, stream, None))
+                chunk = await asyncio.shield(pending)
+                if chunk is None:
+                    break
+                instrumentation.record_llm_usage(getattr(chunk, "usage", None), self.model, STREAM_CALLER)
+                text = _chunk_text(chunk)
+                if text:
+                    if not parts:
+                        instrumentation.observe("memory_llm_first_token_seconds", time.perf_counter() - start,
+                                                model=self.model)
+                    parts.append(text)
+                    yield text
+            completed = finished = True
+            instrumentation.observe("memory_llm_seconds", time.perf_counter() - start,
+                                    caller=STREAM_CALLER, model=self.model)
+            
+        except Exception as e:
+            finished = True
+            print(f"Erro ao gerar resposta: {str(e)}")
+            if not parts:
+                yield ERROR_RESPONSE
+        
+        finally:
+            if not completed:
+                # O stream não é thread-safe: espera a leitura em andamento e fecha numa thread
+                if pending is not None:
+                    try:
+                        result = await pending
+                    except Exception:
+                        result = None
+                    if stream is None:
+                        stream = result
+                if stream is not None:
+                    await asyncio.to_thread(stream.close)
+            # Interrompido pelo consumidor: a consolidação fica para a próxima mensagem
+            if parts:
+                self.memory_agent.add_message(user_id, "assistant", "".join(parts),
+                                              None if completed else {"partial": True}, consolidate=finished)
+            elif finished:
+                self.memory_agent._check_triggers(user_id, counters)
 
     def _build_context_for_user(self, user_id: str) -> List[Dict]:
-        """Constrói contexto completo para o usuário incluindo dados do banco"""
-        messages = []
-        
-        # Sistema prompt com perfil do usuário
-        system_prompt = self._create_system_prompt(user_id)
-        messages.append({"role": "system", "content": system_prompt})
-        
-        # Adiciona resumos de conversas anteriores
-        summaries = self.memory_agent.get_conversation_summaries(user_id, limit=3)
-        if summaries:
-            combined_summary = "\n\n".join(summaries)
-            messages.append({
-                "role": "system", 
-                "content": f"Resumos de conversas anteriores:\n{combined_summary}"
-            })
-        
-        # Adiciona histórico recente da conversa (memória de curto prazo)
-        for msg in self.memory_agent.conversation_history:
-            if msg["user_id"] == user_id:
-                messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-        
-        # Se não tiver mensagens na memória de curto prazo, busca do banco
-        user_messages_in_memory = [msg for msg in self.memory_agent.conversation_history 
-                                  if msg["user_id"] == user_id]
-        
-        if len(user_messages_in_memory) < 2:
-            recent_db_messages = self.memory_agent.repository.get_recent_messages(user_id, limit=5)
-            for msg in recent_db_messages:
-                # Evita duplicar mensagens que já estão na memória
-                if not any(m["content"] == msg["content"] and m["role"] == msg["role"] 
-                          for m in messages):
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-        
-        return messages
+        """Constrói o contexto do usuário dentro do orçamento de tokens do prompt"""
+        profile = self.memory_agent.get_user_profile(user_id)
+        summaries = self.memory_agent.get_conversation_summaries(
+            user_id, limit=self.memory_agent.summary_context_limit
+        )
+        # Histórico recente (memória de curto prazo); usuários fora da memória
+        # são reidratados do banco automaticamente
+        history = self.memory_agent.conversation_history.get(user_id)
+        
+        return self.context_builder.build(
+            system=CHAT_SYSTEM_MESSAGE,
+            profile=get_user_profile_message(profile),
+            summaries=summaries,
+            history=history,
+            knowledge=self._get_relevant_memories(user_id, history)
+        )
     
-    def _create_system_prompt(self, user_id: str) -> str:
-        """Cria prompt do sistema baseado no perfil do usuário"""
-        base_prompt = """Você é um assistente IA inteligente que mantém contexto de conversas. 
-        Seja helpful, preciso e mantenha consistência baseada no que você sabe sobre o usuário."""
+    def _get_relevant_memories(self, user_id: str, history: List[Dict]) -> List[str]:
+        """Lembranças e conhecimentos mais similares à mensagem atual (menor prioridade no orçamento).
+
+        Requer ``semantic_memory=True``; mensagens que já estão no histórico recente são ignoradas.
+        """
+        semantic_memory = self.memory_agent.semantic_memory
+        query = next((msg["content"] for msg in reversed(history) if msg["role"] == "user"), None)
+        if semantic_memory is None or not query:
+            return []
         
-        profile = self.memory_agent.get_user_profile(user_id)
-        if profile:
-            profile_info = f"""
-            
-PERFIL DO USUÁRIO:
-- Nome: {profile.get('name', 'Não informado')}
-- Interesses: {', '.join(profile.get('interests', []))}
-- Preferências: {profile.get('preferences', 'Não definidas')}
-- Contexto: {profile.get('context', 'Não disponível')}
-- Última interação: {profile.get('last_interaction', 'Primeira vez')}
-"""
-            base_prompt += profile_info
-        
-        return base_prompt
+        recent = {msg["content"] for msg in history}
+        results = semantic_memory.search(user_id, query, k=self.semantic_context_limit + len(history))
+        return [format_memory(result) for result in results
+                if result["content"] not in recent][:self.semantic_context_limit]
     
     def get_user_profile(self, user_id: str) -> Dict:
         """Retorna perfil do usuário"""
@@ -278,6 +651,10 @@ PERFIL DO USUÁRIO:
     def add_message(self, user_id: str, role: str, content: str, metadata: Dict = None):
         """Adiciona mensagem (para compatibilidade com testes antigos)"""
         self.memory_agent.add_message(user_id, role, content, metadata)
+    
+    def close(self):
+        """Grava o buffer de write-behind e libera as conexões do banco"""
+        self.memory_agent.close()
 
 
 class MemoryAgent(DBMemoryAgent):
@@ -0,0 +1,106 @@
+"""Migrações leves de esquema para bancos já existentes (SQLite/PostgreSQL).
+
+``Base.metadata.create_all`` só cria tabelas que ainda não existem; colunas
+novas adicionadas aos modelos precisam ser aplicadas aqui.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateColumn
+
+from db import Base
+import fulltext
+import models  # noqa: F401 - registra as tabelas em Base.metadata
+
+
+def add_missing_columns(connection: Connection) -> list:
+    """Adiciona às tabelas existentes as colunas declaradas nos modelos que faltam.
+
+    Retorna a lista de colunas adicionadas no formato ``tabela.coluna``.
+    """
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns or column.primary_key:
+                continue
+            column_ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            # Colunas novas entram sempre como anuláveis: linhas antigas ficam com NULL
+            column_ddl = str(column_ddl).replace(" NOT NULL", "")
+            connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}")
+            added.append(f"{table.name}.{column.name}")
+
+    return added
+
+
+def add_missing_indexes(connection: Connection) -> list:
+    """Cria nos bancos existentes os índices declarados nos modelos que ainda não existem.
+
+    Em tabelas grandes de PostgreSQL prefira criar os índices manualmente com
+    ``CREATE INDEX CONCURRENTLY`` antes do deploy; aqui a criação é bloqueante.
+    """
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            index.create(bind=connection)
+            added.append(index.name)
+
+    return added
+
+
+def backfill_message_counters(connection: Connection) -> list:
+    """Preenche os contadores desnormalizados de perfis criados antes de existirem"""
+    result = connection.exec_driver_sql("""
+        UPDATE user_profiles SET
+            message_count = (SELECT COUNT(*) FROM messages WHERE messages.user_id = user_profiles.id),
+            unsummarized_count = (
+                SELECT COUNT(*) FROM messages
+                WHERE messages.user_id = user_profiles.id
+                  AND messages.id > COALESCE(user_profiles.summary_watermark, 0)
+            )
+        WHERE message_count IS NULL OR unsummarized_count IS NULL
+    """)
+    return [f"user_profiles.message_count ({result.rowcount} perfis)"] if result.rowcount else []
+
+
+def convert_metadata_to_jsonb(connection: Connection) -> list:
+    """PostgreSQL: converte ``messages.message_metadata`` de texto para JSONB.
+
+    Reescreve a tabela inteira sob bloqueio exclusivo; em bancos grandes,
+    rode fora do horário de pico.
+    """
+    if connection.dialect.name != "postgresql":
+        return []
+    columns = {col["name"]: col for col in inspect(connection).get_columns("messages")}
+    column = columns.get("message_metadata")
+    if column is None or isinstance(column["type"], JSONB):
+        return []
+    connection.exec_driver_sql(
+        "ALTER TABLE messages ALTER COLUMN message_metadata TYPE JSONB "
+        "USING NULLIF(message_metadata, '')::jsonb"
+    )
+    return ["messages.message_metadata (JSONB)"]
+
+
+def upgrade(connection: Connection) -> list:
+    """Aplica todas as migrações pendentes"""
+    return (add_missing_columns(connection)
+            + add_missing_indexes(connection)
+            + backfill_message_counters(connection)
+            + convert_metadata_to_jsonb(connection)
+            + fulltext.install(connection))
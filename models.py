@@ -1,11 +1,36 @@
-from sqlalchemy import Column, String, Text, DateTime, Integer, ForeignKey
+from sqlalchemy import Column, String, Text, DateTime, Integer, ForeignKey, Index, LargeBinary
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
 from typing import Dict, List, Any
 import json
 
+import codec
 from db import Base
 
+
+class JSONText(TypeDecorator):
+    """JSON: ``JSONB`` no PostgreSQL, texto nos demais bancos.
+
+    Aceita na escrita tanto a string JSON quanto o objeto; na leitura devolve o
+    que o driver entrega (dict no PostgreSQL, string nos demais), e quem lê
+    trata os dois casos.
+    """
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(JSONB() if dialect.name == "postgresql" else Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == "postgresql":
+            return json.loads(value) if isinstance(value, str) else value
+        return value if isinstance(value, str) else json.dumps(value)
+
+
 class UserProfile(Base):
     """Tabela para armazenar perfis de usuários"""
     __tablename__ = 'user_profiles'
@@ -17,6 +42,9 @@ class UserProfile(Base):
     context = Column(Text, nullable=True)
     first_interaction = Column(DateTime, default=datetime.now)
     last_interaction = Column(DateTime, default=datetime.now)
+    summary_watermark = Column(Integer, default=0)  # id da última mensagem já resumida
+    message_count = Column(Integer, default=0)  # Contador desnormalizado de mensagens armazenadas
+    unsummarized_count = Column(Integer, default=0)  # Mensagens após a marca d'água de resumos
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     
@@ -37,6 +65,55 @@ class UserProfile(Base):
         """Define lista de interesses como JSON"""
         self.interests = json.dumps(interests) if interests else None
     
+    def apply_updates(self, updates: Dict[str, Any]):
+        """Aplica atualizações extraídas ao perfil, com tratamento de tipos"""
+        for key, value in updates.items():
+            if not value:  # Ignora valores vazios
+                continue
+                
+            if key == "interests":
+                # Trata interesses como lista
+                if isinstance(value, list):
+                    # Mescla interesses existentes com novos
+                    existing_interests = set(self.get_interests_list())
+                    new_interests = set(value)
+                    merged_interests = list(existing_interests.union(new_interests))
+                    self.set_interests_list(merged_interests)
+                elif isinstance(value, str):
+                    # Se for string, tenta fazer parse JSON ou adiciona como único interesse
+                    try:
+                        interest_list = json.loads(value)
+                        if isinstance(interest_list, list):
+                            existing_interests = set(self.get_interests_list())
+                            new_interests = set(interest_list)
+                            merged_interests = list(existing_interests.union(new_interests))
+                            self.set_interests_list(merged_interests)
+                    except (json.JSONDecodeError, TypeError):
+                        # Adiciona como interesse único
+                        existing_interests = set(self.get_interests_list())
+                        existing_interests.add(value)
+                        self.set_interests_list(list(existing_interests))
+                        
+            elif key == "preferences":
+                # Trata preferências como string
+                if isinstance(value, list):
+                    # Se for lista, junta em string
+                    self.preferences = ", ".join(str(v) for v in value if v)
+                elif isinstance(value, str):
+                    self.preferences = value
+                    
+            elif key in ["name", "context"]:
+                # Campos de texto simples
+                if isinstance(value, list):
+                    # Se for lista, junta em string
+                    setattr(self, key, ", ".join(str(v) for v in value if v))
+                elif isinstance(value, str):
+                    setattr(self, key, value)
+                    
+            elif hasattr(self, key) and isinstance(value, str):
+                # Outros campos que devem ser strings
+                setattr(self, key, value)
+    
     def to_dict(self) -> Dict[str, Any]:
         """Converte para dicionário para compatibilidade"""
         return {
@@ -52,13 +129,18 @@ class UserProfile(Base):
 class Message(Base):
     """Tabela para armazenar mensagens do histórico"""
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_messages_user_id_id', 'user_id', 'id'),
+        Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(String, ForeignKey('user_profiles.id'), nullable=False)
     role = Column(String, nullable=False)  # 'user', 'assistant', 'system'
-    content = Column(Text, nullable=False)
+    content = Column(Text, nullable=False)  # "" quando o texto está em content_compressed
     timestamp = Column(DateTime, default=datetime.now)
-    message_metadata = Column(Text, nullable=True)  # JSON string
+    message_metadata = Column(JSONText, nullable=True)
+    content_compressed = Column(LargeBinary, nullable=True)  # ver codec.py e compression.py
     
     # Relacionamentos
     user_profile = relationship("UserProfile", back_populates="messages")
@@ -67,6 +149,8 @@ class Message(Base):
         """Retorna metadata como dicionário"""
         if not self.message_metadata:
             return {}
+        if isinstance(self.message_metadata, dict):
+            return self.message_metadata
         try:
             return json.loads(self.message_metadata)
         except (json.JSONDecodeError, TypeError):
@@ -76,11 +160,18 @@ class Message(Base):
         """Define metadata como JSON"""
         self.message_metadata = json.dumps(metadata) if metadata else None
     
+    def get_content(self) -> str:
+        """Texto da mensagem, descomprimido se necessário"""
+        if self.content_compressed is not None:
+            return codec.decode(self.content_compressed)
+        return self.content
+    
     def to_dict(self) -> Dict[str, Any]:
         """Converte para dicionário para compatibilidade"""
         return {
+            "id": self.id,
             "role": self.role,
-            "content": self.content,
+            "content": self.get_content(),
             "timestamp": self.timestamp,
             "user_id": self.user_id,
             "metadata": self.get_metadata_dict()
@@ -90,12 +181,21 @@ class Message(Base):
 class ConversationSummary(Base):
     """Tabela para armazenar resumos de conversas"""
     __tablename__ = 'conversation_summaries'
+    __table_args__ = (
+        Index('ix_conversation_summaries_user_id_created_at', 'user_id', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(String, ForeignKey('user_profiles.id'), nullable=False)
-    summary = Column(Text, nullable=False)
+    summary = Column(Text, nullable=False)  # "" quando o texto está em summary_compressed
     created_at = Column(DateTime, default=datetime.now)
     message_count = Column(Integer, default=0)  # Número de mensagens resumidas
+    level = Column(Integer, default=0)  # 0 = resumo de mensagens, 1+ = resumo de resumos
+    parent_id = Column(Integer, nullable=True)  # Resumo de nível superior que absorveu este
+    start_message_id = Column(Integer, nullable=True)  # Primeira mensagem coberta
+    end_message_id = Column(Integer, nullable=True)  # Última mensagem coberta
+    # Só resumos absorvidos (parent_id) antigos, fora das leituras do turno; ver compression.py
+    summary_compressed = Column(LargeBinary, nullable=True)
     
     # Relacionamentos
     user_profile = relationship("UserProfile", back_populates="summaries")
@@ -104,6 +204,10 @@ class ConversationSummary(Base):
 class KnowledgeBase(Base):
     """Tabela para base de conhecimento geral"""
     __tablename__ = 'knowledge_base'
+    __table_args__ = (
+        # (category, id): filtro por categoria já na ordem da paginação por id
+        Index('ix_knowledge_base_category_id', 'category', 'id'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     key = Column(String, unique=True, nullable=False)
@@ -111,3 +215,87 @@ class KnowledgeBase(Base):
     category = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class ConsolidationJob(Base):
+    """Fila durável de tarefas de consolidação (extração de perfil, resumos)"""
+    __tablename__ = 'consolidation_jobs'
+    __table_args__ = (
+        Index('ix_consolidation_jobs_status_id', 'status', 'id'),
+        Index('ix_consolidation_jobs_kind_user_id_status', 'kind', 'user_id', 'status'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)  # 'extract', 'summarize'
+    user_id = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # 'pending', 'running', 'done', 'failed'
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class MemoryEmbedding(Base):
+    """Vetores da memória semântica (mensagens, resumos e conhecimento).
+
+    O vetor fica em ``vector`` como float32 contíguo (``numpy.ndarray.tobytes``);
+    ``content`` guarda o texto para que a lembrança sobreviva à limpeza das
+    mensagens antigas. ``user_id`` nulo indica conhecimento global.
+    """
+    __tablename__ = 'memory_embeddings'
+    __table_args__ = (
+        Index('ix_memory_embeddings_user_id_id', 'user_id', 'id'),
+        Index('ix_memory_embeddings_source_source_id', 'source', 'source_id'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, nullable=True)
+    source = Column(String, nullable=False)  # 'message', 'summary', 'knowledge'
+    source_id = Column(Integer, nullable=True)  # id da linha de origem, quando conhecido
+    content = Column(Text, nullable=False)
+    vector = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class CompressionDictionary(Base):
+    """Dicionários compartilhados da compressão de mensagens (ver codec.py).
+
+    ``id`` é o prefixo do SHA-256 de ``data`` (em hexadecimal), o mesmo gravado
+    no cabeçalho de cada mensagem comprimida com ele.
+    """
+    __tablename__ = 'compression_dictionaries'
+    __table_args__ = (
+        Index('ix_compression_dictionaries_algorithm_created_at', 'algorithm', 'created_at'),
+    )
+    
+    id = Column(String(16), primary_key=True)
+    algorithm = Column(String, nullable=False)  # 'zstd', 'zlib'
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class LLMCacheEntry(Base):
+    """Cache persistente de respostas do LLM.
+
+    ``key`` é o SHA-256 de (modelo, mensagens, parâmetros); ``response`` guarda
+    o texto e o uso de tokens em JSON. Na camada semântica, ``vector`` é o
+    embedding da última mensagem do prompt e ``context_key`` o hash de todo o
+    resto (modelo, mensagens anteriores, parâmetros).
+    """
+    __tablename__ = 'llm_cache'
+    __table_args__ = (
+        Index('ix_llm_cache_context_key', 'context_key'),
+        Index('ix_llm_cache_expires_at', 'expires_at'),
+        Index('ix_llm_cache_last_used_at', 'last_used_at'),
+    )
+    
+    key = Column(String(64), primary_key=True)
+    model = Column(String, nullable=False)
+    purpose = Column(String, nullable=False)  # 'extract', 'summarize', 'rollup', 'chat'
+    response = Column(Text, nullable=False)
+    context_key = Column(String(64), nullable=True)
+    vector = Column(LargeBinary, nullable=True)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.now)
+    last_used_at = Column(DateTime, default=datetime.now)
+    expires_at = Column(DateTime, nullable=False)
@@ -11,6 +11,19 @@ Return a JSON with:
 If no information is found, return empty fields.
 """
 
+BATCH_EXTRACT_SYSTEM_MESSAGE = """
+Analyze the following conversations, one per user, and extract important information about each user:
+{conversations_text}
+
+Return a JSON object keyed by user id, where each value has:
+- name: User's name (if mentioned)
+- interests: List of mentioned interests
+- preferences: Expressed preferences
+- context: Relevant context of the conversation
+
+Omit users with no information.
+"""
+
 CREATE_SYSTEM_MESSAGE = """
 Summarize the following conversation concisely, highlighting:
 - Main topics discussed
@@ -23,9 +36,55 @@ Conversation:
 Summary:
 """
 
+ROLLUP_SYSTEM_MESSAGE = """
+The following are consecutive summaries of earlier parts of a conversation, oldest first.
+Merge them into a single concise summary that preserves:
+- Main topics discussed
+- Important decisions or conclusions
+- Relevant context for future conversations
+
+Summaries:
+{summaries_text}
+
+Summary:
+"""
+
+CHAT_SYSTEM_MESSAGE = """Você é um assistente IA inteligente que mantém contexto de conversas. 
+        Seja helpful, preciso e mantenha consistência baseada no que você sabe sobre o usuário."""
+
+USER_PROFILE_MESSAGE = """
+            
+PERFIL DO USUÁRIO:
+- Nome: {name}
+- Interesses: {interests}
+- Preferências: {preferences}
+- Contexto: {context}
+- Última interação: {last_interaction}
+"""
+
 # Função para formatar os prompts
 def get_create_system_message(conversation_text: str) -> str:
     return CREATE_SYSTEM_MESSAGE.format(conversation_text=conversation_text)
 
 def get_extract_system_message(conversation_text: str) -> str:
     return EXTRACT_SYSTEM_MESSAGE.format(conversation_text=conversation_text)
+
+def get_batch_extract_system_message(conversations_text: str) -> str:
+    return BATCH_EXTRACT_SYSTEM_MESSAGE.format(conversations_text=conversations_text)
+
+def get_rollup_system_message(summaries_text: str) -> str:
+    return ROLLUP_SYSTEM_MESSAGE.format(summaries_text=summaries_text)
+
+def get_user_profile_message(profile: dict = None) -> str:
+    if not profile:
+        return ""
+    return USER_PROFILE_MESSAGE.format(
+        name=profile.get('name', 'Não informado'),
+        interests=', '.join(profile.get('interests', [])),
+        preferences=profile.get('preferences', 'Não definidas'),
+        context=profile.get('context', 'Não disponível'),
+        last_interaction=profile.get('last_interaction', 'Primeira vez')
+    )
+
+def get_chat_system_message(profile: dict = None) -> str:
+    return CHAT_SYSTEM_MESSAGE + get_user_profile_message(profile)
@@ -0,0 +1,232 @@
+"""Auditoria de planos de consulta do MemoryRepository.
+
+Executa cada método do repositório contra um banco de exemplo, captura o SQL
+emitido e roda EXPLAIN em cada SELECT/UPDATE/DELETE. Falha (código de saída 1)
+se alguma consulta fizer varredura completa de tabela.
+
+Uso: python query_audit.py [database_url]   (padrão: SQLite temporário)
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import event
+
+import codec
+from db import DatabaseConfig
+from repository import MemoryRepository
+
+# Métodos que, por definição, percorrem a tabela inteira
+ALLOWED_SCANS = {
+    "get_all_knowledge": "exportação completa da base de conhecimento",
+    "get_knowledge_to_embed": "sincronização completa dos vetores da base de conhecimento",
+    "delete_orphan_knowledge_embeddings": "sincronização completa dos vetores da base de conhecimento",
+    "evict_llm_cache": "remoção por tamanho percorre o índice de último uso",
+    "get_storage_stats": "relatório de bytes guardados soma a tabela inteira",
+    "sample_message_contents": "amostra percorre a chave primária só até juntar o limite",
+    "sample_compressed_messages": "amostra percorre a chave primária só até juntar o limite",
+}
+
+AUDIT_USER = "audit_user"
+
+
+def _seed(repo: MemoryRepository):
+    """Popula o banco com dados suficientes para exercitar todos os caminhos"""
+    repo.update_user_profile(AUDIT_USER, {"name": "Auditoria", "interests": ["sql"]})
+    for i in range(20):
+        repo.add_message(AUDIT_USER, "user" if i % 2 == 0 else "assistant", f"mensagem {i}")
+    repo.add_conversation_summary(AUDIT_USER, "resumo 1", 3, start_message_id=1, end_message_id=3)
+    repo.add_conversation_summary(AUDIT_USER, "resumo 2", 3, start_message_id=4, end_message_id=6)
+    repo.bulk_add_knowledge([
+        {"key": f"audit_{i}", "value": f"valor {i}", "category": "audit"} for i in range(10)
+    ])
+    repo.enqueue_consolidation_job("extract", AUDIT_USER)
+    repo.add_memory_embeddings([
+        {"user_id": AUDIT_USER, "source": "message", "source_id": i, "content": f"mensagem {i}",
+         "vector": b"\x00" * 16} for i in range(5)
+    ])
+    for i in range(5):
+        repo.put_llm_cache_entry(f"{i:064d}", "modelo", "extract", '{"content": "ok"}',
+                                 datetime.now() + timedelta(days=1), context_key="c" * 64, vector=b"\x00" * 16)
+
+
+def _scenarios(repo: MemoryRepository) -> List[Tuple[str, Callable]]:
+    """Chamadas representativas de cada método público do repositório"""
+    summary_ids = [s["id"] for s in repo.get_active_summaries(AUDIT_USER, 0)]
+    return [
+        ("get_or_create_user_profile", lambda: repo.get_or_create_user_profile(AUDIT_USER)),
+        ("update_user_profile", lambda: repo.update_user_profile(AUDIT_USER, {"context": "auditoria"})),
+        ("add_message", lambda: repo.add_message(AUDIT_USER, "user", "nova mensagem", {"a": 1})),
+        ("get_recent_messages", lambda: repo.get_recent_messages(AUDIT_USER, limit=10)),
+        ("add_conversation_summary", lambda: repo.add_conversation_summary(
+            AUDIT_USER, "resumo 3", 3, start_message_id=7, end_message_id=9, expected_watermark=6)),
+        ("get_conversation_summaries", lambda: repo.get_conversation_summaries(AUDIT_USER)),
+        ("get_summary_watermark", lambda: repo.get_summary_watermark(AUDIT_USER)),
+        ("get_messages_since", lambda: repo.get_messages_since(AUDIT_USER, 5, limit=10)),
+        ("get_unsummarized_message_count", lambda: repo.get_unsummarized_message_count(AUDIT_USER)),
+        ("get_active_summaries", lambda: repo.get_active_summaries(AUDIT_USER, 0)),
+        ("roll_up_summaries", lambda: repo.roll_up_summaries(AUDIT_USER, summary_ids, "resumo geral", 1)),
+        ("get_user_profile_dict", lambda: repo.get_user_profile_dict(AUDIT_USER)),
+        ("get_message_count", lambda: repo.get_message_count(AUDIT_USER)),
+        ("cleanup_old_messages", lambda: repo.cleanup_old_messages(AUDIT_USER, keep_last=15)),
+        ("get_users_over_message_cap", lambda: repo.get_users_over_message_cap(10)),
+        ("prune_messages_over_cap", lambda: repo.prune_messages_over_cap([AUDIT_USER], 12, archive=lambda rows: None)),
+        ("prune_expired_messages", lambda: repo.prune_expired_messages(
+            datetime.now() - timedelta(days=1), after_id=0, limit=100, archive=lambda rows: None)),
+        ("add_knowledge", lambda: repo.add_knowledge("audit_new", "valor", "audit")),
+        ("get_knowledge", lambda: repo.get_knowledge("audit_1")),
+        ("get_knowledge_by_category", lambda: repo.get_knowledge_by_category("audit")),
+        ("update_knowledge", lambda: repo.update_knowledge("audit_2", "novo valor", "audit")),
+        ("delete_knowledge", lambda: repo.delete_knowledge("audit_new")),
+        ("get_all_knowledge", lambda: repo.get_all_knowledge()),
+        ("search_knowledge", lambda: repo.search_knowledge("valor")),
+        ("bulk_add_knowledge", lambda: repo.bulk_add_knowledge([{"key": "audit_3", "value": "v", "category": "audit"}])),
+        ("bulk_upsert_knowledge", lambda: repo.bulk_upsert_knowledge(
+            [{"key": "audit_4", "value": "v"}, {"key": "audit_novo", "value": "v", "category": "audit"}])),
+        ("delete_knowledge_by_category", lambda: repo.delete_knowledge_by_category("audit_vazia")),
+        ("enqueue_consolidation_job", lambda: repo.enqueue_consolidation_job("summarize", AUDIT_USER)),
+        ("claim_consolidation_job", lambda: repo.claim_consolidation_job()),
+        ("complete_consolidation_job", lambda: repo.complete_consolidation_job(1)),
+        ("fail_consolidation_job", lambda: repo.fail_consolidation_job(2, "erro", retry=True)),
+        ("requeue_running_consolidation_jobs", lambda: repo.requeue_running_consolidation_jobs()),
+        ("get_pending_consolidation_count", lambda: repo.get_pending_consolidation_count(True)),
+        ("add_memory_embeddings", lambda: repo.add_memory_embeddings([
+            {"user_id": AUDIT_USER, "source": "summary", "content": "resumo", "vector": b"\x00" * 16}])),
+        ("get_memory_embeddings", lambda: repo.get_memory_embeddings(AUDIT_USER)),
+        ("get_memory_embeddings (conhecimento)", lambda: repo.get_memory_embeddings(None)),
+        ("get_memory_embeddings_page", lambda: repo.get_memory_embeddings_page(after_id=2, limit=100)),
+        ("get_memory_embeddings_by_ids", lambda: repo.get_memory_embeddings_by_ids([1, 3])),
+        ("get_knowledge_to_embed", lambda: repo.get_knowledge_to_embed()),
+        ("get_knowledge_by_keys", lambda: repo.get_knowledge_by_keys(["chave_1", "chave_2"])),
+        ("delete_memory_embeddings", lambda: repo.delete_memory_embeddings("message", [1, 2])),
+        ("delete_orphan_knowledge_embeddings", lambda: repo.delete_orphan_knowledge_embeddings()),
+        ("get_llm_cache_entry", lambda: repo.get_llm_cache_entry(f"{1:064d}")),
+        ("put_llm_cache_entry", lambda: repo.put_llm_cache_entry(
+            f"{1:064d}", "modelo", "extract", '{"content": "novo"}', datetime.now() + timedelta(days=1))),
+        ("get_llm_cache_vectors", lambda: repo.get_llm_cache_vectors("c" * 64)),
+        ("evict_llm_cache", lambda: repo.evict_llm_cache(max_entries=3)),
+        ("add_compression_dictionary", lambda: repo.add_compression_dictionary("zlib", b"mensagem " * 50)),
+        ("get_compression_dictionary", lambda: repo.get_compression_dictionary("zlib")),
+        ("sample_message_contents", lambda: repo.sample_message_contents(10)),
+        ("compress_messages", lambda: repo.compress_messages(
+            codec.Codec("zlib", dictionary=b"mensagem " * 50), datetime.now() + timedelta(days=1), limit=100)),
+        ("compress_summaries", lambda: repo.compress_summaries(
+            codec.Codec("zlib", dictionary=b"mensagem " * 50), datetime.now() + timedelta(days=1), limit=100)),
+        ("get_storage_stats", lambda: repo.get_storage_stats()),
+        ("sample_compressed_messages", lambda: repo.sample_compressed_messages(10)),
+        ("iter_knowledge", lambda: list(repo.iter_knowledge(after_id=1, page_size=2))),
+        ("iter_knowledge (categoria)", lambda: list(repo.iter_knowledge("audit", page_size=2))),
+        ("iter_messages", lambda: list(repo.iter_messages(after_id=3, limit=5, page_size=2))),
+        ("iter_messages (usuário)", lambda: list(repo.iter_messages(AUDIT_USER, page_size=4))),
+        ("get_user_ids", lambda: repo.get_user_ids("a", limit=100)),
+        ("export_user", lambda: repo.export_user(AUDIT_USER)),
+        ("import_user", lambda: repo.import_user(_renamed_export(repo, "audit_copy"))),
+        ("delete_user", lambda: repo.delete_user("audit_copy")),
+    ]
+
+
+def _renamed_export(repo: MemoryRepository, user_id: str) -> Dict:
+    """Exportação do usuário de auditoria com outro id, para importar no mesmo banco"""
+    data = repo.export_user(AUDIT_USER)
+    data["profile"]["id"] = user_id
+    for key in ("messages", "summaries", "embeddings"):
+        data[key] = [dict(row, user_id=user_id) for row in data[key]]
+    return data
+
+
+def _capture_statements(repo: MemoryRepository, func: Callable) -> List[Tuple[str, object]]:
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if executemany and parameters:
+            parameters = parameters[0]
+        captured.append((statement, parameters))
+
+    event.listen(repo.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        func()
+    finally:
+        event.remove(repo.engine, "before_cursor_execute", before_cursor_execute)
+    return captured
+
+
+def _is_plannable(statement: str) -> bool:
+    verb = statement.lstrip().split(None, 1)[0].upper()
+    return verb in ("SELECT", "UPDATE", "DELETE", "WITH")
+
+
+def _explain(repo: MemoryRepository, statement: str, parameters) -> Tuple[List[str], List[str]]:
+    """Retorna (linhas do plano, linhas que indicam varredura de tabela)"""
+    with repo.engine.connect() as conn:
+        if repo.engine.dialect.name == "sqlite":
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            plan = [row[-1] for row in rows]
+            # "SCAN tabela" sem índice (ou percorrendo um índice inteiro) é varredura completa;
+            # tabelas virtuais FTS5 consultadas por MATCH aparecem como "VIRTUAL TABLE INDEX 0:M..."
+            # e subconsultas intermediárias (ex.: funções de janela) como "CO-ROUTINE nome"
+            subqueries = {line.split(" ", 1)[1] for line in plan
+                          if line.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+            scans = [line for line in plan
+                     if line.startswith("SCAN ") and "CONSTANT ROW" not in line
+                     and not ("VIRTUAL TABLE INDEX" in line and ":M" in line)
+                     and line[len("SCAN "):] not in subqueries]
+        else:
+            conn.exec_driver_sql("SET enable_seqscan = off")
+            rows = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters).fetchall()
+            plan = [row[0] for row in rows]
+            scans = [line for line in plan if "Seq Scan" in line]
+        conn.rollback()
+    return plan, scans
+
+
+def audit(database_url: str, verbose: bool = False) -> Dict[str, List[str]]:
+    """Audita todas as consultas do repositório; retorna {método: [varreduras]}"""
+    config = DatabaseConfig(database_url, "postgresql" if database_url.startswith("postgresql") else "sqlite")
+    config.connection_string = database_url
+    repo = MemoryRepository(config)
+    _seed(repo)
+
+    failures = {}
+    for name, func in _scenarios(repo):
+        statements = [(s, p) for s, p in _capture_statements(repo, func) if _is_plannable(s)]
+        method_scans = []
+        for statement, parameters in statements:
+            plan, scans = _explain(repo, statement, parameters)
+            if verbose:
+                print(f"  [{name}] {' '.join(statement.split())[:120]}")
+                for line in plan:
+                    print(f"      {line}")
+            method_scans.extend(scans)
+
+        if not method_scans:
+            print(f"✅ {name}")
+        elif name in ALLOWED_SCANS:
+            print(f"⚠️ {name}: varredura permitida ({ALLOWED_SCANS[name]})")
+        else:
+            print(f"❌ {name}: {'; '.join(method_scans)}")
+            failures[name] = method_scans
+
+    repo.dispose()
+    return failures
+
+
+def main():
+    verbose = "-v" in sys.argv
+    args = [a for a in sys.argv[1:] if a != "-v"]
+
+    if args:
+        failures = audit(args[0], verbose)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            failures = audit(f"sqlite:///{os.path.join(tmp, 'audit.db')}", verbose)
+
+    if failures:
+        print(f"\n{len(failures)} método(s) com varredura completa de tabela")
+        sys.exit(1)
+    print("\nNenhuma varredura completa de tabela encontrada")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Registros leves para o caminho de leitura sem ORM.
+
+``MessageRecord`` e ``ProfileRecord`` são montados direto das linhas de um
+``select()`` do Core (sem identity map nem objetos do ORM) e se comportam como
+os dicionários de ``Message.to_dict()``/``UserProfile.to_dict()``: acesso por
+chave, ``get``, ``keys``/``items``, ``dict(registro)`` e comparação com dicts.
+
+O JSON (``metadata`` das mensagens, ``interests`` do perfil) só é lido quando a
+chave é acessada, e uma vez só. Mensagens comprimidas (``content_compressed``)
+chegam com o texto já descomprimido em ``content``.
+"""
+import json
+from collections.abc import Mapping
+from typing import Any, Dict, List
+
+import codec
+
+
+def _parse_json(raw: str, default):
+    if not raw:
+        return default
+    try:
+        return json.loads(raw)
+    except (json.JSONDecodeError, TypeError):
+        return default
+
+
+class _Record(Mapping):
+    """Base: ``_keys`` são as chaves expostas; cada uma é um atributo ou propriedade"""
+    __slots__ = ()
+    _keys: tuple = ()
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in self._keys}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class MessageRecord(_Record):
+    """Mensagem com as chaves de ``Message.to_dict()``"""
+    __slots__ = ("id", "role", "content", "timestamp", "user_id", "_metadata")
+    _keys = ("id", "role", "content", "timestamp", "user_id", "metadata")
+
+    def __init__(self, id: int, role: str, content: str, timestamp, user_id: str, metadata: str = None,
+                 compressed: bytes = None):
+        self.id = id
+        self.role = role
+        self.content = codec.decode(compressed) if compressed is not None else content
+        self.timestamp = timestamp
+        self.user_id = user_id
+        self._metadata = metadata if metadata else {}  # JSON cru até o primeiro acesso (dict no PostgreSQL)
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        if isinstance(self._metadata, str):
+            self._metadata = _parse_json(self._metadata, {})
+        return self._metadata
+
+
+class ProfileRecord(_Record):
+    """Perfil com as chaves de ``UserProfile.to_dict()``"""
+    __slots__ = ("name", "_interests", "preferences", "context", "first_interaction", "last_interaction")
+    _keys = ("name", "interests", "preferences", "context", "first_interaction", "last_interaction")
+
+    def __init__(self, name: str, interests: str, preferences: str, context: str,
+                 first_interaction, last_interaction):
+        self.name = name or ""
+        self._interests = interests if interests else []
+        self.preferences = preferences or ""
+        self.context = context or ""
+        self.first_interaction = first_interaction
+        self.last_interaction = last_interaction
+
+    @property
+    def interests(self) -> List[str]:
+        if isinstance(self._interests, str):
+            self._interests = _parse_json(self._interests, [])
+        return self._interests
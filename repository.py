@@ -1,32 +1,280 @@
-from sqlalchemy import create_engine
+from sqlalchemy import Boolean, LargeBinary, bindparam, cast, delete, func, insert, literal_column, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import InterfaceError, OperationalError
 from sqlalchemy.orm import sessionmaker
+from bisect import bisect_right
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Any, Optional, Tuple
+import functools
 import json
+import threading
+
+import codec
+from db import DatabaseConfig, ReplicaRouter, acquire_engine, ensure_schema, release_engine
+import fulltext
+import instrumentation
+import migrations
+from models import (Base, CompressionDictionary, ConsolidationJob, ConversationSummary, LLMCacheEntry, Message,
+                    MemoryEmbedding, UserProfile, KnowledgeBase)
+from records import MessageRecord, ProfileRecord
+
+def _insert_ignore(dialect_name: str, model):
+    """INSERT que ignora conflito de chave primária (SQLite/PostgreSQL)"""
+    if dialect_name == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing()
+    if dialect_name == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing()
+    return None
+
+
+KNOWLEDGE_CHUNK_SIZE = 1000  # linhas por lote (executemany + uma consulta de chaves existentes)
+
+
+def _knowledge_chunks(knowledge_items: Iterable[Dict], chunk_size: int, counts: Dict[str, int]):
+    """Agrupa os itens válidos em lotes de linhas prontas para gravar.
+
+    Chaves repetidas dentro de um lote viram uma só linha (a última vence, como
+    na gravação item a item) e contam como atualização; itens sem key/value são
+    contados em ``counts["skipped"]``.
+    """
+    chunk: Dict[str, Dict] = {}
+    for item in knowledge_items:
+        key, value = item.get("key"), item.get("value")
+        if not key or not value:
+            counts["skipped"] += 1
+            continue
+        category = item.get("category") or None
+        previous = chunk.get(key)
+        if previous is not None:
+            counts["updated"] += 1
+            category = category or previous["category"]
+        chunk[key] = {"key": key, "value": value, "category": category}
+        if len(chunk) >= chunk_size:
+            yield _stamp_rows(chunk.values())
+            chunk = {}
+    if chunk:
+        yield _stamp_rows(chunk.values())
+
+
+def _stamp_rows(rows) -> List[Dict]:
+    now = datetime.now()
+    return [dict(row, created_at=now, updated_at=now) for row in rows]
+
+
+def _knowledge_upsert(dialect_name: str):
+    """INSERT ... ON CONFLICT (key) DO UPDATE para executemany (SQLite/PostgreSQL).
+
+    Atualizações trocam o valor e só trocam a categoria se ela vier preenchida.
+    A instrução é a mesma para todos os lotes, então é compilada uma única vez.
+    """
+    dialect = {"sqlite": sqlite, "postgresql": postgresql}.get(dialect_name)
+    if dialect is None:
+        return None
+    table = KnowledgeBase.__table__
+    statement = dialect.insert(table)
+    statement = statement.on_conflict_do_update(index_elements=[table.c.key], set_={
+        "value": statement.excluded.value,
+        "category": func.coalesce(statement.excluded.category, table.c.category),
+        "updated_at": statement.excluded.updated_at,
+    })
+    if dialect_name == "postgresql":
+        # xmax = 0 só nas linhas recém-inseridas: separa inserções de atualizações
+        statement = statement.returning(literal_column("xmax = 0", Boolean))
+    return statement
+
+
+def _upsert_knowledge_chunk(connection, rows: List[Dict]) -> int:
+    """Grava um lote de conhecimentos na transação de ``connection``; retorna quantos eram novos.
+
+    Também usada pelo repositório assíncrono via ``run_sync``.
+    """
+    dialect_name = connection.dialect.name
+    statement = _knowledge_upsert(dialect_name)
+    if dialect_name == "postgresql":
+        return sum(1 for inserted in connection.execute(statement, rows).scalars() if inserted)
+
+    # Demais bancos: as chaves já existentes são lidas em uma consulta por lote
+    table = KnowledgeBase.__table__
+    existing = set(connection.execute(
+        select(table.c.key).where(table.c.key.in_([row["key"] for row in rows]))
+    ).scalars())
+    if statement is not None:
+        connection.execute(statement, rows)
+    else:
+        new_rows = [row for row in rows if row["key"] not in existing]
+        if new_rows:
+            connection.execute(insert(table), new_rows)
+        if existing:
+            connection.execute(
+                update(table).where(table.c.key == bindparam("b_key")).values(
+                    value=bindparam("value"),
+                    category=func.coalesce(bindparam("category"), table.c.category),
+                    updated_at=bindparam("updated_at")),
+                [dict(row, b_key=row["key"]) for row in rows if row["key"] in existing]
+            )
+    return len(rows) - len(existing)
+
+
+def _floor_remap(old_ids: List[int], new_ids: List[int]) -> Callable[[Optional[int]], Optional[int]]:
+    """Mapeia um id antigo para o novo id da maior linha copiada com id antigo <= ele (0 se nenhuma)"""
+    def remap(old_id: Optional[int]) -> Optional[int]:
+        if old_id is None:
+            return None
+        position = bisect_right(old_ids, old_id) - 1
+        return new_ids[position] if position >= 0 else 0
+    return remap
+
+
+def _insert_returning_ids(session, table, rows: List[Dict[str, Any]]) -> List[int]:
+    """Insere as linhas sem o id original e devolve os ids gerados, na ordem das linhas"""
+    if not rows:
+        return []
+    rows = [{column: value for column, value in row.items() if column != "id"} for row in rows]
+    return list(session.execute(
+        insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+    ).scalars())
+
+
+# ========== CAMINHO DE LEITURA SEM ORM ==========
+#
+# Consultas do Core com só as colunas usadas e parâmetros nomeados: montadas uma
+# vez, compiladas uma vez (cache do SQLAlchemy) e lidas como tuplas, sem
+# identity map. As linhas viram ``MessageRecord``/``ProfileRecord``.
+
+_messages, _profiles = Message.__table__, UserProfile.__table__
+_MESSAGE_COLUMNS = (_messages.c.id, _messages.c.role, _messages.c.content, _messages.c.timestamp,
+                    _messages.c.user_id, _messages.c.message_metadata, _messages.c.content_compressed)
+
+RECENT_MESSAGES = select(*_MESSAGE_COLUMNS)\
+    .where(_messages.c.user_id == bindparam("user_id"))\
+    .order_by(_messages.c.timestamp.desc())\
+    .limit(bindparam("limit"))
+
+MESSAGES_SINCE = select(*_MESSAGE_COLUMNS)\
+    .where(_messages.c.user_id == bindparam("user_id"), _messages.c.id > bindparam("after_id"))\
+    .order_by(_messages.c.id)\
+    .limit(bindparam("limit"))
+
+USER_PROFILE = select(_profiles.c.name, _profiles.c.interests, _profiles.c.preferences, _profiles.c.context,
+                      _profiles.c.first_interaction, _profiles.c.last_interaction)\
+    .where(_profiles.c.id == bindparam("user_id"))
+
+COMPRESSION_DICTIONARIES = select(CompressionDictionary.__table__.c.data)
+
+
+def needs_dictionaries(rows, column: str = "content_compressed") -> bool:
+    """Se algum valor comprimido (mensagem ou resumo) usa um dicionário ainda não registrado no ``codec``"""
+    return any(getattr(row, column) is not None and not codec.has_dictionary(getattr(row, column))
+               for row in rows)
+
+
+def register_dictionaries(rows):
+    for (data,) in rows:
+        codec.register_dictionary(data)
+
+
+KNOWLEDGE = ("knowledge",)  # chave de read-your-writes da base de conhecimento (global)
+
+
+def _user_key(args, kwargs) -> Optional[Hashable]:
+    return args[0] if args else kwargs.get("user_id")
+
+
+def read_only(key: Hashable = None):
+    """Marca um método só de leitura: com réplicas, ele roda em uma delas (ver ``ReplicaRouter``).
+
+    ``key`` é a chave de read-your-writes; sem ela, é o ``user_id`` (primeiro
+    argumento). Se a réplica falhar (conexão, tabela ausente), ela sai de uso
+    por um tempo e a leitura é refeita na próxima ou no primário.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            router = self.replicas
+            if router is None or getattr(self._local, "engine", None) is not None:
+                return method(self, *args, **kwargs)
+            for index in router.candidates(key if key is not None else _user_key(args, kwargs)):
+                try:
+                    with router.reading(index) as engine:
+                        self._local.engine = engine
+                        result = method(self, *args, **kwargs)
+                    instrumentation.inc("memory_db_reads_total", target="replica")
+                    return result
+                except (OperationalError, InterfaceError) as e:
+                    router.mark_down(index)
+                    instrumentation.inc("memory_replica_errors_total")
+                    print(f" Replica {router.urls[index]} unavailable, falling back: {str(e).splitlines()[0]}")
+                finally:
+                    self._local.engine = None
+            instrumentation.inc("memory_db_reads_total", target="primary")
+            return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def writes(key: Hashable = None):
+    """Marca um método que escreve: abre a janela de read-your-writes da chave (padrão: ``user_id``)"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if self.replicas is not None:
+                    self.replicas.note_write(key if key is not None else _user_key(args, kwargs))
+        return wrapper
+    return decorator
 
-from db import DatabaseConfig
-from models import Base, ConversationSummary, Message, UserProfile, KnowledgeBase
 
 class MemoryRepository:
-    """Gerenciador de conexão e operações com banco de dados"""
+    """Gerenciador de conexão e operações com banco de dados.
+
+    O engine vem do registro do processo (``db.acquire_engine``): repositórios
+    da mesma URL compartilham o pool, então criar um repositório não abre
+    conexões. O esquema é criado no primeiro acesso, uma vez por banco.
+    Com ``config.replica_urls``, os métodos ``@read_only`` leem das réplicas.
+    """
     def __init__(self, config: DatabaseConfig):
         self.config = config
-        self.engine = create_engine(
-            config.connection_string,
-            echo=False,  # Mude para True para ver as queries SQL
-            pool_pre_ping=True if config.database_type == "postgresql" else False
-        )
+        self.engine = acquire_engine(config)
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
-        self.create_tables()
+        self.replicas = ReplicaRouter(config.replica_configs(), config.sticky_seconds,
+                                      config.replica_retry_seconds) if config.replica_urls else None
+        self._local = threading.local()  # engine da réplica da leitura em andamento nesta thread
+        self._disposed = False
+        self._build_write_statements()
     
-    def create_tables(self):
-        """Cria todas as tabelas"""
+    def create_tables(self) -> bool:
+        """Cria todas as tabelas e aplica migrações de colunas; retorna se há índice full-text"""
         Base.metadata.create_all(bind=self.engine)
+        with self.engine.begin() as connection:
+            migrations.upgrade(connection)
+            register_dictionaries(connection.execute(COMPRESSION_DICTIONARIES))
+            return fulltext.is_available(connection)
+    
+    def _ensure_schema(self) -> bool:
+        """Cria o esquema na primeira vez que o banco é usado no processo"""
+        return ensure_schema(self.config, self.create_tables)
+    
+    @property
+    def _fulltext(self) -> bool:
+        return self._ensure_schema()
     
     def get_session(self):
-        """Retorna nova sessão de banco de dados"""
-        return self.SessionLocal()
+        """Retorna nova sessão de banco de dados (na réplica, dentro de um método ``@read_only``)"""
+        self._ensure_schema()
+        engine = getattr(self._local, "engine", None)
+        return self.SessionLocal(bind=engine) if engine is not None else self.SessionLocal()
     
+    def dispose(self):
+        """Devolve o engine ao registro; o pool fecha quando o último repositório da URL sai"""
+        if not self._disposed:
+            self._disposed = True
+            release_engine(self.engine)
+            if self.replicas is not None:
+                self.replicas.dispose()
+    
+    @writes()
     def get_or_create_user_profile(self, user_id: str) -> UserProfile:
         """Obtém ou cria um perfil de usuário"""
         with self.get_session() as session:
@@ -48,133 +296,260 @@ class MemoryRepository:
             
             return profile
     
-    def update_user_profile(self, user_id: str, updates: Dict[str, Any]):
-        """Atualiza perfil do usuário"""
+    @writes()
+    def update_user_profile(self, user_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
+        """Atualiza perfil do usuário e retorna o perfil resultante como dicionário"""
         with self.get_session() as session:
+            self._ensure_profile(session, user_id)
             profile = session.query(UserProfile).filter(UserProfile.id == user_id).first()
             
-            if not profile:
-                profile = self.get_or_create_user_profile(user_id)
-                session = self.get_session()
-                profile = session.query(UserProfile).filter(UserProfile.id == user_id).first()
-            
             # Atualiza campos com tratamento de tipos
-            for key, value in updates.items():
-                if not value:  # Ignora valores vazios
-                    continue
-                    
-                if key == "interests":
-                    # Trata interesses como lista
-                    if isinstance(value, list):
-                        # Mescla interesses existentes com novos
-                        existing_interests = set(profile.get_interests_list())
-                        new_interests = set(value)
-                        merged_interests = list(existing_interests.union(new_interests))
-                        profile.set_interests_list(merged_interests)
-                    elif isinstance(value, str):
-                        # Se for string, tenta fazer parse JSON ou adiciona como único interesse
-                        try:
-                            interest_list = json.loads(value)
-                            if isinstance(interest_list, list):
-                                existing_interests = set(profile.get_interests_list())
-                                new_interests = set(interest_list)
-                                merged_interests = list(existing_interests.union(new_interests))
-                                profile.set_interests_list(merged_interests)
-                        except (json.JSONDecodeError, TypeError):
-                            # Adiciona como interesse único
-                            existing_interests = set(profile.get_interests_list())
-                            existing_interests.add(value)
-                            profile.set_interests_list(list(existing_interests))
-                            
-                elif key == "preferences":
-                    # Trata preferências como string
-                    if isinstance(value, list):
-                        # Se for lista, junta em string
-                        profile.preferences = ", ".join(str(v) for v in value if v)
-                    elif isinstance(value, str):
-                        profile.preferences = value
-                        
-                elif key in ["name", "context"]:
-                    # Campos de texto simples
-                    if isinstance(value, list):
-                        # Se for lista, junta em string
-                        setattr(profile, key, ", ".join(str(v) for v in value if v))
-                    elif isinstance(value, str):
-                        setattr(profile, key, value)
-                        
-                elif hasattr(profile, key) and isinstance(value, str):
-                    # Outros campos que devem ser strings
-                    setattr(profile, key, value)
+            profile.apply_updates(updates)
             
             profile.last_interaction = datetime.now()
+            updated = profile.to_dict()
             session.commit()
+            return updated
+    
+    def _build_write_statements(self):
+        """Pré-compila as instruções do caminho de escrita de mensagens (usadas a cada turno)"""
+        profile_insert = _insert_ignore(self.engine.dialect.name, UserProfile)
+        self._profile_insert_stmt = profile_insert.values(
+            id=bindparam("user_id"), name="", interests=json.dumps([]), preferences="", context="",
+            first_interaction=bindparam("now"), last_interaction=bindparam("now"),
+            created_at=bindparam("now"), updated_at=bindparam("now"),
+            summary_watermark=0, message_count=0, unsummarized_count=0
+        ) if profile_insert is not None else None
+        
+        self._message_insert_stmt = insert(Message.__table__)
+        
+        counters = update(UserProfile.__table__)\
+            .where(UserProfile.__table__.c.id == bindparam("user_id"))\
+            .values(
+                message_count=func.coalesce(UserProfile.__table__.c.message_count, 0) + 1,
+                unsummarized_count=func.coalesce(UserProfile.__table__.c.unsummarized_count, 0) + 1,
+                last_interaction=bindparam("now")
+            )
+        self._counter_update_returns = bool(self.engine.dialect.update_returning)
+        if self._counter_update_returns:
+            counters = counters.returning(UserProfile.__table__.c.message_count,
+                                          UserProfile.__table__.c.unsummarized_count)
+        self._counter_update_stmt = counters
+        self._counter_select_stmt = select(UserProfile.__table__.c.message_count,
+                                           UserProfile.__table__.c.unsummarized_count)\
+            .where(UserProfile.__table__.c.id == bindparam("user_id"))
     
-    def add_message(self, user_id: str, role: str, content: str, metadata: Dict[str, Any] = None):
-        """Adiciona mensagem ao histórico"""
+    def _ensure_profile(self, session, user_id: str):
+        """Garante que o perfil existe usando a sessão (e a transação) do chamador"""
+        now = datetime.now()
+        if self._profile_insert_stmt is not None:
+            session.connection().execute(self._profile_insert_stmt, {"user_id": user_id, "now": now})
+        elif session.get(UserProfile, user_id) is None:
+            session.add(UserProfile(id=user_id, name="", interests=json.dumps([]), preferences="",
+                                    context="", first_interaction=now, last_interaction=now,
+                                    summary_watermark=0, message_count=0, unsummarized_count=0))
+            session.flush()
+    
+    @writes()
+    def add_message(self, user_id: str, role: str, content: str, metadata: Dict[str, Any] = None) -> Dict[str, int]:
+        """Adiciona mensagem ao histórico.
+        
+        Upsert do perfil, inserção da mensagem e atualização dos contadores
+        desnormalizados acontecem em uma única transação, com instruções Core
+        pré-compiladas. Retorna os contadores atualizados (``message_id``,
+        ``message_count``, ``unsummarized_count``), para que o chamador não
+        precise de consultas COUNT.
+        """
+        now = datetime.now()
         with self.get_session() as session:
             # Garante que o perfil existe
-            self.get_or_create_user_profile(user_id)
+            self._ensure_profile(session, user_id)
+            connection = session.connection()
             
-            message = Message(
-                user_id=user_id,
-                role=role,
-                content=content,
-                timestamp=datetime.now()
-            )
+            result = connection.execute(self._message_insert_stmt, {
+                "user_id": user_id,
+                "role": role,
+                "content": content,
+                "timestamp": now,
+                "message_metadata": json.dumps(metadata) if metadata else None
+            })
+            message_id = result.inserted_primary_key[0]
             
-            if metadata:
-                message.set_metadata_dict(metadata)
+            params = {"user_id": user_id, "now": now}
+            if self._counter_update_returns:
+                row = connection.execute(self._counter_update_stmt, params).one()
+            else:
+                connection.execute(self._counter_update_stmt, params)
+                row = connection.execute(self._counter_select_stmt, params).one()
             
-            session.add(message)
             session.commit()
+            return {"message_id": message_id, "message_count": row[0], "unsummarized_count": row[1]}
     
+    @read_only()
     def get_recent_messages(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
-        """Obtém mensagens recentes do usuário"""
+        """Obtém mensagens recentes do usuário (``MessageRecord``, em ordem cronológica)"""
         with self.get_session() as session:
-            messages = session.query(Message)\
-                             .filter(Message.user_id == user_id)\
-                             .order_by(Message.timestamp.desc())\
-                             .limit(limit)\
-                             .all()
-            
-            return [msg.to_dict() for msg in reversed(messages)]
+            rows = session.connection().execute(RECENT_MESSAGES, {"user_id": user_id, "limit": limit}).all()
+            return self._message_records(reversed(rows))
     
-    def add_conversation_summary(self, user_id: str, summary: str, message_count: int = 0):
-        """Adiciona resumo de conversa"""
+    @writes()
+    def add_conversation_summary(self, user_id: str, summary: str, message_count: int = 0,
+                                 start_message_id: int = None, end_message_id: int = None,
+                                 expected_watermark: int = None) -> bool:
+        """Adiciona resumo de conversa.
+        
+        Se ``end_message_id`` for informado, avança a marca d'água de resumos do
+        usuário na mesma transação. Com ``expected_watermark``, o avanço é
+        condicional: se outro processo já resumiu essas mensagens, nada é gravado
+        e o retorno é False.
+        """
         with self.get_session() as session:
             # Garante que o perfil existe
-            self.get_or_create_user_profile(user_id)
+            self._ensure_profile(session, user_id)
+            
+            if end_message_id is not None:
+                watermark_update = session.query(UserProfile).filter(UserProfile.id == user_id)
+                if expected_watermark is not None:
+                    watermark_update = watermark_update.filter(
+                        func.coalesce(UserProfile.summary_watermark, 0) == expected_watermark
+                    )
+                remaining = session.query(func.count(Message.id))\
+                                   .filter(Message.user_id == user_id)\
+                                   .filter(Message.id > end_message_id)\
+                                   .scalar_subquery()
+                advanced = watermark_update.update({
+                    UserProfile.summary_watermark: end_message_id,
+                    UserProfile.unsummarized_count: remaining
+                }, synchronize_session=False)
+                if not advanced:
+                    session.rollback()
+                    return False
             
             summary_obj = ConversationSummary(
                 user_id=user_id,
                 summary=summary,
-                message_count=message_count
+                message_count=message_count,
+                level=0,
+                start_message_id=start_message_id,
+                end_message_id=end_message_id
             )
             
             session.add(summary_obj)
             session.commit()
+            return True
     
+    @read_only()
     def get_conversation_summaries(self, user_id: str, limit: int = 5) -> List[str]:
-        """Obtém resumos de conversas do usuário"""
+        """Obtém resumos de conversas do usuário (apenas os que não foram consolidados em outro)"""
         with self.get_session() as session:
             summaries = session.query(ConversationSummary)\
                               .filter(ConversationSummary.user_id == user_id)\
+                              .filter(ConversationSummary.parent_id.is_(None))\
                               .order_by(ConversationSummary.created_at.desc())\
                               .limit(limit)\
                               .all()
             
             return [summary.summary for summary in summaries]
     
-    def get_user_profile_dict(self, user_id: str) -> Dict[str, Any]:
-        """Retorna perfil do usuário como dicionário"""
+    @read_only()
+    def get_summary_watermark(self, user_id: str) -> int:
+        """Retorna o id da última mensagem já resumida para o usuário (0 se nenhuma)"""
         with self.get_session() as session:
-            profile = session.query(UserProfile).filter(UserProfile.id == user_id).first()
+            watermark = session.query(UserProfile.summary_watermark)\
+                               .filter(UserProfile.id == user_id)\
+                               .scalar()
+            return watermark or 0
+    
+    @read_only()
+    def get_messages_since(self, user_id: str, after_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+        """Obtém, em ordem cronológica, as mensagens do usuário com id maior que ``after_id``"""
+        with self.get_session() as session:
+            rows = session.connection().execute(
+                MESSAGES_SINCE, {"user_id": user_id, "after_id": after_id, "limit": limit}).all()
+            return self._message_records(rows)
+    
+    @read_only()
+    def get_unsummarized_message_count(self, user_id: str) -> int:
+        """Número de mensagens do usuário posteriores à marca d'água de resumos"""
+        with self.get_session() as session:
+            watermark = session.query(func.coalesce(UserProfile.summary_watermark, 0))\
+                               .filter(UserProfile.id == user_id)\
+                               .scalar_subquery()
+            return session.query(Message)\
+                          .filter(Message.user_id == user_id)\
+                          .filter(Message.id > func.coalesce(watermark, 0))\
+                          .count()
+    
+    @read_only()
+    def get_active_summaries(self, user_id: str, level: int = 0) -> List[Dict[str, Any]]:
+        """Resumos de um nível que ainda não foram consolidados, do mais antigo ao mais novo"""
+        with self.get_session() as session:
+            summaries = session.query(ConversationSummary)\
+                              .filter(ConversationSummary.user_id == user_id)\
+                              .filter(ConversationSummary.parent_id.is_(None))\
+                              .filter(func.coalesce(ConversationSummary.level, 0) == level)\
+                              .order_by(ConversationSummary.created_at, ConversationSummary.id)\
+                              .all()
             
-            if not profile:
-                return {}
+            return [{
+                "id": item.id,
+                "summary": item.summary,
+                "message_count": item.message_count or 0,
+                "created_at": item.created_at,
+                "start_message_id": item.start_message_id,
+                "end_message_id": item.end_message_id
+            } for item in summaries]
+    
+    @writes()
+    def roll_up_summaries(self, user_id: str, summary_ids: List[int], summary: str, level: int) -> bool:
+        """Substitui vários resumos por um resumo de nível superior (resumo de resumos).
+        
+        O novo resumo herda a data do resumo mais recente que absorve, mantendo a
+        ordem cronológica em ``get_conversation_summaries``. Retorna False se algum
+        dos resumos já tiver sido consolidado por outro processo.
+        """
+        with self.get_session() as session:
+            children = session.query(ConversationSummary)\
+                              .filter(ConversationSummary.id.in_(summary_ids))\
+                              .filter(ConversationSummary.user_id == user_id)\
+                              .filter(ConversationSummary.parent_id.is_(None))\
+                              .all()
+            if len(children) != len(summary_ids):
+                return False
+            
+            start_ids = [c.start_message_id for c in children if c.start_message_id is not None]
+            end_ids = [c.end_message_id for c in children if c.end_message_id is not None]
+            parent = ConversationSummary(
+                user_id=user_id,
+                summary=summary,
+                message_count=sum(c.message_count or 0 for c in children),
+                level=level,
+                start_message_id=min(start_ids) if start_ids else None,
+                end_message_id=max(end_ids) if end_ids else None,
+                created_at=max(c.created_at for c in children)
+            )
+            session.add(parent)
+            session.flush()
             
-            return profile.to_dict()
+            updated = session.query(ConversationSummary)\
+                             .filter(ConversationSummary.id.in_(summary_ids))\
+                             .filter(ConversationSummary.parent_id.is_(None))\
+                             .update({ConversationSummary.parent_id: parent.id}, synchronize_session=False)
+            if updated != len(summary_ids):
+                session.rollback()
+                return False
+            
+            session.commit()
+            return True
     
+    @read_only()
+    def get_user_profile_dict(self, user_id: str) -> Dict[str, Any]:
+        """Retorna perfil do usuário como ``ProfileRecord`` (mapeamento), ou {} se não existir"""
+        with self.get_session() as session:
+            row = session.connection().execute(USER_PROFILE, {"user_id": user_id}).first()
+            return ProfileRecord(*row) if row is not None else {}
+    
+    @writes()
     def cleanup_old_messages(self, user_id: str, keep_last: int = 50):
         """Remove mensagens antigas, mantendo apenas as mais recentes"""
         with self.get_session() as session:
@@ -191,9 +566,44 @@ class MemoryRepository:
                             .filter(~Message.id.in_(recent_message_ids))\
                             .delete(synchronize_session=False)
             
+            if deleted:
+                self._refresh_message_counters(session, user_id)
+            
             session.commit()
             return deleted
     
+    def _refresh_message_counters(self, session, user_id: str):
+        """Recalcula os contadores desnormalizados do usuário a partir da tabela de mensagens"""
+        total = session.query(func.count(Message.id))\
+                       .filter(Message.user_id == user_id)\
+                       .scalar_subquery()
+        unsummarized = session.query(func.count(Message.id))\
+                              .filter(Message.user_id == user_id)\
+                              .filter(Message.id > func.coalesce(UserProfile.summary_watermark, 0))\
+                              .scalar_subquery()
+        session.query(UserProfile)\
+               .filter(UserProfile.id == user_id)\
+               .update({UserProfile.message_count: total, UserProfile.unsummarized_count: unsummarized},
+                       synchronize_session=False)
+    
+    @staticmethod
+    def _refresh_message_counters_bulk(session, user_ids: List[str]):
+        """Recalcula os contadores de vários usuários em uma única instrução (subconsultas correlacionadas)"""
+        messages = Message.__table__
+        profiles = UserProfile.__table__
+        total = select(func.count(messages.c.id))\
+            .where(messages.c.user_id == profiles.c.id)\
+            .scalar_subquery()
+        unsummarized = select(func.count(messages.c.id))\
+            .where(messages.c.user_id == profiles.c.id)\
+            .where(messages.c.id > func.coalesce(profiles.c.summary_watermark, 0))\
+            .scalar_subquery()
+        session.execute(
+            update(profiles).where(profiles.c.id.in_(user_ids))
+                            .values(message_count=total, unsummarized_count=unsummarized)
+        )
+    
+    @read_only()
     def get_message_count(self, user_id: str) -> int:
         """Retorna número total de mensagens do usuário"""
         with self.get_session() as session:
@@ -201,6 +611,7 @@ class MemoryRepository:
     
     # ========== MÉTODOS PARA KNOWLEDGE BASE ==========
     
+    @writes(KNOWLEDGE)
     def add_knowledge(self, key: str, value: str, category: str = None):
         """Adiciona conhecimento à base geral"""
         with self.get_session() as session:
@@ -221,12 +632,14 @@ class MemoryRepository:
                 session.add(knowledge)
             session.commit()
     
+    @read_only(KNOWLEDGE)
     def get_knowledge(self, key: str) -> str:
         """Busca conhecimento por chave"""
         with self.get_session() as session:
             kb = session.query(KnowledgeBase).filter(KnowledgeBase.key == key).first()
             return kb.value if kb else None
     
+    @read_only(KNOWLEDGE)
     def get_knowledge_by_category(self, category: str) -> List[Dict]:
         """Busca conhecimento por categoria"""
         with self.get_session() as session:
@@ -235,6 +648,7 @@ class MemoryRepository:
                              .all()
             return [{"key": item.key, "value": item.value, "created_at": item.created_at} for item in kb_items]
     
+    @writes(KNOWLEDGE)
     def update_knowledge(self, key: str, value: str, category: str = None):
         """Atualiza conhecimento existente"""
         with self.get_session() as session:
@@ -248,6 +662,7 @@ class MemoryRepository:
                 return True
             return False
     
+    @writes(KNOWLEDGE)
     def delete_knowledge(self, key: str) -> bool:
         """Remove conhecimento da base"""
         with self.get_session() as session:
@@ -258,6 +673,7 @@ class MemoryRepository:
                 return True
             return False
     
+    @read_only(KNOWLEDGE)
     def get_all_knowledge(self) -> List[Dict]:
         """Retorna todo o conhecimento da base"""
         with self.get_session() as session:
@@ -265,45 +681,729 @@ class MemoryRepository:
             return [{"key": item.key, "value": item.value, "category": item.category, 
                     "created_at": item.created_at, "updated_at": item.updated_at} for item in kb_items]
     
-    def search_knowledge(self, search_term: str) -> List[Dict]:
-        """Busca conhecimento por termo (busca em key, value e category)"""
+    def iter_knowledge(self, category: str = None, after_id: int = 0, limit: Optional[int] = None,
+                       page_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Percorre a base de conhecimento (ou uma categoria) em ordem de id, com memória constante.
+
+        Gerador paginado por chave (``id > after_id``): cada página de até
+        ``page_size`` linhas é uma consulta curta e é lida com ``yield_per``.
+        Cada item traz ``id``; para paginar uma API, passe o ``id`` do último item
+        como ``after_id`` da próxima chamada. ``limit`` limita o total de itens.
+        """
+        table = KnowledgeBase.__table__
+        conditions = [table.c.category == category] if category is not None else []
+        yield from self._iter_by_id(
+            table, (table.c.id, table.c.key, table.c.value, table.c.category, table.c.created_at, table.c.updated_at),
+            conditions, after_id, limit, page_size, lambda row: dict(row._mapping))
+    
+    @read_only(KNOWLEDGE)
+    def search_knowledge(self, search_term: str, limit: Optional[int] = None, offset: int = 0,
+                         match_all: bool = True) -> List[Dict]:
+        """Busca conhecimento por termo em key, value e category, do mais para o menos relevante.
+
+        Usa o índice full-text (FTS5/tsvector) quando disponível; cada resultado
+        traz ``score`` e um ``snippet`` com os termos destacados. Por padrão
+        (``limit=None``) retorna todos os resultados; passe ``limit``/``offset``
+        para paginar. Resultados precisam ter todas as palavras do termo;
+        ``match_all=False`` aceita qualquer uma delas.
+        """
+        if not self._fulltext:
+            return self._search_knowledge_like(search_term, limit, offset)
+        
+        statement = fulltext.search_statement(self.engine.dialect.name, search_term, limit, offset, match_all)
+        if statement is None:
+            return []
+        with self.get_session() as session:
+            rows = session.execute(*statement).all()
+            return [{"key": row.key, "value": row.value, "category": row.category,
+                     "score": row.score, "snippet": row.snippet} for row in rows]
+    
+    def _search_knowledge_like(self, search_term: str, limit: Optional[int], offset: int) -> List[Dict]:
+        """Busca por substring (LIKE), para bancos sem índice full-text"""
         with self.get_session() as session:
             kb_items = session.query(KnowledgeBase)\
                              .filter(
                                  (KnowledgeBase.key.contains(search_term)) |
                                  (KnowledgeBase.value.contains(search_term)) |
                                  (KnowledgeBase.category.contains(search_term))
-                             ).all()
-            return [{"key": item.key, "value": item.value, "category": item.category} for item in kb_items]
+                             )\
+                             .order_by(KnowledgeBase.id)\
+                             .offset(offset)\
+                             .limit(limit)\
+                             .all()
+            return [{"key": item.key, "value": item.value, "category": item.category,
+                     "score": None, "snippet": fulltext.like_snippet(item.value, search_term)} for item in kb_items]
     
     def bulk_add_knowledge(self, knowledge_items: List[Dict]) -> int:
-        """Adiciona múltiplos conhecimentos de uma vez"""
-        added_count = 0
+        """Adiciona múltiplos conhecimentos de uma vez (atualiza os existentes); retorna quantos eram novos"""
+        return self.bulk_upsert_knowledge(knowledge_items)["inserted"]
+    
+    @writes(KNOWLEDGE)
+    def bulk_upsert_knowledge(self, knowledge_items: Iterable[Dict],
+                              chunk_size: int = KNOWLEDGE_CHUNK_SIZE) -> Dict[str, int]:
+        """Insere ou atualiza conhecimentos em lote com INSERT ... ON CONFLICT (key) DO UPDATE.
+        
+        Aceita qualquer iterável (ex.: um gerador lendo um arquivo) e o consome em
+        lotes de ``chunk_size``, um por transação, com memória constante.
+        Retorna as contagens ``{"inserted", "updated", "skipped"}``.
+        """
+        self._ensure_schema()
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        for rows in _knowledge_chunks(knowledge_items, chunk_size, counts):
+            with self.engine.begin() as connection:
+                inserted = _upsert_knowledge_chunk(connection, rows)
+            counts["inserted"] += inserted
+            counts["updated"] += len(rows) - inserted
+        return counts
+    
+    @writes(KNOWLEDGE)
+    def delete_knowledge_by_category(self, category: str) -> int:
+        """Remove todos os conhecimentos de uma categoria em uma única instrução"""
         with self.get_session() as session:
-            for item in knowledge_items:
-                key = item.get('key')
-                value = item.get('value')
-                category = item.get('category')
-                
-                if not key or not value:
-                    continue
+            deleted = session.execute(
+                delete(KnowledgeBase.__table__).where(KnowledgeBase.__table__.c.category == category)
+            ).rowcount
+            session.commit()
+            return deleted
+    
+    # ========== MÉTODOS PARA FILA DE CONSOLIDAÇÃO ==========
+    
+    def enqueue_consolidation_job(self, kind: str, user_id: str) -> bool:
+        """Enfileira tarefa de consolidação; ignora se já houver uma pendente igual"""
+        with self.get_session() as session:
+            exists = session.query(ConsolidationJob.id)\
+                            .filter(ConsolidationJob.kind == kind)\
+                            .filter(ConsolidationJob.user_id == user_id)\
+                            .filter(ConsolidationJob.status == "pending")\
+                            .first()
+            if exists:
+                return False
+            
+            session.add(ConsolidationJob(kind=kind, user_id=user_id, status="pending"))
+            session.commit()
+            return True
+    
+    def claim_consolidation_job(self) -> Optional[Dict[str, Any]]:
+        """Reserva a tarefa pendente mais antiga (pending -> running)"""
+        with self.get_session() as session:
+            candidates = session.query(ConsolidationJob.id)\
+                                .filter(ConsolidationJob.status == "pending")\
+                                .order_by(ConsolidationJob.id)\
+                                .limit(5)\
+                                .all()
+            
+            for (job_id,) in candidates:
+                # UPDATE condicional: só um worker consegue reservar a tarefa
+                claimed = session.query(ConsolidationJob)\
+                                 .filter(ConsolidationJob.id == job_id)\
+                                 .filter(ConsolidationJob.status == "pending")\
+                                 .update({
+                                     ConsolidationJob.status: "running",
+                                     ConsolidationJob.attempts: ConsolidationJob.attempts + 1,
+                                     ConsolidationJob.updated_at: datetime.now()
+                                 }, synchronize_session=False)
+                session.commit()
                 
-                # Verifica se já existe
-                existing = session.query(KnowledgeBase).filter(KnowledgeBase.key == key).first()
-                if not existing:
-                    knowledge = KnowledgeBase(
-                        key=key,
-                        value=value,
-                        category=category
-                    )
-                    session.add(knowledge)
-                    added_count += 1
-                else:
-                    # Atualiza existente
-                    existing.value = value
-                    if category:
-                        existing.category = category
-                    existing.updated_at = datetime.now()
+                if claimed:
+                    job = session.get(ConsolidationJob, job_id)
+                    return {"id": job.id, "kind": job.kind, "user_id": job.user_id, "attempts": job.attempts}
+            return None
+    
+    def complete_consolidation_job(self, job_id: int):
+        """Marca tarefa como concluída"""
+        with self.get_session() as session:
+            session.query(ConsolidationJob)\
+                   .filter(ConsolidationJob.id == job_id)\
+                   .update({ConsolidationJob.status: "done", ConsolidationJob.updated_at: datetime.now()},
+                           synchronize_session=False)
+            session.commit()
+    
+    def fail_consolidation_job(self, job_id: int, error: str, retry: bool = True):
+        """Registra falha; volta para pendente se ``retry`` ou marca como falha definitiva"""
+        with self.get_session() as session:
+            session.query(ConsolidationJob)\
+                   .filter(ConsolidationJob.id == job_id)\
+                   .update({
+                       ConsolidationJob.status: "pending" if retry else "failed",
+                       ConsolidationJob.last_error: error,
+                       ConsolidationJob.updated_at: datetime.now()
+                   }, synchronize_session=False)
+            session.commit()
+    
+    def requeue_running_consolidation_jobs(self) -> int:
+        """Devolve à fila tarefas que ficaram em execução (ex.: processo interrompido)"""
+        with self.get_session() as session:
+            requeued = session.query(ConsolidationJob)\
+                              .filter(ConsolidationJob.status == "running")\
+                              .update({ConsolidationJob.status: "pending"}, synchronize_session=False)
+            session.commit()
+            return requeued
+    
+    def get_pending_consolidation_count(self, include_running: bool = False) -> int:
+        """Número de tarefas de consolidação pendentes (e em execução, se solicitado)"""
+        statuses = ["pending", "running"] if include_running else ["pending"]
+        with self.get_session() as session:
+            return session.query(ConsolidationJob)\
+                          .filter(ConsolidationJob.status.in_(statuses))\
+                          .count()
+    
+    # ========== MÉTODOS PARA RETENÇÃO ==========
+    
+    def get_users_over_message_cap(self, max_messages: int, after_user_id: str = "",
+                                   limit: int = 500) -> List[str]:
+        """Usuários com mais de ``max_messages`` mensagens (pelo contador desnormalizado), paginados por id"""
+        profiles = UserProfile.__table__
+        with self.get_session() as session:
+            return list(session.execute(
+                select(profiles.c.id)
+                .where(profiles.c.id > after_user_id)
+                .where(profiles.c.message_count > max_messages)
+                .order_by(profiles.c.id)
+                .limit(limit)
+            ).scalars())
+    
+    def prune_messages_over_cap(self, user_ids: List[str], keep_last: int,
+                                archive: Callable[[List[Dict[str, Any]]], None] = None) -> Dict[str, int]:
+        """Mantém só as ``keep_last`` mensagens mais recentes de cada usuário, em uma transação.
+        
+        O corte de cada usuário é o id na posição ``keep_last + 1`` (ROW_NUMBER por
+        usuário); tudo até ele é removido com um DELETE por faixa de id. ``archive``
+        recebe as linhas antes da remoção (se falhar, nada é removido).
+        Retorna as mensagens removidas por usuário.
+        """
+        if not user_ids:
+            return {}
+        messages = Message.__table__
+        ranked = select(
+            messages.c.user_id, messages.c.id,
+            func.row_number().over(partition_by=messages.c.user_id, order_by=messages.c.id.desc()).label("position"),
+            func.count().over(partition_by=messages.c.user_id).label("total"),
+        ).where(messages.c.user_id.in_(user_ids)).subquery()
+        with self.get_session() as session:
+            cutoffs = session.execute(
+                select(ranked.c.user_id, ranked.c.id, ranked.c.total).where(ranked.c.position == keep_last + 1)
+            ).all()
+            if not cutoffs:
+                return {}
+            params = [{"b_user_id": user_id, "cutoff": cutoff} for user_id, cutoff, _ in cutoffs]
+            if archive is not None:
+                for start in range(0, len(params), 100):
+                    condition = [(messages.c.user_id == p["b_user_id"]) & (messages.c.id <= p["cutoff"])
+                                 for p in params[start:start + 100]]
+                    archive(self._message_rows(session, or_(*condition)))
+            session.execute(
+                delete(messages).where(messages.c.user_id == bindparam("b_user_id"))
+                                .where(messages.c.id <= bindparam("cutoff")),
+                params
+            )
+            pruned = {user_id: total - keep_last for user_id, _, total in cutoffs}
+            self._refresh_message_counters_bulk(session, list(pruned))
+            session.commit()
+            return pruned
+    
+    def prune_expired_messages(self, before: datetime, after_id: int = 0, limit: int = 5000,
+                               archive: Callable[[List[Dict[str, Any]]], None] = None
+                               ) -> Tuple[Dict[str, int], Optional[int]]:
+        """Remove mensagens anteriores a ``before`` em um lote de até ``limit`` ids após ``after_id``.
+        
+        Percorre a chave primária em ordem (ids crescem com o tempo), então só lê o
+        início da tabela; o DELETE é por faixa de id. Retorna as mensagens removidas
+        por usuário e o ``after_id`` do próximo lote (``None`` quando não há mais
+        mensagens expiradas).
+        """
+        messages = Message.__table__
+        with self.get_session() as session:
+            page = session.execute(
+                select(messages.c.id, messages.c.user_id, messages.c.timestamp)
+                .where(messages.c.id > after_id)
+                .order_by(messages.c.id)
+                .limit(limit)
+            ).all()
+            expired = [row for row in page if row.timestamp is not None and row.timestamp < before]
+            if not expired:
+                return {}, None
+            
+            condition = (messages.c.id > after_id) & (messages.c.id <= expired[-1].id) & (messages.c.timestamp < before)
+            if archive is not None:
+                archive(self._message_rows(session, condition))
+            session.execute(delete(messages).where(condition))
+            pruned: Dict[str, int] = {}
+            for row in expired:
+                pruned[row.user_id] = pruned.get(row.user_id, 0) + 1
+            self._refresh_message_counters_bulk(session, list(pruned))
+            session.commit()
+            return pruned, page[-1].id if len(page) == limit else None
+    
+    def _message_rows(self, session, condition) -> List[Dict[str, Any]]:
+        messages = Message.__table__
+        rows = session.execute(select(messages).where(condition).order_by(messages.c.id)).all()
+        return self._decompressed_rows(rows)
+    
+    # ========== ITERADORES PAGINADOS (EXPORTAÇÃO) ==========
+    
+    def iter_messages(self, user_id: str = None, after_id: int = 0, limit: Optional[int] = None,
+                      page_size: int = 1000) -> Iterator[MessageRecord]:
+        """Histórico completo de mensagens (de todos os usuários ou de um) em ordem de id.
+        
+        Mesmo contrato de ``iter_knowledge``: páginas por chave, memória
+        constante e ``after_id``/``limit`` para paginação por cursor.
+        """
+        messages = Message.__table__
+        conditions = [messages.c.user_id == user_id] if user_id is not None else []
+        yield from self._iter_by_id(messages, _MESSAGE_COLUMNS, conditions, after_id, limit, page_size,
+                                    lambda row: self._message_records([row])[0])
+    
+    def _iter_by_id(self, table, columns, conditions, after_id: int, limit: Optional[int], page_size: int,
+                    make: Callable) -> Iterator[Any]:
+        """Paginação por chave: ``WHERE id > :after ORDER BY id LIMIT :page``, uma sessão curta por página"""
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = page_size if remaining is None else min(page_size, remaining)
+            statement = select(*columns).where(*conditions, table.c.id > after_id).order_by(table.c.id).limit(size)
+            fetched = 0
+            with self.get_session() as session:
+                result = session.connection().execution_options(stream_results=True, yield_per=size)\
+                                .execute(statement)
+                for row in result:
+                    fetched += 1
+                    after_id = row.id
+                    yield make(row)
+            if fetched < size:
+                return
+            if remaining is not None:
+                remaining -= fetched
+    
+    # ========== MÉTODOS PARA MEMÓRIA SEMÂNTICA ==========
+    
+    def add_memory_embeddings(self, items: List[Dict[str, Any]]) -> List[int]:
+        """Grava vetores em lote e retorna os ids gerados, na ordem dos itens.
+
+        Cada item tem user_id, source, source_id, content e vector (bytes).
+        """
+        if not items:
+            return []
+        table = MemoryEmbedding.__table__
+        now = datetime.now()
+        rows = [{"user_id": item.get("user_id"), "source": item["source"], "source_id": item.get("source_id"),
+                 "content": item["content"], "vector": item["vector"], "created_at": now} for item in items]
+        with self.get_session() as session:
+            ids = session.execute(
+                insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+            ).scalars().all()
+            session.commit()
+        return list(ids)
+    
+    def get_memory_embeddings(self, user_id: Optional[str]) -> List[Dict[str, Any]]:
+        """Vetores do usuário, ou do conhecimento global com ``user_id=None``, em ordem de inserção"""
+        table = MemoryEmbedding.__table__
+        condition = table.c.user_id.is_(None) if user_id is None else table.c.user_id == user_id
+        with self.get_session() as session:
+            rows = session.execute(
+                select(table.c.id, table.c.source, table.c.source_id, table.c.content,
+                       table.c.vector, table.c.created_at)
+                .where(condition)
+                .order_by(table.c.id)
+            ).all()
+            return [dict(row._mapping) for row in rows]
+    
+    def get_memory_embeddings_page(self, after_id: int = 0, limit: int = 10000) -> List[Dict[str, Any]]:
+        """Vetores de todos os usuários com id maior que ``after_id`` (paginação por chave)"""
+        table = MemoryEmbedding.__table__
+        with self.get_session() as session:
+            rows = session.execute(
+                select(table.c.id, table.c.user_id, table.c.vector)
+                .where(table.c.id > after_id)
+                .order_by(table.c.id)
+                .limit(limit)
+            ).all()
+            return [dict(row._mapping) for row in rows]
+    
+    def get_memory_embeddings_by_ids(self, ids: List[int]) -> List[Dict[str, Any]]:
+        """Conteúdo (sem o vetor) das lembranças com os ids informados"""
+        if not ids:
+            return []
+        table = MemoryEmbedding.__table__
+        with self.get_session() as session:
+            rows = session.execute(
+                select(table.c.id, table.c.user_id, table.c.source, table.c.source_id,
+                       table.c.content, table.c.created_at)
+                .where(table.c.id.in_(ids))
+            ).all()
+            return [dict(row._mapping) for row in rows]
+    
+    def delete_memory_embeddings(self, source: str, source_ids: List[int]) -> List[int]:
+        """Remove os vetores de origem ``source`` com os ids informados; retorna os ids dos vetores"""
+        if not source_ids:
+            return []
+        table = MemoryEmbedding.__table__
+        deleted = []
+        with self.get_session() as session:
+            # Em lotes, para não passar do limite de parâmetros por instrução do SQLite
+            for start in range(0, len(source_ids), 500):
+                deleted.extend(session.execute(
+                    delete(table).where(table.c.source == source)
+                                 .where(table.c.source_id.in_(source_ids[start:start + 500]))
+                                 .returning(table.c.id)
+                ).scalars())
+            session.commit()
+        return deleted
+    
+    def get_knowledge_to_embed(self) -> List[Dict[str, Any]]:
+        """Conhecimentos sem vetor ou alterados depois de vetorizados"""
+        embeddings = MemoryEmbedding.__table__
+        knowledge = KnowledgeBase.__table__
+        joined = knowledge.outerjoin(embeddings, (embeddings.c.source == "knowledge") &
+                                     (embeddings.c.source_id == knowledge.c.id))
+        with self.get_session() as session:
+            rows = session.execute(
+                select(knowledge.c.id, knowledge.c.key, knowledge.c.value, knowledge.c.category)
+                .select_from(joined)
+                .where(embeddings.c.id.is_(None) | (knowledge.c.updated_at > embeddings.c.created_at))
+            ).all()
+            return [dict(row._mapping) for row in rows]
+    
+    def get_knowledge_by_keys(self, keys: List[str]) -> List[Dict[str, Any]]:
+        """Id, chave e valor dos conhecimentos dessas chaves (lidos do primário)"""
+        knowledge = KnowledgeBase.__table__
+        rows = []
+        with self.get_session() as session:
+            for start in range(0, len(keys), 500):
+                rows.extend(session.execute(
+                    select(knowledge.c.id, knowledge.c.key, knowledge.c.value)
+                    .where(knowledge.c.key.in_(keys[start:start + 500]))
+                ).all())
+        return [dict(row._mapping) for row in rows]
+    
+    def delete_orphan_knowledge_embeddings(self) -> List[int]:
+        """Remove vetores de conhecimentos que não existem mais; retorna os ids dos vetores"""
+        embeddings = MemoryEmbedding.__table__
+        with self.get_session() as session:
+            deleted = session.execute(
+                delete(embeddings)
+                .where(embeddings.c.source == "knowledge")
+                .where(embeddings.c.user_id.is_(None))
+                .where(embeddings.c.source_id.notin_(select(KnowledgeBase.__table__.c.id)))
+                .returning(embeddings.c.id)
+            ).scalars().all()
+            session.commit()
+            return list(deleted)
+    
+    # ========== MÉTODOS PARA CACHE DE RESPOSTAS DO LLM ==========
+    
+    def get_llm_cache_entry(self, key: str, now: datetime = None) -> Optional[str]:
+        """Resposta em cache (JSON) se existir e não tiver expirado; conta o acerto na mesma instrução"""
+        table = LLMCacheEntry.__table__
+        now = now or datetime.now()
+        with self.get_session() as session:
+            response = session.execute(
+                update(table)
+                .where(table.c.key == key, table.c.expires_at > now)
+                .values(hits=func.coalesce(table.c.hits, 0) + 1, last_used_at=now)
+                .returning(table.c.response)
+            ).scalar()
+            session.commit()
+            return response
+    
+    def put_llm_cache_entry(self, key: str, model: str, purpose: str, response: str,
+                            expires_at: datetime, context_key: str = None, vector: bytes = None):
+        """Grava (ou substitui) uma resposta no cache"""
+        table = LLMCacheEntry.__table__
+        now = datetime.now()
+        row = {"key": key, "model": model, "purpose": purpose, "response": response,
+               "context_key": context_key, "vector": vector, "hits": 0, "created_at": now, "last_used_at": now, "expires_at": expires_at}
+        dialect = {"sqlite": sqlite, "postgresql": postgresql}.get(self.engine.dialect.name)
+        with self.get_session() as session:
+            if dialect is not None:
+                statement = dialect.insert(table)
+                session.execute(statement.on_conflict_do_update(
+                    index_elements=[table.c.key],
+                    set_={column: statement.excluded[column]
+                          for column in ("response", "context_key", "vector", "last_used_at", "expires_at")}
+                ), row)
+            else:
+                session.execute(delete(table).where(table.c.key == key))
+                session.execute(insert(table), row)
+            session.commit()
+    
+    def get_llm_cache_vectors(self, context_key: str, now: datetime = None) -> List[Dict[str, Any]]:
+        """Chaves e vetores das entradas válidas com o mesmo contexto, para a camada semântica"""
+        table = LLMCacheEntry.__table__
+        with self.get_session() as session:
+            rows = session.execute(
+                select(table.c.key, table.c.vector)
+                .where(table.c.context_key == context_key, table.c.expires_at > (now or datetime.now()))
+            ).all()
+            return [dict(row._mapping) for row in rows]
+    
+    def evict_llm_cache(self, max_entries: Optional[int] = None, now: datetime = None) -> int:
+        """Remove as entradas expiradas e, acima de ``max_entries``, as usadas há mais tempo"""
+        table = LLMCacheEntry.__table__
+        with self.get_session() as session:
+            removed = session.execute(
+                delete(table).where(table.c.expires_at <= (now or datetime.now()))
+            ).rowcount
+            if max_entries is not None:
+                # Último uso da entrada mais recente que fica de fora do limite
+                boundary = session.execute(
+                    select(table.c.last_used_at)
+                    .order_by(table.c.last_used_at.desc())
+                    .offset(max_entries)
+                    .limit(1)
+                ).scalar()
+                if boundary is not None:
+                    removed += session.execute(
+                        delete(table).where(table.c.last_used_at <= boundary)
+                    ).rowcount
+            session.commit()
+            return removed
+    
+    # ========== MÉTODOS PARA MOVER USUÁRIOS ENTRE BANCOS ==========
+    
+    def get_user_ids(self, after_user_id: str = "", limit: int = 500) -> List[str]:
+        """Ids dos usuários em ordem, paginados pela chave primária"""
+        profiles = UserProfile.__table__
+        with self.get_session() as session:
+            return list(session.execute(
+                select(profiles.c.id).where(profiles.c.id > after_user_id).order_by(profiles.c.id).limit(limit)
+            ).scalars())
+    
+    def export_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Perfil, mensagens, resumos e vetores do usuário (linhas completas), ou None se não existir"""
+        profiles, messages = UserProfile.__table__, Message.__table__
+        summaries, embeddings = ConversationSummary.__table__, MemoryEmbedding.__table__
+        with self.get_session() as session:
+            profile = session.execute(select(profiles).where(profiles.c.id == user_id)).first()
+            if profile is None:
+                return None
+            
+            def rows(table):
+                return session.execute(select(table).where(table.c.user_id == user_id).order_by(table.c.id)).all()
+            
+            # Mensagens e resumos saem descomprimidos: o banco de destino pode não ter o dicionário
+            return {"profile": dict(profile._mapping), "messages": self._decompressed_rows(rows(messages)),
+                    "summaries": self._decompressed_rows(rows(summaries), "summary"),
+                    "embeddings": [dict(row._mapping) for row in rows(embeddings)]}
+    
+    def import_user(self, data: Dict[str, Any]) -> int:
+        """Grava um usuário exportado por ``export_user``, substituindo o que houver dele neste banco.
+        
+        Mensagens, resumos e vetores recebem ids novos; a marca d'água, as faixas
+        e a hierarquia dos resumos e o ``source_id`` dos vetores são remapeados.
+        Retorna quantas mensagens foram gravadas.
+        """
+        profiles, summaries = UserProfile.__table__, ConversationSummary.__table__
+        profile = dict(data["profile"])
+        user_id = profile["id"]
+        with self.get_session() as session:
+            self._delete_user_rows(session, user_id)
+            watermark = profile.get("summary_watermark") or 0
+            session.execute(insert(profiles), dict(profile, summary_watermark=0))
             
+            old_message_ids = [row["id"] for row in data["messages"]]
+            new_message_ids = _insert_returning_ids(session, Message.__table__, data["messages"])
+            message_id = _floor_remap(old_message_ids, new_message_ids)
+            session.execute(update(profiles).where(profiles.c.id == user_id)
+                            .values(summary_watermark=message_id(watermark)))
+            
+            new_summary_ids = _insert_returning_ids(session, summaries, [
+                dict(row, parent_id=None, start_message_id=message_id(row.get("start_message_id")),
+                     end_message_id=message_id(row.get("end_message_id")))
+                for row in data["summaries"]
+            ])
+            summary_ids = dict(zip((row["id"] for row in data["summaries"]), new_summary_ids))
+            parents = [{"b_id": summary_ids[row["id"]], "b_parent_id": summary_ids.get(row["parent_id"])}
+                       for row in data["summaries"] if row.get("parent_id") is not None]
+            if parents:
+                session.execute(update(summaries).where(summaries.c.id == bindparam("b_id"))
+                                .values(parent_id=bindparam("b_parent_id")), parents)
+            
+            # Vetores de mensagens já removidas ficam sem source_id (o mapeamento é exato)
+            source_ids = {"message": dict(zip(old_message_ids, new_message_ids)).get, "summary": summary_ids.get}
+            _insert_returning_ids(session, MemoryEmbedding.__table__, [
+                dict(row, source_id=source_ids[row["source"]](row["source_id"])
+                     if row["source"] in source_ids and row.get("source_id") is not None else row.get("source_id"))
+                for row in data.get("embeddings", [])
+            ])
+            session.commit()
+            return len(new_message_ids)
+    
+    @writes()
+    def delete_user(self, user_id: str) -> int:
+        """Remove perfil, mensagens, resumos e vetores do usuário; retorna as mensagens removidas"""
+        with self.get_session() as session:
+            deleted = self._delete_user_rows(session, user_id)
             session.commit()
-        return added_count
+            return deleted
+    
+    @staticmethod
+    def _delete_user_rows(session, user_id: str) -> int:
+        for table in (MemoryEmbedding.__table__, ConversationSummary.__table__):
+            session.execute(delete(table).where(table.c.user_id == user_id))
+        messages = Message.__table__
+        deleted = session.execute(delete(messages).where(messages.c.user_id == user_id)).rowcount
+        session.execute(delete(UserProfile.__table__).where(UserProfile.__table__.c.id == user_id))
+        return deleted
+    
+    # ========== COMPRESSÃO DE MENSAGENS ANTIGAS ==========
+    
+    def _message_records(self, rows) -> List[MessageRecord]:
+        rows = list(rows)
+        if needs_dictionaries(rows):
+            self._load_compression_dictionaries()
+        return [MessageRecord(*row) for row in rows]
+    
+    def _decompressed_rows(self, rows, column: str = "content") -> List[Dict[str, Any]]:
+        """Linhas completas como dicts, com o texto descomprimido em ``column`` (``content`` ou ``summary``)"""
+        compressed = f"{column}_compressed"
+        if needs_dictionaries(rows, compressed):
+            self._load_compression_dictionaries()
+        decoded = []
+        for row in rows:
+            data = dict(row._mapping)
+            blob = data.pop(compressed)
+            if blob is not None:
+                data[column] = codec.decode(blob)
+            decoded.append(data)
+        return decoded
+    
+    def _load_compression_dictionaries(self):
+        """Registra no ``codec`` os dicionários gravados (inclusive por outro processo) no primário"""
+        with self.engine.connect() as connection:
+            register_dictionaries(connection.execute(COMPRESSION_DICTIONARIES))
+    
+    def get_compression_dictionary(self, algorithm: str) -> Optional[bytes]:
+        """Dicionário mais recente do algoritmo, ou None"""
+        dictionaries = CompressionDictionary.__table__
+        with self.get_session() as session:
+            return session.execute(
+                select(dictionaries.c.data)
+                .where(dictionaries.c.algorithm == algorithm)
+                .order_by(dictionaries.c.created_at.desc())
+                .limit(1)
+            ).scalar()
+    
+    def add_compression_dictionary(self, algorithm: str, data: bytes) -> str:
+        """Grava (se ainda não existir) e registra um dicionário; retorna o id dele"""
+        key = codec.register_dictionary(data).hex()
+        with self.get_session() as session:
+            if session.get(CompressionDictionary, key) is None:
+                session.add(CompressionDictionary(id=key, algorithm=algorithm, data=data))
+                session.commit()
+        return key
+    
+    def sample_message_contents(self, limit: int = 2000) -> List[str]:
+        """Texto das mensagens não comprimidas mais recentes (amostra para treinar dicionários)"""
+        messages = Message.__table__
+        with self.get_session() as session:
+            return list(session.execute(
+                select(messages.c.content)
+                .where(messages.c.content_compressed.is_(None))
+                .order_by(messages.c.id.desc())
+                .limit(limit)
+            ).scalars())
+    
+    def compress_messages(self, message_codec: codec.Codec, before: datetime, after_id: int = 0,
+                          limit: int = 1000) -> Tuple[Dict[str, int], Optional[int]]:
+        """Comprime o texto das mensagens anteriores a ``before`` em um lote de até ``limit`` ids após ``after_id``.
+        
+        Mesmo percurso de ``prune_expired_messages``: ids em ordem, parando na
+        primeira página sem mensagens antigas. Mensagens que não diminuem ficam
+        como estão. Retorna as contagens do lote (``rows``, ``compressed``,
+        ``bytes_before``, ``bytes_after``) e o ``after_id`` do próximo lote
+        (``None`` quando não há mais mensagens antigas).
+        """
+        messages = Message.__table__
+        stats = dict.fromkeys(("rows", "compressed", "bytes_before", "bytes_after"), 0)
+        with self.get_session() as session:
+            page = session.execute(
+                select(messages.c.id, messages.c.content, messages.c.timestamp)
+                .where(messages.c.id > after_id, messages.c.content_compressed.is_(None))
+                .order_by(messages.c.id)
+                .limit(limit)
+            ).all()
+            old = [row for row in page if row.timestamp is not None and row.timestamp < before]
+            if not old:
+                return stats, None
+            
+            updates = []
+            for row in old:
+                stats["rows"] += 1
+                blob = message_codec.encode(row.content) if row.content else None
+                if blob is None:
+                    continue
+                updates.append({"b_id": row.id, "b_blob": blob})
+                stats["bytes_before"] += len(row.content.encode("utf-8"))
+                stats["bytes_after"] += len(blob)
+            if updates:
+                session.execute(update(messages).where(messages.c.id == bindparam("b_id"))
+                                .values(content="", content_compressed=bindparam("b_blob")), updates)
+                session.commit()
+            stats["compressed"] = len(updates)
+            return stats, page[-1].id if len(page) == limit else None
+    
+    def compress_summaries(self, summary_codec: codec.Codec, before: datetime, after_id: int = 0,
+                           limit: int = 1000) -> Tuple[Dict[str, int], Optional[int]]:
+        """Comprime os resumos já absorvidos por um resumo de nível superior, criados antes de ``before``.
+        
+        Resumos ativos (``parent_id`` nulo) ficam em texto: são lidos a cada
+        turno. Os absorvidos só saem em ``export_user``. Percorre ``limit`` ids
+        após ``after_id``; retorna as contagens do lote (como ``compress_messages``)
+        e o ``after_id`` do próximo lote (``None`` no fim da tabela).
+        """
+        summaries = ConversationSummary.__table__
+        stats = dict.fromkeys(("rows", "compressed", "bytes_before", "bytes_after"), 0)
+        with self.get_session() as session:
+            page = session.execute(
+                select(summaries.c.id, summaries.c.summary, summaries.c.parent_id, summaries.c.created_at)
+                .where(summaries.c.id > after_id, summaries.c.summary_compressed.is_(None))
+                .order_by(summaries.c.id)
+                .limit(limit)
+            ).all()
+            
+            updates = []
+            for row in page:
+                if row.parent_id is None or row.created_at is None or row.created_at >= before:
+                    continue
+                stats["rows"] += 1
+                blob = summary_codec.encode(row.summary) if row.summary else None
+                if blob is None:
+                    continue
+                updates.append({"b_id": row.id, "b_blob": blob})
+                stats["bytes_before"] += len(row.summary.encode("utf-8"))
+                stats["bytes_after"] += len(blob)
+            if updates:
+                session.execute(update(summaries).where(summaries.c.id == bindparam("b_id"))
+                                .values(summary="", summary_compressed=bindparam("b_blob")), updates)
+                session.commit()
+            stats["compressed"] = len(updates)
+            return stats, page[-1].id if len(page) == limit else None
+    
+    def get_storage_stats(self) -> Dict[str, int]:
+        """Mensagens e bytes de texto guardados sem e com compressão (percorre a tabela)"""
+        messages = Message.__table__
+        if self.engine.dialect.name == "postgresql":
+            text_bytes = func.octet_length(messages.c.content)
+        else:
+            text_bytes = func.length(cast(messages.c.content, LargeBinary))
+        with self.get_session() as session:
+            row = session.execute(select(
+                func.count(),
+                func.count(messages.c.content_compressed),
+                func.coalesce(func.sum(text_bytes), 0),
+                func.coalesce(func.sum(func.length(messages.c.content_compressed)), 0),
+            ).select_from(messages)).one()
+            return {"messages": row[0], "compressed": row[1], "text_bytes": row[2], "compressed_bytes": row[3]}
+    
+    def sample_compressed_messages(self, limit: int = 1000) -> List[bytes]:
+        """Valores comprimidos das mensagens mais antigas (para estimar taxa e custo de leitura)"""
+        messages = Message.__table__
+        with self.get_session() as session:
+            blobs = list(session.execute(
+                select(messages.c.content_compressed)
+                .where(messages.c.content_compressed.is_not(None))
+                .order_by(messages.c.id)
+                .limit(limit)
+            ).scalars())
+        if any(not codec.has_dictionary(blob) for blob in blobs):
+            self._load_compression_dictionaries()
+        return blobs
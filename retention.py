@@ -0,0 +1,195 @@
+"""Job de retenção de mensagens: limite por usuário e expiração por idade.
+
+Substitui a limpeza feita usuário a usuário dentro de ``add_message``. Percorre
+todos os usuários fora do caminho das requisições, em lotes, com DELETEs por
+faixa de id:
+
+- limite: usuários com mais de ``max_messages_per_user`` mensagens (pelo
+  contador desnormalizado) ficam com as ``keep_last`` mais recentes;
+- expiração: mensagens mais antigas que ``max_age_days`` são removidas.
+
+Antes de apagar, as mensagens podem ser arquivadas em JSONL comprimido (gzip).
+Roda como tarefa agendada (``start``/``stop``) ou pela linha de comando, com
+limite opcional de linhas removidas por segundo.
+
+Uso: python retention.py [--database-url sqlite:///memory.db] [--max-messages 100] [--max-age-days 90]
+                         [--archive-dir arquivo/] [--rows-per-second 5000] [--interval 3600]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from db import DatabaseConfig
+import instrumentation
+from repository import MemoryRepository
+
+
+class GzipJsonlArchive:
+    """Arquivo frio: uma mensagem por linha em ``<prefixo>-<data>.jsonl.gz``.
+
+    O arquivo só é criado na primeira escrita; cada lote é descarregado antes
+    de o DELETE correspondente ser confirmado.
+    """
+
+    def __init__(self, directory: str, prefix: str = "messages"):
+        self.directory = directory
+        self.prefix = prefix
+        self.path: Optional[str] = None
+        self.rows = 0
+        self._file = None
+
+    def write(self, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.path = os.path.join(self.directory, f"{self.prefix}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}.jsonl.gz")
+            self._file = gzip.open(self.path, "at", encoding="utf-8")
+        for row in rows:
+            self._file.write(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n")
+        self._file.flush()
+        self.rows += len(rows)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(value).__name__}")
+
+
+class RetentionJob:
+    """Aplica as políticas de retenção a todos os usuários"""
+
+    def __init__(self, repository: MemoryRepository, max_messages_per_user: Optional[int] = 100,
+                 keep_last: int = None, max_age_days: Optional[float] = None, archive_dir: str = None,
+                 batch_size: int = 5000, users_per_batch: int = 200, max_rows_per_second: float = None):
+        self.repository = repository
+        self.max_messages_per_user = max_messages_per_user
+        # Como a limpeza antiga: ao passar do limite, volta para a metade (evita podar a cada mensagem)
+        self.keep_last = keep_last if keep_last is not None else (max_messages_per_user or 0) // 2
+        self.max_age_days = max_age_days
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.users_per_batch = users_per_batch
+        self.max_rows_per_second = max_rows_per_second
+        self._task: Optional[asyncio.Task] = None
+
+    def run_once(self) -> Dict[str, Any]:
+        """Executa uma passada completa; retorna as estatísticas"""
+        stats = {"capped_users": 0, "capped_messages": 0, "expired_messages": 0, "batches": 0, "archive": None}
+        archive = GzipJsonlArchive(self.archive_dir) if self.archive_dir else None
+        archive_rows = archive.write if archive is not None else None
+        started = time.monotonic()
+        removed = 0
+
+        try:
+            if self.max_messages_per_user is not None:
+                after_user_id = ""
+                while True:
+                    user_ids = self.repository.get_users_over_message_cap(
+                        self.max_messages_per_user, after_user_id, self.users_per_batch)
+                    if not user_ids:
+                        break
+                    pruned = self.repository.prune_messages_over_cap(user_ids, self.keep_last, archive_rows)
+                    stats["capped_users"] += len(pruned)
+                    stats["capped_messages"] += sum(pruned.values())
+                    stats["batches"] += 1
+                    removed += sum(pruned.values())
+                    self._throttle(removed, started)
+                    after_user_id = user_ids[-1]
+
+            if self.max_age_days is not None:
+                before = datetime.now() - timedelta(days=self.max_age_days)
+                after_id = 0
+                while after_id is not None:
+                    pruned, after_id = self.repository.prune_expired_messages(
+                        before, after_id, self.batch_size, archive_rows)
+                    stats["expired_messages"] += sum(pruned.values())
+                    stats["batches"] += 1
+                    removed += sum(pruned.values())
+                    self._throttle(removed, started)
+        finally:
+            if archive is not None:
+                archive.close()
+                stats["archive"] = archive.path
+
+        stats["seconds"] = round(time.monotonic() - started, 3)
+        instrumentation.inc("memory_messages_cleaned_total", stats["capped_messages"], source="retention_cap")
+        instrumentation.inc("memory_messages_cleaned_total", stats["expired_messages"], source="retention_ttl")
+        if removed:
+            print(f"🗑️ Retention removed {stats['capped_messages']} messages over the cap "
+                  f"({stats['capped_users']} users) and {stats['expired_messages']} expired messages")
+        return stats
+
+    def _throttle(self, removed: int, started: float):
+        """Dorme o necessário para não passar de ``max_rows_per_second``"""
+        if not self.max_rows_per_second:
+            return
+        wait = removed / self.max_rows_per_second - (time.monotonic() - started)
+        if wait > 0:
+            time.sleep(wait)
+
+    # ========== EXECUÇÃO AGENDADA ==========
+
+    async def start(self, interval: float = 3600.0):
+        """Executa ``run_once`` a cada ``interval`` segundos em segundo plano"""
+        self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, interval: float):
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                print(f" Retention job failed: {e}")
+            await asyncio.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite:///memory.db", help="URL do banco")
+    parser.add_argument("--max-messages", type=int, default=100, help="Mensagens por usuário (0 desativa)")
+    parser.add_argument("--keep-last", type=int, help="Mensagens mantidas ao podar (padrão: metade do limite)")
+    parser.add_argument("--max-age-days", type=float, help="Remove mensagens mais antigas que isso")
+    parser.add_argument("--archive-dir", help="Arquiva as mensagens removidas neste diretório (JSONL gzip)")
+    parser.add_argument("--rows-per-second", type=float, help="Limite de mensagens removidas por segundo")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Ids por lote na expiração")
+    parser.add_argument("--interval", type=float, help="Repete a cada N segundos (padrão: uma vez)")
+    args = parser.parse_args()
+
+    repository = MemoryRepository(DatabaseConfig(args.database_url))
+    job = RetentionJob(repository, max_messages_per_user=args.max_messages or None, keep_last=args.keep_last,
+                       max_age_days=args.max_age_days, archive_dir=args.archive_dir, batch_size=args.batch_size,
+                       max_rows_per_second=args.rows_per_second)
+    try:
+        while True:
+            stats = job.run_once()
+            print(f"Acima do limite: {stats['capped_messages']} mensagens de {stats['capped_users']} usuários | "
+                  f"expiradas: {stats['expired_messages']} | lotes: {stats['batches']} | {stats['seconds']}s"
+                  + (f" | arquivo: {stats['archive']}" if stats["archive"] else ""))
+            if args.interval is None:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        repository.dispose()
+
+
+if __name__ == "__main__":
+    main()
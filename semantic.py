@@ -0,0 +1,529 @@
+"""Memória semântica: recuperação por similaridade de vetores (NumPy).
+
+Mensagens, resumos e itens da base de conhecimento são convertidos em vetores
+float32 normalizados por um ``embedder`` plugável e gravados na tabela
+``memory_embeddings``. As buscas carregam os vetores do usuário para uma
+matriz em memória (LRU por usuário) e calculam a similaridade de cosseno de
+todos de uma vez com um produto matricial.
+
+O embedder padrão (``HashingEmbedder``) é determinístico e não depende de
+modelos externos; qualquer objeto com ``dim`` e ``embed(textos) -> ndarray``
+pode substituí-lo (ex.: um modelo local de sentence embeddings).
+
+Com ``index_path`` as buscas passam por um índice aproximado (``ann.IVFIndex``)
+sobre os vetores de todos os usuários, mantido em disco e carregado com mmap;
+é o modo indicado para milhões de lembranças.
+"""
+import asyncio
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from ann import IVFIndex
+from repository import KNOWLEDGE_CHUNK_SIZE
+
+MESSAGE = "message"
+SUMMARY = "summary"
+KNOWLEDGE = "knowledge"
+
+MIN_TOKEN_LENGTH = 3  # descarta artigos, preposições e afins
+
+SOURCE_LABELS = {MESSAGE: "Mensagem anterior", SUMMARY: "Resumo anterior", KNOWLEDGE: "Conhecimento"}
+
+
+@lru_cache(maxsize=65536)
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [token for token in re.findall(r"\w+", text) if len(token) >= MIN_TOKEN_LENGTH]
+
+
+def format_memory(memory: Dict[str, Any]) -> str:
+    """Linha de contexto para uma lembrança retornada por ``SemanticMemory.search``"""
+    return f"- {SOURCE_LABELS.get(memory['source'], memory['source'])}: {memory['content']}"
+
+
+class HashingEmbedder:
+    """Embedder determinístico por hashing de palavras e bigramas (feature hashing).
+
+    Não captura sinônimos, mas aproxima textos que compartilham vocabulário;
+    serve para testes e como base sem dependências.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _tokenize(text)
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = _feature_hash(feature)
+                vectors[row, h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        return normalize(vectors)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Normaliza as linhas para norma 1 (linhas nulas continuam nulas)"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+class VectorSet:
+    """Matriz de vetores normalizados com busca top-k exata.
+
+    Cresce por duplicação de capacidade, então inserções são O(1) amortizado.
+    """
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.dim = dim
+        self._vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.items: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:len(self.items)]
+
+    def append(self, vectors: np.ndarray, items: List[Dict[str, Any]]):
+        size = len(self.items)
+        needed = size + len(items)
+        if needed > len(self._vectors):
+            grown = np.empty((max(needed, len(self._vectors) * 2), self.dim), dtype=np.float32)
+            grown[:size] = self._vectors[:size]
+            self._vectors = grown
+        self._vectors[size:needed] = vectors
+        self.items.extend(items)
+
+    def remove(self, source: str, source_ids: Iterable[int]):
+        ids = set(source_ids)
+        keep = [i for i, item in enumerate(self.items)
+                if not (item["source"] == source and item.get("source_id") in ids)]
+        if len(keep) == len(self.items):
+            return
+        self._vectors = self._vectors[keep] if keep else np.empty((64, self.dim), dtype=np.float32)
+        self.items = [self.items[i] for i in keep]
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[float, Dict[str, Any]]]:
+        """Os ``k`` itens de maior similaridade de cosseno com ``query`` (normalizado)"""
+        size = len(self.items)
+        if size == 0 or k <= 0:
+            return []
+        scores = self.vectors @ query
+        k = min(k, size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.items[i]) for i in top]
+
+
+class SemanticMemory:
+    """Armazena e recupera lembranças por similaridade semântica.
+
+    Os vetores ficam no banco (``memory_embeddings``); as matrizes dos usuários
+    consultados ficam em memória com limite LRU, como a memória de curto prazo.
+    Com ``index_path``, usa um índice IVF persistido nesse diretório (construído
+    a partir do banco na primeira vez e salvo em ``close()``).
+
+    Escritas na base de conhecimento feitas pelo agente (``SemanticRepository``)
+    atualizam os vetores na hora; as feitas por fora são percebidas pela
+    sincronização, refeita no máximo a cada ``knowledge_sync_interval`` segundos.
+    """
+
+    def __init__(self, repository, embedder=None, max_resident_users: int = 1000,
+                 index_path: str = None, nprobe: int = 8, knowledge_sync_interval: float = 60.0):
+        self.repository = repository
+        self.embedder = embedder or HashingEmbedder()
+        self.max_resident_users = max_resident_users
+        self._users: "OrderedDict[str, VectorSet]" = OrderedDict()
+        self._knowledge: Optional[VectorSet] = None
+        self._lock = threading.RLock()
+
+        self.index_path = index_path
+        self.index: Optional[IVFIndex] = None
+        self.knowledge_sync_interval = knowledge_sync_interval
+        self._knowledge_synced_at: Optional[float] = None  # monotonic da última sincronização
+        if index_path is not None:
+            if os.path.exists(os.path.join(index_path, "meta.json")):
+                self.index = IVFIndex.load(index_path, mmap=True)
+                self.index.nprobe = nprobe
+                self._catch_up_index()
+            else:
+                self.build_index(nprobe=nprobe)
+
+    # ========== ESCRITA ==========
+
+    def remember(self, user_id: str, source: str, content: str, source_id: int = None) -> bool:
+        """Vetoriza e grava uma lembrança do usuário; retorna False se o texto não tiver conteúdo"""
+        return self.remember_many(user_id, [(source, content, source_id)]) > 0
+
+    def remember_many(self, user_id: Optional[str], items: List[Tuple[str, str, Optional[int]]]) -> int:
+        """Vetoriza e grava lembranças ``(source, content, source_id)`` em lote"""
+        if not items:
+            return 0
+        vectors = self.embedder.embed([content for _, content, _ in items])
+        # Textos sem nenhuma palavra útil geram vetor nulo e não ajudam na busca
+        useful = np.flatnonzero(np.any(vectors != 0, axis=1))
+        if len(useful) == 0:
+            return 0
+
+        records = [{"user_id": user_id, "source": items[i][0], "content": items[i][1],
+                    "source_id": items[i][2], "vector": vectors[i].tobytes()} for i in useful]
+        ids = self.repository.add_memory_embeddings(records)
+
+        if self.index is not None:
+            self.index.add(ids, vectors[useful], user_id)
+            return len(records)
+        with self._lock:
+            target = self._knowledge if user_id is None else self._users.get(user_id)
+            if target is not None:
+                target.append(vectors[useful], [self._item(record) for record in records])
+        return len(records)
+
+    def forget(self, source: str, source_ids: List[int]) -> int:
+        """Remove lembranças de uma origem (ex.: conhecimento apagado)"""
+        deleted = self.repository.delete_memory_embeddings(source, source_ids)
+        if self.index is not None:
+            self.index.remove(deleted)
+            return len(deleted)
+        with self._lock:
+            for vector_set in list(self._users.values()) + [self._knowledge]:
+                if vector_set is not None:
+                    vector_set.remove(source, source_ids)
+        return len(deleted)
+
+    def remember_knowledge(self, keys: Iterable[str], chunk_size: int = 500) -> int:
+        """Vetoriza (de novo) os conhecimentos dessas chaves logo depois de gravados"""
+        keys = list(dict.fromkeys(keys))
+        added = 0
+        for start in range(0, len(keys), chunk_size):
+            rows = self.repository.get_knowledge_by_keys(keys[start:start + chunk_size])
+            if not rows:
+                continue
+            self.forget(KNOWLEDGE, [row["id"] for row in rows])  # vetores da versão anterior
+            added += self.remember_many(None, [
+                (KNOWLEDGE, f"{row['key']}: {row['value']}", row["id"]) for row in rows
+            ])
+        return added
+
+    def forget_knowledge(self, ids: List[int]) -> int:
+        """Remove os vetores de conhecimentos apagados (ids da tabela knowledge_base)"""
+        return self.forget(KNOWLEDGE, ids) if ids else 0
+
+    def forget_user(self, user_id: str, ids: List[int]):
+        """Descarta da memória e do índice os vetores de um usuário removido do banco"""
+        if self.index is not None:
+            self.index.remove(ids)
+        self.evict(user_id)
+
+    def knowledge_ids(self, keys: List[str] = None, category: str = None) -> List[int]:
+        """Ids dos conhecimentos dessas chaves (ou dessa categoria), antes de apagá-los"""
+        if category is not None:
+            return [row["id"] for row in self.repository.iter_knowledge(category)]
+        return [row["id"] for row in self.repository.get_knowledge_by_keys(list(keys))]
+
+    def sync_knowledge(self) -> int:
+        """Vetoriza conhecimentos novos ou alterados e descarta os apagados.
+
+        Pega as escritas que não passaram por ``SemanticRepository`` (outros
+        processos, o repositório usado diretamente); as buscas chamam
+        periodicamente (``knowledge_sync_interval``).
+        """
+        changed = self.repository.get_knowledge_to_embed()
+        removed = self.repository.delete_memory_embeddings(KNOWLEDGE, [row["id"] for row in changed]) if changed else []
+        removed += self.repository.delete_orphan_knowledge_embeddings()
+        if self.index is not None:
+            self.index.remove(removed)
+        added = self.remember_many(None, [
+            (KNOWLEDGE, f"{row['key']}: {row['value']}", row["id"]) for row in changed
+        ]) if changed else 0
+        self._knowledge_synced_at = time.monotonic()
+        if changed or removed:
+            with self._lock:
+                self._knowledge = None  # recarrega na próxima busca
+        return added
+
+    # ========== ÍNDICE APROXIMADO ==========
+
+    def build_index(self, nlist: int = None, nprobe: int = 8, page_size: int = 50000) -> IVFIndex:
+        """(Re)constrói o índice IVF com todos os vetores do banco.
+
+        Por padrão usa ~sqrt(n) listas; o índice passa a atender as buscas.
+        """
+        expected_bytes = self.embedder.dim * 4
+        ids, user_ids, chunks = [], [], []
+        after_id = 0
+        while True:
+            rows = self.repository.get_memory_embeddings_page(after_id=after_id, limit=page_size)
+            if not rows:
+                break
+            after_id = rows[-1]["id"]
+            rows = [row for row in rows if len(row["vector"]) == expected_bytes]
+            ids.extend(row["id"] for row in rows)
+            user_ids.extend(row["user_id"] for row in rows)
+            chunks.append(b"".join(row["vector"] for row in rows))
+
+        vectors = np.frombuffer(b"".join(chunks), dtype=np.float32).reshape(len(ids), self.embedder.dim)
+        index = IVFIndex(self.embedder.dim, nlist=nlist or max(1, int(math.sqrt(len(ids)))), nprobe=nprobe)
+        if ids:
+            index.build(ids, vectors, user_ids)
+        with self._lock:
+            self.index = index
+            self._users.clear()
+            self._knowledge = None
+        return index
+
+    def _catch_up_index(self, page_size: int = 50000) -> int:
+        """Acrescenta ao índice carregado do disco os vetores gravados depois de salvo.
+
+        O índice guarda o maior id de ``memory_embeddings`` que contém
+        (``max_id``); um processo que caiu antes de ``close()`` deixa vetores
+        mais novos só no banco. Vetores apagados nesse meio tempo continuam no
+        índice, mas somem das buscas porque o conteúdo vem do banco.
+        """
+        expected_bytes = self.embedder.dim * 4
+        after_id, added = self.index.max_id, 0
+        while True:
+            rows = self.repository.get_memory_embeddings_page(after_id=after_id, limit=page_size)
+            if not rows:
+                break
+            after_id = rows[-1]["id"]
+            by_user: Dict[Optional[str], List[Dict[str, Any]]] = {}
+            for row in rows:
+                if len(row["vector"]) == expected_bytes:
+                    by_user.setdefault(row["user_id"], []).append(row)
+            for user_id, user_rows in by_user.items():
+                vectors = np.frombuffer(b"".join(row["vector"] for row in user_rows), dtype=np.float32)
+                self.index.add([row["id"] for row in user_rows], vectors, user_id)
+                added += len(user_rows)
+        if added:
+            print(f" Semantic index caught up with {added} vectors written after the last save")
+        return added
+
+    def close(self):
+        """Salva o índice aproximado em disco (se houver)"""
+        if self.index is not None and self.index_path is not None:
+            self.index.save(self.index_path)
+
+    # ========== BUSCA ==========
+
+    def search(self, user_id: str, query: str, k: int = 5, include_knowledge: bool = True,
+               min_score: float = 0.1) -> List[Dict[str, Any]]:
+        """As ``k`` lembranças do usuário (e conhecimentos) mais similares à consulta"""
+        query_vector = self.embedder.embed([query])[0]
+        if not np.any(query_vector):
+            return []
+
+        if self.index is not None:
+            return self._search_index(user_id, query_vector, k, include_knowledge, min_score)
+
+        candidates = self._user_vectors(user_id).search(query_vector, k)
+        if include_knowledge:
+            candidates += self._knowledge_vectors().search(query_vector, k)
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        return [dict(item, score=score) for score, item in candidates[:k] if score >= min_score]
+
+    def _search_index(self, user_id: str, query_vector: np.ndarray, k: int, include_knowledge: bool,
+                      min_score: float) -> List[Dict[str, Any]]:
+        """Busca pelo índice IVF; o conteúdo das lembranças encontradas vem do banco"""
+        hits = self.index.search(query_vector, k, user_id=user_id)
+        if include_knowledge:
+            self._sync_knowledge_if_due()
+            hits += self.index.search(query_vector, k, user_id=None)
+        hits = [hit for hit in sorted(hits, reverse=True)[:k] if hit[0] >= min_score]
+        rows = {row["id"]: row for row in self.repository.get_memory_embeddings_by_ids([i for _, i in hits])}
+        return [dict(self._item(rows[i]), score=score) for score, i in hits if i in rows]
+
+    def evict(self, user_id: str):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def _user_vectors(self, user_id: str) -> VectorSet:
+        with self._lock:
+            vector_set = self._users.get(user_id)
+            if vector_set is not None:
+                self._users.move_to_end(user_id)
+                return vector_set
+
+        vector_set = self._load(user_id)
+        with self._lock:
+            self._users[user_id] = vector_set
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_resident_users:
+                self._users.popitem(last=False)
+        return vector_set
+
+    def _knowledge_vectors(self) -> VectorSet:
+        self._sync_knowledge_if_due()
+        with self._lock:
+            if self._knowledge is None:
+                self._knowledge = self._load(None)
+            return self._knowledge
+
+    def _sync_knowledge_if_due(self):
+        synced_at = self._knowledge_synced_at
+        if synced_at is None or time.monotonic() - synced_at >= self.knowledge_sync_interval:
+            self.sync_knowledge()
+
+    def _load(self, user_id: Optional[str]) -> VectorSet:
+        rows = self.repository.get_memory_embeddings(user_id)
+        vector_set = VectorSet(self.embedder.dim, capacity=max(len(rows), 64))
+        expected_bytes = self.embedder.dim * 4
+        rows = [row for row in rows if len(row["vector"]) == expected_bytes]  # ignora vetores de outro embedder
+        if rows:
+            vectors = np.frombuffer(b"".join(row["vector"] for row in rows), dtype=np.float32)
+            vector_set.append(vectors.reshape(len(rows), self.embedder.dim), [self._item(row) for row in rows])
+        return vector_set
+
+    @staticmethod
+    def _item(row: Dict[str, Any]) -> Dict[str, Any]:
+        return {"source": row["source"], "source_id": row.get("source_id"), "content": row["content"],
+                "created_at": row.get("created_at")}
+
+
+def _knowledge_batches(knowledge_items: Iterable[Dict], chunk_size: int) -> Iterator[Tuple[List[Dict], List[str]]]:
+    """Divide os itens (inclusive de geradores) em lotes de ``chunk_size``, com as chaves válidas de cada um.
+
+    Itens sem key/value seguem no lote para o repositório contá-los como
+    ignorados, mas não entram nas chaves a vetorizar.
+    """
+    batch: List[Dict] = []
+    for item in knowledge_items:
+        batch.append(item)
+        if len(batch) >= chunk_size:
+            yield batch, _valid_keys(batch)
+            batch = []
+    if batch:
+        yield batch, _valid_keys(batch)
+
+
+def _valid_keys(batch: List[Dict]) -> List[str]:
+    # Mesma validação de repository._knowledge_chunks
+    return [item.get("key") for item in batch if item.get("key") and item.get("value")]
+
+
+def _add_counts(total: Dict[str, int], counts: Dict[str, int]):
+    for name, value in counts.items():
+        total[name] = total.get(name, 0) + value
+
+
+class _SemanticRepositoryBase:
+    def __init__(self, repository, semantic_memory: SemanticMemory):
+        self.repository = repository
+        self.semantic_memory = semantic_memory
+
+    def __getattr__(self, name):
+        # Demais métodos vão direto para o repositório
+        return getattr(self.repository, name)
+
+
+class SemanticRepository(_SemanticRepositoryBase):
+    """Repassa ao repositório e mantém os vetores da base de conhecimento em dia.
+
+    Fica na frente do repositório do agente (como ``CachedRepository``):
+    conhecimentos gravados ou alterados são vetorizados logo em seguida, e os
+    apagados (e usuários removidos) saem na hora do banco de vetores, das
+    matrizes em memória e do índice aproximado.
+    """
+
+    def add_knowledge(self, key: str, value: str, category: str = None):
+        result = self.repository.add_knowledge(key, value, category)
+        self.semantic_memory.remember_knowledge([key])
+        return result
+
+    def update_knowledge(self, key: str, value: str, category: str = None):
+        updated = self.repository.update_knowledge(key, value, category)
+        if updated:
+            self.semantic_memory.remember_knowledge([key])
+        return updated
+
+    def bulk_add_knowledge(self, knowledge_items: List[Dict]) -> int:
+        return self.bulk_upsert_knowledge(knowledge_items)["inserted"]
+
+    def bulk_upsert_knowledge(self, knowledge_items: Iterable[Dict],
+                              chunk_size: int = KNOWLEDGE_CHUNK_SIZE) -> Dict[str, int]:
+        """Grava lote a lote e vetoriza cada lote logo depois (memória constante com geradores)"""
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        for batch, keys in _knowledge_batches(knowledge_items, chunk_size):
+            _add_counts(counts, self.repository.bulk_upsert_knowledge(batch, chunk_size=chunk_size))
+            self.semantic_memory.remember_knowledge(keys)
+        return counts
+
+    def delete_knowledge(self, key: str) -> bool:
+        ids = self.semantic_memory.knowledge_ids([key])
+        deleted = self.repository.delete_knowledge(key)
+        if deleted:
+            self.semantic_memory.forget_knowledge(ids)
+        return deleted
+
+    def delete_knowledge_by_category(self, category: str) -> int:
+        ids = self.semantic_memory.knowledge_ids(category=category)
+        deleted = self.repository.delete_knowledge_by_category(category)
+        self.semantic_memory.forget_knowledge(ids)
+        return deleted
+
+    def delete_user(self, user_id: str) -> int:
+        ids = [row["id"] for row in self.repository.get_memory_embeddings(user_id)]
+        deleted = self.repository.delete_user(user_id)  # também apaga os vetores do banco
+        self.semantic_memory.forget_user(user_id, ids)
+        return deleted
+
+
+class AsyncSemanticRepository(_SemanticRepositoryBase):
+    """``SemanticRepository`` na frente de um repositório assíncrono.
+
+    A memória semântica usa um repositório síncrono; as chamadas a ela rodam
+    em threads via ``asyncio.to_thread``.
+    """
+
+    async def add_knowledge(self, key: str, value: str, category: str = None):
+        result = await self.repository.add_knowledge(key, value, category)
+        await asyncio.to_thread(self.semantic_memory.remember_knowledge, [key])
+        return result
+
+    async def update_knowledge(self, key: str, value: str, category: str = None):
+        updated = await self.repository.update_knowledge(key, value, category)
+        if updated:
+            await asyncio.to_thread(self.semantic_memory.remember_knowledge, [key])
+        return updated
+
+    async def bulk_add_knowledge(self, knowledge_items: List[Dict]) -> int:
+        return (await self.bulk_upsert_knowledge(knowledge_items))["inserted"]
+
+    async def bulk_upsert_knowledge(self, knowledge_items: Iterable[Dict],
+                                    chunk_size: int = KNOWLEDGE_CHUNK_SIZE) -> Dict[str, int]:
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        for batch, keys in _knowledge_batches(knowledge_items, chunk_size):
+            _add_counts(counts, await self.repository.bulk_upsert_knowledge(batch, chunk_size=chunk_size))
+            await asyncio.to_thread(self.semantic_memory.remember_knowledge, keys)
+        return counts
+
+    async def delete_knowledge(self, key: str) -> bool:
+        ids = await asyncio.to_thread(self.semantic_memory.knowledge_ids, [key])
+        deleted = await self.repository.delete_knowledge(key)
+        if deleted:
+            await asyncio.to_thread(self.semantic_memory.forget_knowledge, ids)
+        return deleted
+
+    async def delete_knowledge_by_category(self, category: str) -> int:
+        ids = await asyncio.to_thread(self.semantic_memory.knowledge_ids, category=category)
+        deleted = await self.repository.delete_knowledge_by_category(category)
+        await asyncio.to_thread(self.semantic_memory.forget_knowledge, ids)
+        return deleted
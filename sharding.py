@@ -0,0 +1,344 @@
+"""Repositório particionado por usuário em vários bancos (hash consistente).
+
+``ShardedRepository`` tem a interface do ``MemoryRepository`` e distribui os
+usuários entre N bancos (``DatabaseConfig`` ou URLs) com um anel de hash
+consistente sobre o ``user_id``:
+
+- operações de um usuário (mensagens, perfil, resumos, limpeza) vão para o
+  shard dele; cada shard tem o esquema completo;
+- estado global (base de conhecimento, fila de consolidação, cache do LLM) fica
+  no ``primary``; com ``replicate_knowledge=True`` as escritas na base de
+  conhecimento vão para todos os shards (as leituras continuam no primário);
+- a retenção percorre todos os shards.
+
+A memória semântica não é particionada (os ids dos vetores colidem entre
+bancos) e não está disponível no repositório particionado.
+
+Ao adicionar shards, só os usuários cujo ponto no anel mudou de dono precisam
+sair do lugar (~1/N); ``rebalance`` os move. Localmente, N arquivos SQLite:
+
+Uso: python sharding.py --shard s0=sqlite:///s0.db --shard s1=sqlite:///s1.db --shard s2=sqlite:///s2.db
+                        [--retire s3=sqlite:///s3.db] [--dry-run]
+"""
+import argparse
+import bisect
+import hashlib
+import heapq
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+from db import DatabaseConfig
+from repository import MemoryRepository
+
+# Métodos cujo primeiro argumento é o user_id: executados no shard do usuário
+USER_METHODS = (
+    "get_or_create_user_profile", "update_user_profile", "add_message", "get_recent_messages",
+    "add_conversation_summary", "get_conversation_summaries", "get_summary_watermark", "get_messages_since",
+    "get_unsummarized_message_count", "get_active_summaries", "roll_up_summaries", "get_user_profile_dict",
+    "cleanup_old_messages", "get_message_count", "export_user", "delete_user",
+)
+
+# Estado global, mantido no shard primário
+PRIMARY_METHODS = (
+    "get_knowledge", "get_knowledge_by_category", "get_all_knowledge", "iter_knowledge", "search_knowledge",
+    "enqueue_consolidation_job", "claim_consolidation_job", "complete_consolidation_job",
+    "fail_consolidation_job", "requeue_running_consolidation_jobs", "get_pending_consolidation_count",
+    "get_llm_cache_entry", "put_llm_cache_entry", "get_llm_cache_vectors", "evict_llm_cache",
+)
+
+# Escritas na base de conhecimento: primário ou, com replicação, todos os shards
+KNOWLEDGE_WRITE_METHODS = (
+    "add_knowledge", "update_knowledge", "delete_knowledge", "bulk_add_knowledge", "bulk_upsert_knowledge",
+    "delete_knowledge_by_category",
+)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Anel de hash consistente com ``vnodes`` pontos virtuais por shard"""
+
+    def __init__(self, shards: Iterable[str] = (), vnodes: int = 64):
+        self.vnodes = vnodes
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for shard in shards:
+            self.add(shard)
+
+    def add(self, shard: str):
+        for replica in range(self.vnodes):
+            point = _hash(f"{shard}#{replica}")
+            position = bisect.bisect_left(self._points, point)
+            self._points.insert(position, point)
+            self._owners.insert(position, shard)
+
+    def remove(self, shard: str):
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != shard]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def shard_for(self, key: str) -> str:
+        if not self._points:
+            raise ValueError("Anel de shards vazio")
+        position = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[position]
+
+    @property
+    def shards(self) -> List[str]:
+        return sorted(set(self._owners))
+
+
+def _route_to_user_shard(name: str) -> Callable:
+    def method(self, user_id: str, *args, **kwargs):
+        return getattr(self.repository_for(user_id), name)(user_id, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = f"``{name}`` no shard do usuário"
+    return method
+
+
+def _route_to_primary(name: str) -> Callable:
+    def method(self, *args, **kwargs):
+        return getattr(self.primary, name)(*args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = f"``{name}`` no shard primário"
+    return method
+
+
+def _route_knowledge_write(name: str) -> Callable:
+    def method(self, *args, **kwargs):
+        if not self.replicate_knowledge:
+            return getattr(self.primary, name)(*args, **kwargs)
+        # Geradores são consumidos uma vez só: materializa antes de replicar
+        args = tuple(list(arg) if not isinstance(arg, (str, bytes, dict, list)) and hasattr(arg, "__iter__")
+                     else arg for arg in args)
+        result = getattr(self.primary, name)(*args, **kwargs)
+        for shard, repository in self.repositories.items():
+            if shard != self.primary_name:
+                getattr(repository, name)(*args, **kwargs)
+        return result
+    method.__name__ = name
+    method.__doc__ = f"``{name}`` no primário (e nos demais shards, com replicação)"
+    return method
+
+
+class ShardedRepository:
+    """``MemoryRepository`` distribuído em vários bancos por ``user_id``.
+
+    ``shards`` mapeia um nome estável para o banco (``DatabaseConfig`` ou URL);
+    o anel usa os nomes, então trocar a URL de um shard não move usuários.
+    ``repository_factory`` cria o repositório de cada shard (ex.:
+    ``WriteBehindRepository``).
+    """
+
+    def __init__(self, shards: Mapping[str, Union[str, DatabaseConfig]], primary: str = None,
+                 replicate_knowledge: bool = False, vnodes: int = 64,
+                 repository_factory: Callable[[DatabaseConfig], Any] = MemoryRepository):
+        if not shards:
+            raise ValueError("Informe ao menos um shard")
+        self.configs = {name: config if isinstance(config, DatabaseConfig) else DatabaseConfig(config)
+                        for name, config in shards.items()}
+        self.repositories = {name: repository_factory(config) for name, config in self.configs.items()}
+        self.primary_name = primary or next(iter(self.configs))
+        if self.primary_name not in self.repositories:
+            raise ValueError(f"Shard primário desconhecido: {self.primary_name}")
+        self.primary = self.repositories[self.primary_name]
+        self.config = self.configs[self.primary_name]
+        self.replicate_knowledge = replicate_knowledge
+        self.ring = HashRing(self.configs, vnodes)
+
+    def shard_for(self, user_id: str) -> str:
+        return self.ring.shard_for(user_id)
+
+    def repository_for(self, user_id: str):
+        return self.repositories[self.ring.shard_for(user_id)]
+
+    def __getattr__(self, name: str):
+        raise AttributeError(f"ShardedRepository não oferece {name!r} "
+                             "(memória semântica e índices por id não são particionados)")
+
+    # ========== CICLO DE VIDA ==========
+
+    def create_tables(self) -> bool:
+        """Cria o esquema em todos os shards; retorna se o primário tem índice full-text"""
+        fulltext = {name: repository.create_tables() for name, repository in self.repositories.items()}
+        return fulltext[self.primary_name]
+
+    def flush(self):
+        for repository in self.repositories.values():
+            flush = getattr(repository, "flush", None)
+            if flush is not None:
+                flush()
+
+    def close(self):
+        for repository in self.repositories.values():
+            close = getattr(repository, "close", None)
+            if close is not None:
+                close()
+
+    def dispose(self):
+        for repository in self.repositories.values():
+            repository.dispose()
+
+    # ========== RETENÇÃO (TODOS OS SHARDS) ==========
+
+    def get_users_over_message_cap(self, max_messages: int, after_user_id: str = "",
+                                   limit: int = 500) -> List[str]:
+        """Usuários acima do limite em todos os shards, na ordem global de id"""
+        pages = [repository.get_users_over_message_cap(max_messages, after_user_id, limit)
+                 for repository in self.repositories.values()]
+        return list(heapq.merge(*pages))[:limit]
+
+    def prune_messages_over_cap(self, user_ids: List[str], keep_last: int,
+                                archive: Callable[[List[Dict[str, Any]]], None] = None) -> Dict[str, int]:
+        pruned: Dict[str, int] = {}
+        for shard, shard_user_ids in self._group_by_shard(user_ids).items():
+            pruned.update(self.repositories[shard].prune_messages_over_cap(shard_user_ids, keep_last, archive))
+        return pruned
+
+    def prune_expired_messages(self, before, after_id: Union[int, Tuple[int, int]] = 0, limit: int = 5000,
+                               archive: Callable[[List[Dict[str, Any]]], None] = None
+                               ) -> Tuple[Dict[str, int], Optional[Tuple[int, int]]]:
+        """Como no ``MemoryRepository``, shard por shard: o cursor é (índice do shard, id)"""
+        shard_index, shard_after_id = after_id if isinstance(after_id, tuple) else (0, after_id)
+        repositories = list(self.repositories.values())
+        while shard_index < len(repositories):
+            pruned, next_id = repositories[shard_index].prune_expired_messages(
+                before, shard_after_id, limit, archive)
+            if next_id is not None:
+                return pruned, (shard_index, next_id)
+            shard_index, shard_after_id = shard_index + 1, 0
+            if pruned:
+                return pruned, (shard_index, 0) if shard_index < len(repositories) else None
+        return {}, None
+
+    def _group_by_shard(self, user_ids: Iterable[str]) -> Dict[str, List[str]]:
+        groups: Dict[str, List[str]] = {}
+        for user_id in user_ids:
+            groups.setdefault(self.ring.shard_for(user_id), []).append(user_id)
+        return groups
+
+    def iter_messages(self, user_id: str = None, after_id: int = 0, limit: Optional[int] = None,
+                      page_size: int = 1000):
+        """Mensagens de um usuário (no shard dele) ou, sem ``user_id``, de todos os shards em sequência.
+
+        Os ids são de cada banco: sem ``user_id``, o cursor ``after_id`` não é suportado.
+        """
+        if user_id is not None:
+            yield from self.repository_for(user_id).iter_messages(user_id, after_id, limit, page_size)
+            return
+        if after_id:
+            raise ValueError("after_id exige user_id: os ids das mensagens são de cada shard")
+        remaining = limit
+        for repository in self.repositories.values():
+            for message in repository.iter_messages(None, 0, remaining, page_size):
+                yield message
+                if remaining is not None:
+                    remaining -= 1
+            if remaining is not None and remaining <= 0:
+                return
+
+    # ========== REBALANCEAMENTO ==========
+
+    def rebalance(self, retired: Mapping[str, Union[str, DatabaseConfig]] = None, batch_size: int = 500,
+                  dry_run: bool = False) -> Dict[str, int]:
+        """Move para o shard certo (segundo o anel atual) cada usuário que está em outro.
+
+        ``retired`` são shards que saíram do anel e devem ser esvaziados. Cada
+        usuário é copiado para o destino (substituindo cópias de uma execução
+        interrompida) e só então removido da origem; rode sem tráfego de escrita.
+        Com replicação, a base de conhecimento do primário é copiada para todos.
+        """
+        sources = dict(self.repositories)
+        retired_repositories = {name: MemoryRepository(config if isinstance(config, DatabaseConfig)
+                                                       else DatabaseConfig(config))
+                                for name, config in (retired or {}).items()}
+        sources.update(retired_repositories)
+        stats = {"scanned": 0, "moved": 0, "messages": 0, "knowledge": 0}
+        try:
+            for shard, repository in sources.items():
+                after_user_id = ""
+                while True:
+                    user_ids = repository.get_user_ids(after_user_id, batch_size)
+                    if not user_ids:
+                        break
+                    after_user_id = user_ids[-1]
+                    stats["scanned"] += len(user_ids)
+                    for user_id in user_ids:
+                        target = self.ring.shard_for(user_id)
+                        if target == shard:
+                            continue
+                        stats["moved"] += 1
+                        if dry_run:
+                            continue
+                        data = repository.export_user(user_id)
+                        if data is None:
+                            continue
+                        stats["messages"] += self.repositories[target].import_user(data)
+                        repository.delete_user(user_id)
+
+            if self.replicate_knowledge and not dry_run:
+                for shard, repository in self.repositories.items():
+                    if shard != self.primary_name:
+                        counts = repository.bulk_upsert_knowledge(self.primary.iter_knowledge())
+                        stats["knowledge"] = counts["inserted"] + counts["updated"]
+        finally:
+            for repository in retired_repositories.values():
+                repository.dispose()
+        return stats
+
+    def shard_stats(self) -> Dict[str, int]:
+        """Usuários por shard"""
+        counts = {}
+        for shard, repository in self.repositories.items():
+            total, after_user_id = 0, ""
+            while user_ids := repository.get_user_ids(after_user_id, 10000):
+                total += len(user_ids)
+                after_user_id = user_ids[-1]
+            counts[shard] = total
+        return counts
+
+
+for _name in USER_METHODS:
+    setattr(ShardedRepository, _name, _route_to_user_shard(_name))
+for _name in PRIMARY_METHODS:
+    setattr(ShardedRepository, _name, _route_to_primary(_name))
+for _name in KNOWLEDGE_WRITE_METHODS:
+    setattr(ShardedRepository, _name, _route_knowledge_write(_name))
+
+
+def _parse_shard(value: str) -> Tuple[str, str]:
+    name, separator, url = value.partition("=")
+    if not separator or not name or not url:
+        raise argparse.ArgumentTypeError(f"Use nome=url: {value}")
+    return name, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shard", type=_parse_shard, action="append", required=True,
+                        help="Shard do anel (nome=url); o primeiro é o primário")
+    parser.add_argument("--retire", type=_parse_shard, action="append", default=[],
+                        help="Shard que sai do anel e deve ser esvaziado (nome=url)")
+    parser.add_argument("--replicate-knowledge", action="store_true",
+                        help="Copia a base de conhecimento do primário para todos os shards")
+    parser.add_argument("--dry-run", action="store_true", help="Só conta os usuários que seriam movidos")
+    args = parser.parse_args()
+
+    repository = ShardedRepository(dict(args.shard), replicate_knowledge=args.replicate_knowledge)
+    try:
+        stats = repository.rebalance(retired=dict(args.retire), dry_run=args.dry_run)
+        action = "seriam movidos" if args.dry_run else "movidos"
+        print(f"Usuários verificados: {stats['scanned']} | {action}: {stats['moved']} | "
+              f"mensagens copiadas: {stats['messages']}")
+        if stats["knowledge"]:
+            print(f"Base de conhecimento replicada: {stats['knowledge']} itens por shard")
+        print(f"{'shard':>10} | {'usuários':>9}")
+        for shard, users in repository.shard_stats().items():
+            print(f"{shard:>10} | {users:>9}")
+    finally:
+        repository.dispose()
+
+
+if __name__ == "__main__":
+    main()
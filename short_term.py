@@ -0,0 +1,127 @@
+from collections import OrderedDict, deque
+import threading
+from typing import Callable, Dict, List, Optional
+
+
+class ShortTermMemory:
+    """Memória de curto prazo particionada por usuário.
+
+    Cada usuário tem seu próprio buffer circular (deque com maxlen), então um
+    usuário muito ativo não expulsa o contexto dos demais. O número de usuários
+    residentes é limitado por uma política LRU; ao acessar um usuário que não
+    está em memória, o buffer é reidratado a partir do banco via ``loader``.
+    As operações são protegidas por lock, pois a consolidação em segundo plano
+    pode ler a memória a partir de outras threads; a reidratação (consulta ao
+    banco) acontece fora dele.
+    """
+
+    def __init__(self, per_user_limit: int = 10, max_resident_users: int = 1000,
+                 loader: Optional[Callable[[str, int], List[Dict]]] = None):
+        if per_user_limit <= 0:
+            raise ValueError("per_user_limit deve ser maior que zero")
+        if max_resident_users <= 0:
+            raise ValueError("max_resident_users deve ser maior que zero")
+
+        self.per_user_limit = per_user_limit
+        self.max_resident_users = max_resident_users
+        self.loader = loader
+        self._buffers: "OrderedDict[str, deque]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _get_buffer(self, user_id: str, create: bool = True) -> deque:
+        """Retorna o buffer do usuário, reidratando do banco se necessário (O(1) em hit).
+
+        A leitura do banco roda fora do lock, para que um usuário frio não
+        bloqueie o histórico dos demais; se outra thread carregar o mesmo
+        usuário nesse meio-tempo, o buffer dela é mantido. Sem ``loader``, uma
+        leitura (``create=False``) de um usuário não residente devolve um
+        buffer vazio avulso: inseri-lo faria o usuário parecer residente e
+        impediria a reidratação externa (ex.: via ``load``).
+        """
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            if buffer is not None:
+                self._buffers.move_to_end(user_id)
+                return buffer
+            if self.loader is None and not create:
+                return deque()
+
+        # Cópias em dict: o repositório devolve MessageRecord (imutável) e o contexto
+        # guarda a contagem de tokens na própria mensagem
+        messages = [dict(msg) for msg in self.loader(user_id, self.per_user_limit)] if self.loader else []
+
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            if buffer is None:
+                buffer = self._buffers[user_id] = deque(messages, maxlen=self.per_user_limit)
+            self._buffers.move_to_end(user_id)
+            # Remove usuários menos recentemente usados além do orçamento
+            while len(self._buffers) > self.max_resident_users:
+                self._buffers.popitem(last=False)
+            return buffer
+
+    def load(self, user_id: str, messages: List[Dict]):
+        """Carrega mensagens já buscadas (ex.: por um repositório assíncrono) para o usuário"""
+        with self._lock:
+            buffer = deque((dict(msg) for msg in messages), maxlen=self.per_user_limit)
+            self._buffers[user_id] = buffer
+            self._buffers.move_to_end(user_id)
+            while len(self._buffers) > self.max_resident_users:
+                self._buffers.popitem(last=False)
+
+    def append(self, user_id: str, message: Dict):
+        """Adiciona mensagem ao buffer do usuário"""
+        buffer = self._get_buffer(user_id)
+        with self._lock:
+            buffer.append(message)
+
+    def get(self, user_id: str) -> List[Dict]:
+        """Retorna as mensagens em memória do usuário, da mais antiga para a mais recente"""
+        buffer = self._get_buffer(user_id, create=False)
+        with self._lock:
+            return list(buffer)
+
+    def recent(self, user_id: str, n: int) -> List[Dict]:
+        """Retorna as últimas ``n`` mensagens do usuário (O(n))"""
+        buffer = self._get_buffer(user_id, create=False)
+        with self._lock:
+            if n <= 0:
+                return []
+            start = max(len(buffer) - n, 0)
+            return [buffer[i] for i in range(start, len(buffer))]
+
+    def count(self, user_id: str) -> int:
+        """Número de mensagens em memória para o usuário"""
+        buffer = self._get_buffer(user_id, create=False)
+        with self._lock:
+            return len(buffer)
+
+    def compress(self, user_id: str, keep_last: int = 5):
+        """Mantém apenas as últimas ``keep_last`` mensagens do usuário"""
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            if buffer is None:
+                return
+            while len(buffer) > keep_last:
+                buffer.popleft()
+
+    def evict(self, user_id: str):
+        """Remove o usuário da memória residente"""
+        with self._lock:
+            self._buffers.pop(user_id, None)
+
+    def clear(self):
+        """Remove todos os usuários da memória"""
+        with self._lock:
+            self._buffers.clear()
+
+    def resident_users(self) -> List[str]:
+        """Usuários atualmente em memória, do menos para o mais recentemente usado"""
+        with self._lock:
+            return list(self._buffers.keys())
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._buffers
+
+    def __len__(self) -> int:
+        return len(self._buffers)
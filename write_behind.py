@@ -0,0 +1,318 @@
+import atexit
+import json
+import threading
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, List
+
+from sqlalchemy import bindparam, func, update
+
+from db import DatabaseConfig
+import instrumentation
+from models import UserProfile
+from repository import MemoryRepository, writes
+
+
+class WriteBehindRepository(MemoryRepository):
+    """MemoryRepository com gravação adiada (write-behind) de mensagens.
+
+    ``add_message`` apenas acumula a mensagem em memória; um thread de fundo
+    grava os lotes com ``executemany`` quando o buffer atinge ``flush_size``
+    mensagens ou a cada ``flush_interval`` segundos, e ``close()`` (também
+    registrado no ``atexit``) grava o que restar. Leituras de mensagens de um
+    usuário com gravações pendentes descarregam o buffer antes, garantindo
+    read-your-writes.
+
+    Mensagens ainda no buffer se perdem se o processo morrer sem ``close()``;
+    use apenas onde essa janela (no máximo ``flush_interval``) é aceitável.
+    Se a gravação de um lote falhar, as mensagens são regravadas uma a uma (as
+    boas entram; as que falham voltam para o início do buffer) e o thread de
+    fundo espera mais a cada falha seguida (até ``max_flush_backoff``). Uma
+    mensagem que falha ``max_flush_attempts`` vezes vai para ``dead_letters``
+    em vez de travar o buffer para sempre.
+
+    Os contadores por usuário ficam em memória (LRU) para ``add_message`` não
+    ler o banco a cada mensagem; depois de cada gravação, passam de
+    ``max_cached_counters`` só usuários sem mensagens pendentes são descartados.
+    """
+
+    def __init__(self, config: DatabaseConfig, flush_size: int = 500, flush_interval: float = 0.5,
+                 max_pending: int = 10000, max_cached_counters: int = 10000, max_flush_attempts: int = 10,
+                 max_flush_backoff: float = 60.0, max_dead_letters: int = 10000):
+        super().__init__(config)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_cached_counters = max_cached_counters
+        self.max_flush_attempts = max_flush_attempts
+        self.max_flush_backoff = max_flush_backoff
+        # (mensagem, erro) descartadas depois de max_flush_attempts falhas
+        self.dead_letters: deque = deque(maxlen=max_dead_letters)
+        self._attempts: Dict[int, int] = {}  # id(mensagem pendente) -> falhas de gravação
+        self._consecutive_failures = 0
+
+        self._pending: List[Dict[str, Any]] = []
+        self._pending_users: Counter = Counter()
+        self._in_flight_users: Counter = Counter()  # do lote sendo gravado (ainda sem commit)
+        # user_id -> [message_count, unsummarized_count], do menos para o mais recente
+        self._counters: "OrderedDict[str, List[int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        table = UserProfile.__table__
+        self._counter_bulk_update_stmt = update(table)\
+            .where(table.c.id == bindparam("user_id"))\
+            .values(
+                message_count=func.coalesce(table.c.message_count, 0) + bindparam("n"),
+                unsummarized_count=func.coalesce(table.c.unsummarized_count, 0) + bindparam("n"),
+                last_interaction=bindparam("now")
+            )
+
+        # SQLite em memória tem um banco por thread: sem thread de fundo, o lote
+        # é gravado pelo próprio chamador ao atingir flush_size
+        url = self.engine.url
+        in_memory = url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+        self._flusher = None
+        if not in_memory:
+            self._flusher = threading.Thread(target=self._flush_loop, name="write-behind-flusher", daemon=True)
+            self._flusher.start()
+        atexit.register(self.close)
+
+    # ========== GRAVAÇÃO ==========
+
+    def _load_counters(self, user_id: str) -> List[int]:
+        with self.get_session() as session:
+            row = session.execute(self._counter_select_stmt, {"user_id": user_id}).first()
+        return [row[0] or 0, row[1] or 0] if row else [0, 0]
+
+    @writes()
+    def add_message(self, user_id: str, role: str, content: str, metadata: Dict[str, Any] = None) -> Dict[str, int]:
+        """Acumula a mensagem no buffer e devolve os contadores já incluindo as pendentes.
+
+        ``message_id`` é None: o id só existe depois que o lote é gravado.
+        """
+        counters = self._counters.get(user_id)
+        if counters is None:
+            counters = self._load_counters(user_id)
+
+        now = datetime.now()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("WriteBehindRepository já foi fechado")
+            counters = self._counters.setdefault(user_id, counters)
+            self._counters.move_to_end(user_id)
+            counters[0] += 1
+            counters[1] += 1
+            self._pending.append({
+                "user_id": user_id,
+                "role": role,
+                "content": content,
+                "timestamp": now,
+                "message_metadata": json.dumps(metadata) if metadata else None
+            })
+            self._pending_users[user_id] += 1
+            pending = len(self._pending)
+            result = {"message_id": None, "message_count": counters[0], "unsummarized_count": counters[1]}
+
+        if pending >= self.max_pending or (pending >= self.flush_size and self._flusher is None):
+            # Sem thread de fundo, ou com ele atrasado (backpressure), grava no chamador
+            self.flush()
+        elif pending >= self.flush_size:
+            self._wakeup.set()
+        return result
+
+    def flush(self) -> int:
+        """Grava todas as mensagens pendentes em uma transação; retorna quantas foram gravadas"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                per_user, self._pending_users = self._pending_users, Counter()
+                self._in_flight_users = per_user
+            if not batch:
+                return 0
+
+            try:
+                self._write(batch, per_user)
+            except Exception as e:
+                print(f" Error flushing {len(batch)} buffered messages: {str(e)}")
+                failed = self._write_one_by_one(batch) if len(batch) > 1 else [(batch[0], e)]
+                self._requeue_or_dead_letter(failed)
+                self._consecutive_failures = self._consecutive_failures + 1 if failed else 0
+                if any(id(row) in self._attempts for row, _ in failed):
+                    raise
+                self._trim_counters()
+                return len(batch) - len(failed)
+            else:
+                self._consecutive_failures = 0
+                for row in batch:
+                    self._attempts.pop(id(row), None)
+            finally:
+                with self._lock:
+                    self._in_flight_users = Counter()
+            self._trim_counters()
+            return len(batch)
+
+    def _write(self, batch: List[Dict[str, Any]], per_user: Counter):
+        """Grava mensagens e contadores em uma transação"""
+        now = datetime.now()
+        users = [{"user_id": user_id, "now": now} for user_id in per_user]
+        with self.get_session() as session:
+            connection = session.connection()
+            if self._profile_insert_stmt is not None:
+                connection.execute(self._profile_insert_stmt, users)
+            else:
+                for user in users:
+                    self._ensure_profile(session, user["user_id"])
+            connection.execute(self._message_insert_stmt, batch)
+            connection.execute(self._counter_bulk_update_stmt, [
+                {"user_id": user_id, "n": count, "now": now} for user_id, count in per_user.items()
+            ])
+            session.commit()
+
+    def _write_one_by_one(self, batch: List[Dict[str, Any]]) -> List[tuple]:
+        """Regrava um lote que falhou mensagem a mensagem; retorna as que falharam, com o erro"""
+        failed = []
+        for row in batch:
+            try:
+                self._write([row], Counter({row["user_id"]: 1}))
+            except Exception as e:
+                failed.append((row, e))
+            else:
+                self._attempts.pop(id(row), None)
+        return failed
+
+    def _requeue_or_dead_letter(self, failed: List[tuple]):
+        """Devolve ao início do buffer as mensagens que falharam; descarta as que esgotaram as tentativas"""
+        retry, dead = [], []
+        for row, error in failed:
+            attempts = self._attempts.pop(id(row), 0) + 1
+            if attempts >= self.max_flush_attempts:
+                dead.append((row, str(error)))
+            else:
+                self._attempts[id(row)] = attempts
+                retry.append(row)
+        with self._lock:
+            self._pending = retry + self._pending
+            self._pending_users = Counter(row["user_id"] for row in retry) + self._pending_users
+        for row, error in dead:
+            # Os contadores em memória incluíam a mensagem descartada: relidos do banco
+            self._forget_counters(row["user_id"])
+            self.dead_letters.append((row, error))
+            print(f" Dropping buffered message of user {row['user_id']} after "
+                  f"{self.max_flush_attempts} failed writes: {error}")
+        if dead:
+            instrumentation.inc("memory_write_behind_dead_letters_total", len(dead))
+
+    def _trim_counters(self):
+        """Descarta os contadores mais antigos além de ``max_cached_counters``.
+
+        Só de usuários sem mensagens pendentes: os deles já estão no banco.
+        """
+        with self._lock:
+            excess = len(self._counters) - self.max_cached_counters
+            if excess <= 0:
+                return
+            idle = [user_id for user_id in self._counters if not self._pending_users.get(user_id)]
+            for user_id in idle[:excess]:
+                del self._counters[user_id]
+
+    def _flush_loop(self):
+        while not self._closed:
+            # Backoff exponencial enquanto as gravações falham
+            self._wakeup.wait(min(self.flush_interval * 2 ** self._consecutive_failures, self.max_flush_backoff))
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f" Error flushing buffered messages: {str(e)}")
+
+    def close(self):
+        """Para o thread de fundo e grava o que restar no buffer"""
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)  # o registro mantinha a instância viva até o fim do processo
+        self._wakeup.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval * 4)
+        self.flush()
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _flush_if_pending(self, user_id: str):
+        # Mensagens do usuário no lote em gravação também contam: flush() espera
+        # o commit desse lote (_flush_lock) antes de gravar o restante
+        with self._lock:
+            pending = self._pending_users.get(user_id) or self._in_flight_users.get(user_id)
+        if pending:
+            self.flush()
+
+    def _forget_counters(self, user_id: str):
+        """Descarta os contadores em cache; o banco os recalculou"""
+        with self._lock:
+            self._counters.pop(user_id, None)
+
+    # ========== LEITURAS COM READ-YOUR-WRITES ==========
+
+    def get_recent_messages(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        self._flush_if_pending(user_id)
+        return super().get_recent_messages(user_id, limit)
+
+    def get_messages_since(self, user_id: str, after_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+        self._flush_if_pending(user_id)
+        return super().get_messages_since(user_id, after_id, limit)
+
+    def get_message_count(self, user_id: str) -> int:
+        self._flush_if_pending(user_id)
+        return super().get_message_count(user_id)
+
+    def get_unsummarized_message_count(self, user_id: str) -> int:
+        self._flush_if_pending(user_id)
+        return super().get_unsummarized_message_count(user_id)
+
+    def iter_messages(self, user_id: str = None, after_id: int = 0, limit: int = None, page_size: int = 1000):
+        # Exportação: grava o buffer antes da primeira página
+        if user_id is None:
+            self.flush()
+        else:
+            self._flush_if_pending(user_id)
+        yield from super().iter_messages(user_id, after_id, limit, page_size)
+
+    # ========== OPERAÇÕES QUE RECALCULAM CONTADORES ==========
+
+    def add_conversation_summary(self, user_id: str, summary: str, message_count: int = 0,
+                                 start_message_id: int = None, end_message_id: int = None,
+                                 expected_watermark: int = None) -> bool:
+        self._flush_if_pending(user_id)
+        stored = super().add_conversation_summary(user_id, summary, message_count, start_message_id,
+                                                  end_message_id, expected_watermark)
+        self._forget_counters(user_id)
+        return stored
+
+    def cleanup_old_messages(self, user_id: str, keep_last: int = 50):
+        self._flush_if_pending(user_id)
+        deleted = super().cleanup_old_messages(user_id, keep_last)
+        self._forget_counters(user_id)
+        return deleted
+
+    def get_users_over_message_cap(self, max_messages: int, after_user_id: str = "", limit: int = 500) -> List[str]:
+        # O job de retenção decide pelos contadores do banco: o buffer precisa estar gravado
+        self.flush()
+        return super().get_users_over_message_cap(max_messages, after_user_id, limit)
+
+    def prune_messages_over_cap(self, user_ids: List[str], keep_last: int, archive=None) -> Dict[str, int]:
+        self.flush()
+        pruned = super().prune_messages_over_cap(user_ids, keep_last, archive)
+        for user_id in pruned:
+            self._forget_counters(user_id)
+        return pruned
+
+    def prune_expired_messages(self, before: datetime, after_id: int = 0, limit: int = 5000, archive=None):
+        self.flush()
+        pruned, next_after_id = super().prune_expired_messages(before, after_id, limit, archive)
+        for user_id in pruned:
+            self._forget_counters(user_id)
+        return pruned, next_after_id